@@ -1,6 +1,7 @@
 import dash
 from dash import dcc, html, Input, Output, State, dash_table, ctx, no_update
 import dash_bootstrap_components as dbc
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import threading
@@ -8,10 +9,26 @@ import time
 import requests 
 import psycopg2 
 import json
+import logging
 import os
 import webbrowser  # ✅ CORRECTION : Import déplacé en haut
 from datetime import datetime
 
+import instrumentation
+from instrumentation import mesurer_requete
+from crosstab import Croiseur, VARIABLES, vers_table
+from incidence import Incidence
+import nomenclature
+import communes
+from communes import AgregatCommunes
+import series
+from series import Series, GRAINS, DIMENSIONS, FENETRE_DEFAUT
+from recherche import Recherche
+from ecriture import FileEcriture, Instantane, transaction_courante
+import rapport
+
+logger = logging.getLogger("mdd")
+
 # =============================================================================
 # 1. CONFIGURATION & MAPPINGS
 # =============================================================================
@@ -19,31 +36,23 @@ COLOR_NAVY = "#003366"
 COLOR_GOLD = "#D4AF37"
 COLOR_BG = "#F4F6F9"
 
-TRANSCO_MODE = {1: "RDV", 2: "Sans RDV", 3: "Téléphone", 4: "Courrier", 5: "Mail"}
-TRANSCO_SEXE = {1: "Homme", 2: "Femme", 3: "Couple", 4: "Pro"}
-TRANSCO_AGE = {1: "-18 ans", 2: "18-25 ans", 3: "26-40 ans", 4: "41-60 ans", 5: "+ 60 ans"}
-TRANSCO_SIT = {"1": "Célibataire", "2": "Concubin", "3": "Pacsé", "4": "Marié", "5": "Séparé/Div", "5a": "Sép. s/s enf", "5b": "Sép. Alt", "5c": "Sép. Princ", "5d": "Sép. Visite", "5e": "Parent Isolé", "5f": "Sép. m. toit", "6": "Veuf/ve", "7": "Non Rens."}
-TRANSCO_VIENT = {1: "Soi", 2: "Conjoint", 3: "Parent", 4: "Enfant", 5: "Pers. Morale", 6: "Autre"}
-TRANSCO_PROF = {1: "Scolaire/Etu", 2: "Agri/Pêche", 3: "Chef Ent.", 4: "Libéral", 5: "Militaire", 6: "Employé", 7: "Ouvrier", 8: "Cadre", 9: "Retraité", 10: "Chômeur", 11: "Sans Prof."}
-TRANSCO_DUREE = {1: "- 15 min", 2: "15-30 min", 3: "30-45 min", 4: "45-60 min", 5: "+ 60 min"}
-TRANSCO_RESS = {1: "Salaire", 2: "Rev. Pro", 3: "Retraite", 4: "Chômage", 5: "RSA", 6: "AAH", 7: "IJSS", 8: "Bourse", 9: "Sans", 10: "Autre"}
-
-# Inversés pour la saisie (Texte -> Code BDD)
-REV_MODE = {v: k for k, v in TRANSCO_MODE.items()}
-REV_SEXE = {v: k for k, v in TRANSCO_SEXE.items()}
-REV_AGE = {v: k for k, v in TRANSCO_AGE.items()}
-REV_SIT = {v: k for k, v in TRANSCO_SIT.items()}
-REV_VIENT = {v: k for k, v in TRANSCO_VIENT.items()}
-REV_PROF = {v: k for k, v in TRANSCO_PROF.items()}
-REV_DUREE = {v: k for k, v in TRANSCO_DUREE.items()}
-REV_RESS = {v: k for k, v in TRANSCO_RESS.items()}
+# Listes déroulantes du formulaire alimentées par la nomenclature (id -> variable codée)
+CHAMPS_CODES = {'in-mode': 'mode', 'in-duree': 'duree', 'in-sexe': 'sexe', 'in-age': 'age', 'in-sit': 'sit_fam',
+                'in-mod-fam': 'modele_fam', 'in-vient': 'vient_pr', 'in-prof': 'profession', 'in-ress': 'ress', 'in-origine': 'origine'}
+
+def code_saisie(variable, valeur, defaut=None):
+    """ Valeur du snapshot ou du formulaire -> code BDD de la nomenclature (`defaut` si absent / inconnu). """
+    code = nomenclature.courante()[variable].valider(valeur)
+    return defaut if code is None else code
 
 # =============================================================================
 # 2. GESTION BASE DE DONNÉES
 # =============================================================================
 def get_db_connection():
     if 'DATABASE_URL' in os.environ:
-        return psycopg2.connect(os.environ['DATABASE_URL'], sslmode='require')
+        # SSL imposé, sauf si l'URL précise son propre sslmode (base locale de benchmark...)
+        url = os.environ['DATABASE_URL']
+        return psycopg2.connect(url) if 'sslmode' in url else psycopg2.connect(url, sslmode='require')
     
     if not os.path.exists('config.json'): return None
     config = json.load(open('config.json', 'r', encoding='utf-8'))
@@ -54,106 +63,137 @@ def load_data_from_db():
         conn = get_db_connection()
         if not conn: return pd.DataFrame()
         
+        instantane = Instantane.lire(conn)  # Avant les lectures : toute écriture visible ici l'est dans le snapshot
+        with mesurer_requete("load_nomenclature"):
+            nomenc = nomenclature.actualiser(conn)  # Recompilée seulement si MODALITE a changé
+        with mesurer_requete("load_communes"):
+            index_communes = communes.actualiser(conn)
         query = """
             SELECT e.num, e.date_ent, e.mode, e.duree, e.sexe, e.age, e.vient_pr, e.sit_fam, 
                    e.enfant, e.modele_fam, e.profession, e.ress, e.origine, 
-                   e.commune, e.partenaire,
-                   STRING_AGG(DISTINCT d.nature, ', ') as demande_txt,
-                   STRING_AGG(DISTINCT s.nature, ', ') as solution_txt
+                   e.commune, e.partenaire, e.code_c
             FROM entretien e
-            LEFT JOIN demande d ON e.num = d.num
-            LEFT JOIN solution s ON e.num = s.num
-            GROUP BY e.num
         """
-        df = pd.read_sql_query(query, conn)
+        with mesurer_requete("load_entretiens") as m:
+            df = pd.read_sql_query(query, conn)
+            m['lignes'], m['octets'] = len(df), int(df.memory_usage(deep=True).sum())
+        # Demandes / solutions : une ligne par (entretien, nature), sans agrégation texte
+        with mesurer_requete("load_natures") as m:
+            demandes = pd.read_sql_query("SELECT num, pos, nature FROM demande", conn)
+            solutions = pd.read_sql_query("SELECT num, pos, nature FROM solution", conn)
+            m['lignes'] = len(demandes) + len(solutions)
         conn.close()
+        instrumentation.incrementer("mdd_rechargements_total")
+        instrumentation.fixer("mdd_snapshot_lignes", len(df))
         
         if df.empty: return pd.DataFrame()
 
         df['date_ent'] = pd.to_datetime(df['date_ent'], errors='coerce')
-        df['Annee'] = df['date_ent'].apply(lambda x: str(x.year) if pd.notnull(x) else "Inconnue")
-        df['Mois'] = df['date_ent'].dt.strftime('%Y-%m')
-
-        df['Mode_Lib'] = df['mode'].map(TRANSCO_MODE).fillna('Autre')
-        df['Sexe_Lib'] = df['sexe'].map(TRANSCO_SEXE).fillna('Inc.')
-        df['Age_Lib'] = df['age'].map(TRANSCO_AGE).fillna('Inc.')
-        df['Sit_Lib'] = df['sit_fam'].astype(str).map(TRANSCO_SIT).fillna(df['sit_fam'])
-        df['Prof_Lib'] = df['profession'].map(TRANSCO_PROF).fillna('Autre')
+        df['Annee'] = series.libelles_annee(df['date_ent'])
+        df['Mois'] = series.libelles_mois(df['date_ent'])
+
+        df['Mode_Lib'] = nomenc['mode'].decoder(df['mode'], 'Autre')
+        df['Sexe_Lib'] = nomenc['sexe'].decoder(df['sexe'], 'Inc.')
+        df['Age_Lib'] = nomenc['age'].decoder(df['age'], 'Inc.')
+        df['Sit_Lib'] = nomenc['sit_fam'].decoder(df['sit_fam']).fillna(df['sit_fam'])
+        df['Prof_Lib'] = nomenc['profession'].decoder(df['profession'], 'Autre')
         
-        df.rename(columns={'commune': 'Ville', 'partenaire': 'Partenaire', 'num': 'id', 
-                           'demande_txt': 'Demandes', 'solution_txt': 'Solutions'}, inplace=True)
+        df.rename(columns={'commune': 'Ville', 'partenaire': 'Partenaire', 'num': 'id'}, inplace=True)
         
-        for col in ['Ville', 'Partenaire', 'modele_fam', 'Demandes', 'Solutions']:
+        for col in ['Ville', 'Partenaire']:
             df[col] = df[col].astype(str).str.strip().str.replace("''", "'").replace("nan", "").replace("None", "").replace("NULL", "")
 
-        return df.sort_values('date_ent', ascending=False)
-    except Exception as e:
-        print(f"❌ ERREUR SQL Load : {e}")
+        # Commune : CODE_C enregistré, sinon résolu en mémoire (saisies antérieures).
+        # 'Ville' garde le texte saisi (formulaire) ; 'Commune' porte le nom du référentiel (affichage, agrégats)
+        df['code_c'] = index_communes.completer(df['code_c'], df['Ville'])
+        noms = pd.Series(index_communes.noms(df['code_c']), index=df.index)
+        df['Commune'] = noms.where(noms.notna(), df['Ville'])
+        df['Agglo'] = index_communes.agglos(df['code_c'])
+
+        # Index = position dans le snapshot : c'est la clé de ligne des incidences
+        df = df.sort_values('date_ent', ascending=False, ignore_index=True)
+        df.attrs['demandes'] = Incidence.depuis_table(demandes, df['id'], nomenc['demande'].codes)
+        df.attrs['solutions'] = Incidence.depuis_table(solutions, df['id'], nomenc['solution'].codes)
+        df['Demandes'] = df.attrs['demandes'].textes(nomenc['demande'].en_dict())
+        df['Solutions'] = df.attrs['solutions'].textes(nomenc['solution'].en_dict())
+        df.attrs['communes'] = AgregatCommunes.depuis_snapshot(df)
+        df.attrs['instantane'] = instantane
+        return df
+    except Exception:
+        logger.exception("❌ ERREUR SQL Load")
         return pd.DataFrame()
 
+# Les écritures renvoient (succès, message, transaction) : le txid validé sert à rafraîchir le snapshot
 def delete_entretien_db(num_dossier):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("DELETE FROM demande WHERE num = %s", (num_dossier,))
-        cur.execute("DELETE FROM solution WHERE num = %s", (num_dossier,))
-        cur.execute("DELETE FROM entretien WHERE num = %s", (num_dossier,))
-        conn.commit()
+        with mesurer_requete("delete_entretien") as m:
+            cur.execute("DELETE FROM demande WHERE num = %s", (num_dossier,))
+            cur.execute("DELETE FROM solution WHERE num = %s", (num_dossier,))
+            cur.execute("DELETE FROM entretien WHERE num = %s", (num_dossier,))
+            transaction = transaction_courante(cur)
+            conn.commit()
+            m['lignes'] = 1
         conn.close()
-        return True, "Dossier supprimé."
+        return True, "Dossier supprimé.", transaction
     except Exception as e:
         if conn: conn.rollback()
-        return False, str(e)
+        return False, str(e), None
 
 def save_entretien_db(data, update_id=None):
+    # File d'écriture : les saisies simultanées sont validées par lots (une transaction par lot)
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        new_id = update_id
-
-        if update_id:
-            sql_update = """
-                UPDATE entretien SET date_ent=%s, mode=%s, duree=%s, sexe=%s, age=%s, vient_pr=%s, 
-                sit_fam=%s, enfant=%s, modele_fam=%s, profession=%s, ress=%s, origine=%s, commune=%s, partenaire=%s
-                WHERE num = %s
-            """
-            cur.execute(sql_update, (
-                data['date'], data['mode'], data['duree'], data['sexe'], data['age'], 
-                data['vient'], data['sit'], data['enfant'], data['mod_fam'], 
-                data['prof'], data['ress'], data['origine'], data['ville'], data['partenaire'],
-                update_id
-            ))
-            cur.execute("DELETE FROM demande WHERE num=%s", (update_id,))
-            cur.execute("DELETE FROM solution WHERE num=%s", (update_id,))
-        else:
-            sql_insert = """
-                INSERT INTO entretien (date_ent, mode, duree, sexe, age, vient_pr, sit_fam, 
-                                       enfant, modele_fam, profession, ress, origine, commune, partenaire)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING num;
-            """
-            cur.execute(sql_insert, (
-                data['date'], data['mode'], data['duree'], data['sexe'], data['age'], 
-                data['vient'], data['sit'], data['enfant'], data['mod_fam'], 
-                data['prof'], data['ress'], data['origine'], data['ville'], data['partenaire']
-            ))
-            new_id = cur.fetchone()[0]
-
-        if data['demande_txt']:
-            cur.execute(f"INSERT INTO demande (num, pos, nature) VALUES ({new_id}, 1, '{data['demande_txt'].replace("'", "''")}')")
-        if data['solution_txt']:
-            cur.execute(f"INSERT INTO solution (num, pos, nature) VALUES ({new_id}, 1, '{data['solution_txt'].replace("'", "''")}')")
-
-        conn.commit()
-        conn.close()
-        action = "modifié" if update_id else "créé"
-        return True, f"Dossier N°{new_id} {action} avec succès !"
+        resultat = ecritures.enregistrer(data, update_id)
+    except TimeoutError as e:
+        return False, str(e), None  # Annulée, ou encore en cours : pas une erreur SQL
     except Exception as e:
-        if conn: conn.rollback()
-        return False, f"Erreur SQL Save : {str(e)}"
+        return False, f"Erreur SQL Save : {str(e)}", None
+    action = "créé" if resultat.cree else "modifié"
+    return True, f"Dossier N°{resultat.num} {action} avec succès !", resultat.transaction
 
 # Chargement initial
 df_global = load_data_from_db()
+ecritures = FileEcriture(lambda: get_db_connection())
+_verrou_snapshot = threading.Lock()
+
+def jeton_rafraichissement(transaction):
+    """ Valeur de refresh-trigger : txid de l'écriture validée, sinon jeton horodaté (rechargement forcé). """
+    return transaction if transaction is not None else f"t{time.time()}"
+
+def synchroniser_snapshot(transaction=None):
+    """
+    Recharge df_global, sauf si l'instantané du snapshot voit déjà la transaction `transaction` (txid lu
+    en base : valable quel que soit le worker qui l'a validée). Les appels concurrents attendent le
+    rechargement en cours : un rechargement par écriture, partagé par les callbacks de refresh-trigger.
+    """
+    global df_global
+    with _verrou_snapshot:
+        instantane = df_global.attrs.get('instantane')
+        if isinstance(transaction, int) and instantane is not None and instantane.couvre(transaction): return
+        df_global = load_data_from_db()
+
+class DeriveSnapshot:
+    """ Objet construit sur le snapshot courant et reconstruit quand df_global est rechargé (clé : le snapshot lui-même). """
+    def __init__(self, construire):
+        self.construire = construire
+        self._snapshot = self._valeur = None
+        self._verrou = threading.Lock()
+
+    def __call__(self):
+        df = df_global
+        with self._verrou:
+            if self._valeur is None or self._snapshot is not df:
+                self._valeur, self._snapshot = self.construire(df), df
+            return self._valeur
+
+def _croiseur(df):
+    nomenc = nomenclature.courante()
+    return Croiseur(df, {col: nomenc[col].en_dict() for col in VARIABLES if col in nomenc})
+
+obtenir_croiseur = DeriveSnapshot(_croiseur)                                     # Index de croisement
+obtenir_series = DeriveSnapshot(lambda df: Series(df, get_db_connection))        # SERIE_ENTRETIEN (sinon snapshot)
+obtenir_recherche = DeriveSnapshot(lambda df: Recherche(df, get_db_connection))  # RECHERCHE_ENTRETIEN (sinon en mémoire)
 
 # =============================================================================
 # 3. INTERFACE DASH (SINGLE PAGE)
@@ -161,6 +201,7 @@ df_global = load_data_from_db()
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUX], suppress_callback_exceptions=True)
 app.title = "MDD Manager"
 server = app.server
+instrumentation.instrumenter(app)  # Métriques Prometheus sur /metrics + logs structurés
 
 # --- SIDEBAR ---
 sidebar = html.Div([
@@ -178,6 +219,8 @@ sidebar = html.Div([
 ], style={"position": "fixed", "top": 0, "left": 0, "bottom": 0, "width": "18rem", "padding": "2rem 1rem", "background-color": COLOR_NAVY, "color": "white", "overflowY": "auto"})
 
 # --- LAYOUT DASHBOARD ---
+OPTIONS_CROISEMENT = [{'label': lib, 'value': col} for col, lib in VARIABLES.items()]
+
 layout_dashboard = html.Div(id="view-dashboard", children=[
     html.H2("Tableau de Bord", style={'color': COLOR_NAVY}),
     html.Div(id="kpi-container"),
@@ -186,11 +229,37 @@ layout_dashboard = html.Div(id="view-dashboard", children=[
         dbc.Button("📊 Activité", id="btn-act", color="primary", className="me-2"),
         dbc.Button("👥 Usagers", id="btn-cli", color="light", className="me-2"),
         dbc.Button("📈 Évolution", id="btn-evo", color="light", className="me-2"),
+        dbc.Button("🔀 Croisements", id="btn-cro", color="light", className="me-2"),
+        dbc.Button("📑 Rapport annuel", id="btn-rapport", color="success", className="float-end"),
+        dcc.Download(id="download-rapport"),
     ], className="mb-3"),
-    html.Div(id="graphs-container")
+    html.Div(id="graphs-container"),
+    html.Div(id="crosstab-panel", style={'display': 'none'}, children=[
+        dbc.Row([
+            dbc.Col([html.Label("Lignes", className="fw-bold"), dcc.Dropdown(id='cro-var1', options=OPTIONS_CROISEMENT, value='age', clearable=False)], width=3),
+            dbc.Col([html.Label("Colonnes", className="fw-bold"), dcc.Dropdown(id='cro-var2', options=OPTIONS_CROISEMENT, value='sexe', clearable=False)], width=3),
+            dbc.Col([html.Label("Découpage (optionnel)"), dcc.Dropdown(id='cro-var3', options=OPTIONS_CROISEMENT, value=None)], width=3),
+            dbc.Col([dbc.Button("📥 Tableau", id="btn-cro-export", color="success"), dcc.Download(id="download-crosstab")], width=3, className="text-end align-self-end"),
+        ], className="mb-3"),
+        dcc.Graph(id="crosstab-graph")
+    ]),
+    html.Div(id="evolution-panel", style={'display': 'none'}, children=[
+        dbc.Row([
+            dbc.Col([html.Label("Pas de temps", className="fw-bold"), dbc.RadioItems(id='evo-grain', options=[{'label': lib, 'value': g} for g, lib in GRAINS.items()], value='M', inline=True)], width=3),
+            dbc.Col([html.Label("Séries", className="fw-bold"), dcc.Dropdown(id='evo-dimension', options=[{'label': lib, 'value': d} for d, lib in DIMENSIONS.items()], value='total', clearable=False)], width=3),
+            dbc.Col([html.Label("Options"), dbc.Checklist(id='evo-options', options=[{'label': "Comparaison annuelle", 'value': 'annuel'}, {'label': "Moyenne mobile", 'value': 'mobile'}], value=[], inline=True)], width=4),
+            dbc.Col([html.Label("Fenêtre (périodes)"), dbc.Input(id='evo-fenetre', type="number", min=2, step=1, placeholder="auto")], width=2),
+        ], className="mb-3"),
+        dcc.Graph(id="evolution-graph")
+    ])
 ])
 
 # --- LAYOUT DONNÉES ---
+TAILLE_PAGE = 15  # Lignes par page de la table (pagination côté serveur)
+
+def nb_pages(n_lignes):
+    return max(-(-n_lignes // TAILLE_PAGE), 1)
+
 layout_data = html.Div(id="view-data", children=[
     dbc.Row([
         dbc.Col(html.H2("Données Brutes & Édition", style={'color': COLOR_NAVY}), width=6),
@@ -201,12 +270,17 @@ layout_data = html.Div(id="view-data", children=[
             dcc.Download(id="download-dataframe-xlsx")
         ], width=6, className="text-end")
     ], className="mb-3"),
+    dbc.Row([
+        dbc.Col(dbc.Input(id="search-input", type="search", debounce=400,  # ms : une recherche par pause de saisie
+                          placeholder="🔎 Rechercher : commune, partenaire, demande, solution, origine ou n° de dossier"), width=8),
+        dbc.Col(html.Small(id="search-summary", className="text-muted"), width=4, className="align-self-center"),
+    ], className="mb-3"),
     html.Div(id="delete-confirm-box"),
     dash_table.DataTable(
         id='data-table',
-        data=df_global.to_dict('records'),
-        columns=[{"name": i, "id": i} for i in ['id', 'date_ent', 'Ville', 'Mode_Lib', 'Sit_Lib', 'Demandes', 'Solutions'] if i in df_global.columns],
-        page_size=15, 
+        data=df_global.head(TAILLE_PAGE).to_dict('records'),
+        columns=[{"name": i, "id": i} for i in ['id', 'date_ent', 'Commune', 'Mode_Lib', 'Sit_Lib', 'Demandes', 'Solutions'] if i in df_global.columns],
+        page_size=TAILLE_PAGE, page_action='custom', page_current=0, page_count=nb_pages(len(df_global)),
         style_header={'backgroundColor': COLOR_NAVY, 'color': 'white'},
         style_cell={'textAlign': 'left', 'whiteSpace': 'normal', 'height': 'auto'},
         row_selectable="single", # INDISPENSABLE
@@ -215,6 +289,15 @@ layout_data = html.Div(id="view-data", children=[
 ])
 
 # --- LAYOUT FORMULAIRE ---
+def options_natures(variable, natures=()):
+    """ Options code -> "code : libellé", plus les natures hors nomenclature déjà saisies. """
+    codage = nomenclature.courante()[variable]
+    options = [{'label': f"{code} : {lib}", 'value': code} for code, lib in zip(codage.codes, codage.libelles)]
+    return options + [{'label': n, 'value': n} for n in natures if n not in codage.codes]
+
+def options_codes(champ):
+    return nomenclature.courante()[CHAMPS_CODES[champ]].options()
+
 layout_input = html.Div(id="view-input", children=[
     dbc.Row([
         dbc.Col(html.H2(id="form-title", children="📝 Saisie d'un nouvel entretien"), width=9),
@@ -225,30 +308,31 @@ layout_input = html.Div(id="view-input", children=[
         dbc.CardBody([
             dbc.Row([
                 dbc.Col([html.Label("Date", className="fw-bold"), dcc.DatePickerSingle(id='in-date', date=datetime.today().date(), display_format='DD/MM/YYYY', style={'width': '100%'})], width=3),
-                dbc.Col([html.Label("Mode", className="fw-bold"), dcc.Dropdown(id='in-mode', options=[{'label': v, 'value': v} for v in TRANSCO_MODE.values()])], width=3),
-                dbc.Col([html.Label("Durée", className="fw-bold"), dcc.Dropdown(id='in-duree', options=[{'label': v, 'value': v} for v in TRANSCO_DUREE.values()])], width=3),
+                dbc.Col([html.Label("Mode", className="fw-bold"), dcc.Dropdown(id='in-mode', options=options_codes('in-mode'))], width=3),
+                dbc.Col([html.Label("Durée", className="fw-bold"), dcc.Dropdown(id='in-duree', options=options_codes('in-duree'))], width=3),
                 dbc.Col([html.Label("Partenaire"), dbc.Input(id='in-partenaire')], width=3),
             ], className="mb-3"),
             dbc.Row([
-                dbc.Col([html.Label("Ville"), dbc.Input(id='in-ville')], width=6),
+                dbc.Col([html.Label("Ville"), dbc.Input(id='in-ville', list='liste-communes'),
+                         html.Datalist(id='liste-communes', children=[html.Option(value=nom) for nom in communes.courant().table['nom_c']])], width=6),
                 dbc.Col([html.Label("Nb Enfants"), dbc.Input(id='in-enfant', type="number", min=0, value=0)], width=6),
             ], className="mb-3"),
             dbc.Row([
-                dbc.Col([html.Label("Sexe", className="fw-bold"), dcc.Dropdown(id='in-sexe', options=[{'label': v, 'value': v} for v in TRANSCO_SEXE.values()])], width=3),
-                dbc.Col([html.Label("Tranche d'Age"), dcc.Dropdown(id='in-age', options=[{'label': v, 'value': v} for v in TRANSCO_AGE.values()])], width=3),
-                dbc.Col([html.Label("Situation Familiale"), dcc.Dropdown(id='in-sit', options=[{'label': v, 'value': v} for v in TRANSCO_SIT.values()])], width=3),
-                dbc.Col([html.Label("Modèle Familial"), dbc.Input(id='in-mod-fam')], width=3),
+                dbc.Col([html.Label("Sexe", className="fw-bold"), dcc.Dropdown(id='in-sexe', options=options_codes('in-sexe'))], width=3),
+                dbc.Col([html.Label("Tranche d'Age"), dcc.Dropdown(id='in-age', options=options_codes('in-age'))], width=3),
+                dbc.Col([html.Label("Situation Familiale"), dcc.Dropdown(id='in-sit', options=options_codes('in-sit'))], width=3),
+                dbc.Col([html.Label("Modèle Familial"), dcc.Dropdown(id='in-mod-fam', options=options_codes('in-mod-fam'))], width=3),
             ], className="mb-3"),
             dbc.Row([
-                dbc.Col([html.Label("Vient pour"), dcc.Dropdown(id='in-vient', options=[{'label': v, 'value': v} for v in TRANSCO_VIENT.values()])], width=4),
-                dbc.Col([html.Label("Profession"), dcc.Dropdown(id='in-prof', options=[{'label': v, 'value': v} for v in TRANSCO_PROF.values()])], width=4),
-                dbc.Col([html.Label("Ressources"), dcc.Dropdown(id='in-ress', options=[{'label': v, 'value': v} for v in TRANSCO_RESS.values()])], width=4),
+                dbc.Col([html.Label("Vient pour"), dcc.Dropdown(id='in-vient', options=options_codes('in-vient'))], width=4),
+                dbc.Col([html.Label("Profession"), dcc.Dropdown(id='in-prof', options=options_codes('in-prof'))], width=4),
+                dbc.Col([html.Label("Ressources"), dcc.Dropdown(id='in-ress', options=options_codes('in-ress'))], width=4),
             ], className="mb-3"),
-            dbc.Row([dbc.Col([html.Label("Origine"), dbc.Input(id='in-origine')], width=12)], className="mb-4"),
+            dbc.Row([dbc.Col([html.Label("Origine"), dcc.Dropdown(id='in-origine', options=options_codes('in-origine'))], width=12)], className="mb-4"),
             html.Hr(),
             dbc.Row([
-                dbc.Col([html.Label("🔎 Demande", className="fw-bold text-primary"), dbc.Textarea(id='in-demande-txt', style={'height': '100px'})], width=6),
-                dbc.Col([html.Label("💡 Solution", className="fw-bold text-success"), dbc.Textarea(id='in-solution-txt', style={'height': '100px'})], width=6),
+                dbc.Col([html.Label("🔎 Demandes", className="fw-bold text-primary"), dcc.Dropdown(id='in-demandes', multi=True, options=options_natures('demande'))], width=6),
+                dbc.Col([html.Label("💡 Solutions", className="fw-bold text-success"), dcc.Dropdown(id='in-solutions', multi=True, options=options_natures('solution'))], width=6),
             ], className="mb-4"),
             dbc.Button("💾 Enregistrer", id="btn-submit", color="primary", size="lg", className="w-100 shadow"),
             html.Br(), html.Br(),
@@ -268,6 +352,7 @@ app.layout = html.Div([
     dcc.Location(id="url"),
     dcc.Store(id='refresh-trigger', data=0),
     dcc.Store(id='store-edit-id', data=None), 
+    dcc.Store(id='store-view', data='act'),
     sidebar, 
     content_container
 ])
@@ -276,32 +361,83 @@ app.layout = html.Div([
 # 4. CALLBACKS
 # =============================================================================
 
-@app.callback(
+# --- CALLBACKS CLIENT (purement UI : aucun aller-retour serveur) ---
+app.clientside_callback(
+    """
+    function(pathname) {
+        const hide = {'display': 'none'};
+        const show = {'display': 'block'};
+        if (pathname === '/data') { return [hide, show, hide]; }
+        if (pathname === '/input') { return [hide, hide, show]; }
+        return [show, hide, hide];
+    }
+    """,
     [Output("view-dashboard", "style"), Output("view-data", "style"), Output("view-input", "style")],
     [Input("url", "pathname")]
 )
-def display_page(pathname):
-    hide = {'display': 'none'}
-    show = {'display': 'block'}
-    if pathname == "/data": return hide, show, hide
-    elif pathname == "/input": return hide, hide, show
-    else: return show, hide, hide
-
-@app.callback(Output("data-table", "data"), Input("refresh-trigger", "data"))
-def refresh_table(trigger):
-    global df_global
-    df_global = load_data_from_db()
-    return df_global.to_dict('records')
 
-@app.callback(Output('filter-year', 'options'), Input('data-table', 'data'))
-def update_year_filter(rows):
+app.clientside_callback(
+    """
+    function(selected_rows) {
+        const aucune = !selected_rows || selected_rows.length === 0;
+        return [aucune, aucune];
+    }
+    """,
+    [Output("btn-edit-mode", "disabled"), Output("btn-delete", "disabled")],
+    Input("data-table", "selected_rows")
+)
+
+app.clientside_callback(
+    """
+    function(b1, b2, b3, b4) {
+        const trig = (dash_clientside.callback_context.triggered[0] || {}).prop_id || '';
+        let view = 'act';
+        if (trig.startsWith('btn-cli')) { view = 'cli'; }
+        else if (trig.startsWith('btn-evo')) { view = 'evo'; }
+        else if (trig.startsWith('btn-cro')) { view = 'cro'; }
+        const couleur = (v) => view === v ? 'primary' : 'light';
+        return [view, couleur('act'), couleur('cli'), couleur('evo'), couleur('cro'),
+                {'display': view === 'cro' ? 'block' : 'none'}, {'display': view === 'evo' ? 'block' : 'none'}];
+    }
+    """,
+    [Output("store-view", "data"), Output("btn-act", "color"), Output("btn-cli", "color"), Output("btn-evo", "color"),
+     Output("btn-cro", "color"), Output("crosstab-panel", "style"), Output("evolution-panel", "style")],
+    [Input("btn-act", "n_clicks"), Input("btn-cli", "n_clicks"), Input("btn-evo", "n_clicks"), Input("btn-cro", "n_clicks")]
+)
+
+# --- CALLBACKS SERVEUR ---
+
+@app.callback([Output("data-table", "data"), Output("data-table", "page_count"), Output("data-table", "page_current"),
+               Output("data-table", "selected_rows"), Output("search-summary", "children")],
+              [Input("refresh-trigger", "data"), Input("search-input", "value"), Input("data-table", "page_current")])
+def refresh_table(trigger, texte=None, page=0):
+    # Pagination côté serveur : seule la page affichée est envoyée (snapshot ou correspondances de la recherche)
+    if ctx.triggered_id == "refresh-trigger": synchroniser_snapshot(trigger)
+    elif ctx.triggered_id is None: synchroniser_snapshot()
+    page = (page or 0) if ctx.triggered_id == "data-table" else 0  # Nouvelle recherche / rechargement : 1re page
+    debut = page * TAILLE_PAGE
+    if not (texte or "").strip() or df_global.empty:
+        return (df_global.iloc[debut:debut + TAILLE_PAGE].to_dict('records'), nb_pages(len(df_global)), page, [], "")
+
+    # Page des correspondances dans l'ordre du classement (LIMIT / OFFSET en base)
+    resultat = obtenir_recherche().rechercher(texte, limite=TAILLE_PAGE, decalage=debut)
+    positions = pd.Index(df_global['id']).get_indexer(resultat.nums)
+    lignes = df_global.iloc[positions[positions >= 0]]
+    return lignes.to_dict('records'), nb_pages(resultat.total), page, [], f"{resultat.total} résultat(s)"
+
+# Listes dépendant du snapshot : recalculées à son rechargement (refresh-trigger), pas à chaque page de la table
+@app.callback(Output('filter-year', 'options'), Input('refresh-trigger', 'data'))
+def update_year_filter(refresh):
+    if ctx.triggered_id == "refresh-trigger": synchroniser_snapshot(refresh)
     if df_global.empty: return [{'label': 'Aucune donnée', 'value': 'ALL'}]
     years = sorted(df_global['Annee'].unique(), reverse=True)
     return [{'label': 'Tout', 'value': 'ALL'}] + [{'label': y, 'value': y} for y in years if y != "Inconnue"]
 
-@app.callback([Output("btn-edit-mode", "disabled"), Output("btn-delete", "disabled")], Input("data-table", "selected_rows"))
-def toggle_buttons(selected_rows):
-    return (not selected_rows, not selected_rows)
+@app.callback([Output(champ, 'options') for champ in CHAMPS_CODES], Input('refresh-trigger', 'data'))
+def update_form_options(refresh):
+    if ctx.triggered_id == "refresh-trigger": synchroniser_snapshot(refresh)
+    # Suit la nomenclature rechargée avec le snapshot (nouvelles modalités sans changement de code)
+    return [options_codes(champ) for champ in CHAMPS_CODES]
 
 @app.callback(
     [Output("url", "pathname"), Output("store-edit-id", "data"), Output("delete-confirm-box", "children"), Output("refresh-trigger", "data", allow_duplicate=True)],
@@ -321,9 +457,9 @@ def handle_table_actions(n_edit, n_delete, n_reset, selected_rows, rows):
     if ctx_id == "btn-edit-mode":
         return "/input", row_id, None, dash.no_update
     if ctx_id == "btn-delete":
-        success, msg = delete_entretien_db(row_id)
+        success, msg, transaction = delete_entretien_db(row_id)
         alert = dbc.Alert(msg, color="success" if success else "danger", dismissable=True, duration=4000)
-        return dash.no_update, dash.no_update, alert, time.time()
+        return dash.no_update, dash.no_update, alert, jeton_rafraichissement(transaction)
     return dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
 @app.callback(
@@ -332,109 +468,232 @@ def handle_table_actions(n_edit, n_delete, n_reset, selected_rows, rows):
      Output("in-ville", "value"), Output("in-enfant", "value"), Output("in-sit", "value"),
      Output("in-mod-fam", "value"), Output("in-vient", "value"), Output("in-prof", "value"),
      Output("in-ress", "value"), Output("in-origine", "value"), Output("in-partenaire", "value"),
-     Output("in-demande-txt", "value"), Output("in-solution-txt", "value")],
+     Output("in-demandes", "value"), Output("in-solutions", "value"),
+     Output("in-demandes", "options"), Output("in-solutions", "options")],
     Input("store-edit-id", "data")
 )
 def populate_form(edit_id):
-    defaults = ("📝 Saisie d'un nouvel entretien", datetime.today().date(), None, None, None, None, "", 0, None, "", None, None, None, "", "", "", "")
+    defaults = ("📝 Saisie d'un nouvel entretien", datetime.today().date(), None, None, None, None, "", 0, None, None, None, None, None, None, "", [], [],
+                options_natures('demande'), options_natures('solution'))
     if not edit_id: return defaults
     
     try: id_cherche = int(edit_id)
     except: return defaults
 
-    df_copy = df_global.copy()
-    filtered_df = df_copy[df_copy['id'].astype(int) == id_cherche]
+    filtered_df = df_global[df_global['id'].astype(int) == id_cherche]
     if filtered_df.empty: return defaults
     row = filtered_df.iloc[0]
+
+    # Natures de l'entretien lues dans les incidences (position = index du snapshot)
+    inc_dem, inc_sol = df_global.attrs.get('demandes'), df_global.attrs.get('solutions')
+    demandes = inc_dem.natures_de(row.name) if inc_dem is not None else []
+    solutions = inc_sol.natures_de(row.name) if inc_sol is not None else []
     
     return (f"✏️ Modification du Dossier N°{id_cherche}", 
-            row['date_ent'], TRANSCO_MODE.get(row['mode'], row['Mode_Lib']), 
-            TRANSCO_DUREE.get(row['duree'], "2"), TRANSCO_SEXE.get(row['sexe']), 
-            TRANSCO_AGE.get(row['age']), row['Ville'], row['enfant'], 
-            TRANSCO_SIT.get(str(row['sit_fam']), "7"), row['modele_fam'], 
-            TRANSCO_VIENT.get(row['vient_pr']), TRANSCO_PROF.get(row['profession']), 
-            TRANSCO_RESS.get(row['ress']), row['origine'], row['Partenaire'], 
-            row['Demandes'], row['Solutions'])
+            row['date_ent'], code_saisie('mode', row['mode']), 
+            code_saisie('duree', row['duree'], 2), code_saisie('sexe', row['sexe']), 
+            code_saisie('age', row['age']), row['Ville'], row['enfant'], 
+            code_saisie('sit_fam', row['sit_fam'], "7"), code_saisie('modele_fam', row['modele_fam']), 
+            code_saisie('vient_pr', row['vient_pr']), code_saisie('profession', row['profession']), 
+            code_saisie('ress', row['ress']), code_saisie('origine', row['origine']), row['Partenaire'], 
+            demandes, solutions, options_natures('demande', demandes), options_natures('solution', solutions))
 
 @app.callback(
     [Output("submit-feedback", "children"), Output("refresh-trigger", "data", allow_duplicate=True)],
     [Input("btn-submit", "n_clicks")],
     [State('store-edit-id', 'data'), State('in-date', 'date'), State('in-mode', 'value'), State('in-duree', 'value'), State('in-sexe', 'value'), State('in-age', 'value'), 
-     State('in-ville', 'value'), State('in-enfant', 'value'), State('in-sit', 'value'), State('in-mod-fam', 'value'), State('in-vient', 'value'), State('in-prof', 'value'), State('in-ress', 'value'), State('in-origine', 'value'), State('in-partenaire', 'value'), State('in-demande-txt', 'value'), State('in-solution-txt', 'value')],
+     State('in-ville', 'value'), State('in-enfant', 'value'), State('in-sit', 'value'), State('in-mod-fam', 'value'), State('in-vient', 'value'), State('in-prof', 'value'), State('in-ress', 'value'), State('in-origine', 'value'), State('in-partenaire', 'value'), State('in-demandes', 'value'), State('in-solutions', 'value')],
     prevent_initial_call=True
 )
-def save_form_data(n, edit_id, date, mode, duree, sexe, age, ville, enfant, sit, mod_fam, vient, prof, ress, origine, part, dem_txt, sol_txt):
+def save_form_data(n, edit_id, date, mode, duree, sexe, age, ville, enfant, sit, mod_fam, vient, prof, ress, origine, part, demandes, solutions):
     if not date or not mode or not sexe: return dbc.Alert("❌ Champs obligatoires manquants.", color="danger"), dash.no_update
     try:
         data = {
-            'date': date, 'mode': REV_MODE.get(mode), 'duree': REV_DUREE.get(duree, 2), 'sexe': REV_SEXE.get(sexe), 'age': REV_AGE.get(age, 0), 
-            'ville': ville if ville else "", 
-            'enfant': int(enfant) if enfant else 0, 'sit': REV_SIT.get(sit, "7"), 'mod_fam': mod_fam if mod_fam else None, 
-            'vient': REV_VIENT.get(vient, 6), 'prof': REV_PROF.get(prof, 11), 'ress': REV_RESS.get(ress, 9), 
-            'origine': origine if origine else None, 'partenaire': part if part else "", 'demande_txt': dem_txt, 'solution_txt': sol_txt
+            'date': date, 'mode': code_saisie('mode', mode), 'duree': code_saisie('duree', duree, 2), 'sexe': code_saisie('sexe', sexe), 'age': code_saisie('age', age, 0), 
+            'ville': ville.strip() if ville else "", 'code_c': communes.courant().resoudre_un(ville, approche=False), 
+            'enfant': int(enfant) if enfant else 0, 'sit': code_saisie('sit_fam', sit, "7"), 'mod_fam': code_saisie('modele_fam', mod_fam), 
+            'vient': code_saisie('vient_pr', vient, 6), 'prof': code_saisie('profession', prof, 11), 'ress': code_saisie('ress', ress, 9), 
+            'origine': code_saisie('origine', origine), 'partenaire': part if part else "", 'demandes': list(demandes or []), 'solutions': list(solutions or [])
         }
-        success, msg = save_entretien_db(data, update_id=edit_id)
-        return (dbc.Alert(f"✅ {msg}", color="success"), time.time()) if success else (dbc.Alert(f" {msg}", color="danger"), dash.no_update)
+        success, msg, transaction = save_entretien_db(data, update_id=edit_id)
+        return (dbc.Alert(f"✅ {msg}", color="success"), jeton_rafraichissement(transaction)) if success else (dbc.Alert(f" {msg}", color="danger"), dash.no_update)
     except Exception as e: return dbc.Alert(f" Erreur: {str(e)}", color="danger"), dash.no_update
 
 @app.callback(Output("download-dataframe-xlsx", "data"), Input("btn-export", "n_clicks"), prevent_initial_call=True)
 def export_excel_callback(n_clicks):
     return dcc.send_data_frame(df_global.to_excel, "export_mdd_vannes.xlsx", sheet_name="Données")
 
+@app.callback(Output("download-rapport", "data"), Input("btn-rapport", "n_clicks"), State("filter-year", "value"), prevent_initial_call=True)
+def export_rapport(n_clicks, fy):
+    # Toutes les variables de toutes les rubriques : une requête GROUPING SETS (mois de l'année, ou années si 'ALL')
+    if df_global.empty: return no_update
+    try:
+        conn = get_db_connection()
+    except Exception:
+        conn = None
+    try:
+        nom = f"rapport_mdd_vannes_{fy if fy not in (None, 'ALL') else 'toutes_annees'}.xlsx"
+        return dcc.send_bytes(lambda tampon: rapport.generer(tampon, df_global, conn, fy), nom)
+    finally:
+        if conn: conn.close()
+
 @app.callback(
-    [Output("kpi-container", "children"), Output("graphs-container", "children"),
-     Output("btn-act", "color"), Output("btn-cli", "color"), Output("btn-evo", "color")],
-    [Input("filter-year", "value"), Input("btn-act", "n_clicks"), Input("btn-cli", "n_clicks"), Input("btn-evo", "n_clicks"), Input("refresh-trigger", "data")]
+    [Output("kpi-container", "children"), Output("graphs-container", "children")],
+    [Input("filter-year", "value"), Input("store-view", "data"), Input("refresh-trigger", "data")]
 )
-def update_dashboard(fy, b1, b2, b3, refresh):
-    ctx_id = ctx.triggered_id
-    
-    if ctx_id == "refresh-trigger":
-        global df_global
-        df_global = load_data_from_db()
-        ctx_id = "btn-act"
-    
-    if not ctx_id or ctx_id in ["filter-year"]: ctx_id = "btn-act"
-    view = "act"
-    if ctx_id == "btn-cli": view = "cli"
-    elif ctx_id == "btn-evo": view = "evo"
+def update_dashboard(fy, view, refresh):
+    # La vue active (act / cli / evo / cro) et la couleur des boutons sont gérées côté client (store-view)
+    if ctx.triggered_id == "refresh-trigger": synchroniser_snapshot(refresh)
 
     dff = df_global.copy()
-    if df_global.empty: return html.Div("Pas de données"), html.Div(), "light", "light", "light"
+    if df_global.empty: return html.Div("Pas de données"), html.Div()
     if fy != 'ALL' and fy is not None: dff = dff[dff['Annee'] == fy]
 
     kpi = dbc.Row([
         dbc.Col(dbc.Card([html.H2(len(dff), className="text-warning"), html.H6("Total Rdv")], body=True, className="text-center shadow-sm"), width=3),
-        dbc.Col(dbc.Card([html.H2(dff['Ville'].mode()[0] if not dff.empty else "-", className="text-primary"), html.H6("Top Ville")], body=True, className="text-center shadow-sm"), width=3),
+        dbc.Col(dbc.Card([html.H2(top_ville(dff, fy), className="text-primary"), html.H6("Top Ville")], body=True, className="text-center shadow-sm"), width=3),
         dbc.Col(dbc.Card([html.H2(dff['Sit_Lib'].mode()[0] if not dff.empty else "-", className="text-primary", style={'fontSize': '1rem'}), html.H6("Situation")], body=True, className="text-center shadow-sm"), width=3),
         dbc.Col(dbc.Card([html.H2(dff['Prof_Lib'].mode()[0] if not dff.empty else "-", className="text-primary", style={'fontSize': '1rem'}), html.H6("Profession")], body=True, className="text-center shadow-sm"), width=3),
     ], className="mb-4")
 
     graphs = []
-    colors = ["light", "light", "light"]
-    if view == "act":
-        colors[0] = "primary"
-        df_part = dff[dff['Partenaire'] != ""]
-        fig1 = px.bar(dff['Mode_Lib'].value_counts(), title="Modes", color_discrete_sequence=[COLOR_NAVY])
-        fig2 = px.bar(df_part['Partenaire'].value_counts().head(10), orientation='h', title="Top Partenaires", color_discrete_sequence=[COLOR_GOLD])
-        graphs = [dbc.Row([dbc.Col(dcc.Graph(figure=fig1), width=6), dbc.Col(dcc.Graph(figure=fig2), width=6)])]
+    if view in ("cro", "evo"):
+        pass  # Graphiques portés par crosstab-panel / evolution-panel (update_crosstab / update_evolution)
     elif view == "cli":
-        colors[1] = "primary"
         graphs = [
             dbc.Row([dbc.Col(dcc.Graph(figure=px.bar(dff['Age_Lib'].value_counts(), title="Age", color_discrete_sequence=[COLOR_NAVY])), width=6), dbc.Col(dcc.Graph(figure=px.pie(dff, names='Sexe_Lib', title="Sexe", hole=0.4, color_discrete_sequence=[COLOR_NAVY, COLOR_GOLD])), width=6)]),
             dbc.Row([dbc.Col(dcc.Graph(figure=px.bar(dff['Sit_Lib'].value_counts(), title="Situation", color_discrete_sequence=[COLOR_GOLD])), width=6), dbc.Col(dcc.Graph(figure=px.pie(dff, names='Prof_Lib', title="Profession", color_discrete_sequence=px.colors.sequential.Blues)), width=6)])
         ]
-    elif view == "evo":
-        colors[2] = "primary"
-        df_evol = dff.groupby('Mois').size().reset_index(name='Nombre')
-        graphs = [dbc.Row([dbc.Col(dcc.Graph(figure=px.line(df_evol, x='Mois', y='Nombre', title="Evolution Mensuelle", markers=True, color_discrete_sequence=[COLOR_NAVY])), width=12)])]
+    else:
+        df_part = dff[dff['Partenaire'] != ""]
+        fig1 = px.bar(dff['Mode_Lib'].value_counts(), title="Modes", color_discrete_sequence=[COLOR_NAVY])
+        fig2 = px.bar(df_part['Partenaire'].value_counts().head(10), orientation='h', title="Top Partenaires", color_discrete_sequence=[COLOR_GOLD])
+        graphs = [dbc.Row([dbc.Col(dcc.Graph(figure=fig1), width=6), dbc.Col(dcc.Graph(figure=fig2), width=6)])]
+        graphs += graphes_natures(dff)
+        graphs += graphes_communes(fy)
+
+    return kpi, graphs
+
+def top_ville(dff, fy):
+    """ Commune la plus fréquente, lue dans l'agrégat pré-joint du snapshot (noms du référentiel). """
+    agregat = df_global.attrs.get('communes')
+    if agregat is not None: return agregat.top_commune(fy)
+    villes = dff['Commune'][(dff['Commune'] != "") & ~dff['Commune'].map(communes.normaliser_nom).isin(communes.FOURRE_TOUT)]
+    return villes.mode()[0] if not villes.empty else "-"
+
+def graphes_communes(fy):
+    """ Entretiens par agglomération puis par commune (agrégat pré-joint, quelques dizaines de lignes). """
+    agregat = df_global.attrs.get('communes')
+    if agregat is None: return []
+    table = agregat.filtrer(fy)
+    table = table[table['Commune'] != ""].groupby(['Agglo', 'Commune'], as_index=False)['Nombre'].sum()
+    if table.empty: return []
+    fig_agglo = px.bar(agregat.par_agglo(fy), title="Entretiens par agglomération", color_discrete_sequence=[COLOR_NAVY])
+    fig_communes = px.treemap(table, path=['Agglo', 'Commune'], values='Nombre', title="Communes par agglomération")
+    return [dbc.Row([dbc.Col(dcc.Graph(figure=fig_agglo), width=6), dbc.Col(dcc.Graph(figure=fig_communes), width=6)])]
+
+TOP_NATURES = 10  # Demandes / solutions affichées (graphe « Top Demandes » et croisement)
+
+def graphes_natures(dff):
+    """ Top demandes et croisement demande -> solution, comptés sur les incidences du snapshot. """
+    inc_dem, inc_sol = df_global.attrs.get('demandes'), df_global.attrs.get('solutions')
+    if inc_dem is None or inc_sol is None: return []
+    positions = dff.index.to_numpy()
+    nomenc = nomenclature.courante()
+    lib_dem = [nomenc['demande'].libelle(n, n) for n in inc_dem.natures]
+    lib_sol = [nomenc['solution'].libelle(n, n) for n in inc_sol.natures]
+
+    # Natures les plus fréquentes (les libellés libres historiques sont nombreux) : indices dans le vocabulaire
+    plus_frequentes = lambda n: [i for i in np.argsort(-n, kind="stable")[:TOP_NATURES] if n[i] > 0]
+    comptes_dem = inc_dem.comptes(positions)
+    i_dem = plus_frequentes(comptes_dem.to_numpy())
+    i_sol = plus_frequentes(inc_sol.comptes(positions).to_numpy())
+    top = comptes_dem.iloc[i_dem[::-1]].set_axis([lib_dem[i] for i in i_dem[::-1]])
+    croise = inc_dem.cooccurrences(inc_sol, positions).iloc[i_dem, i_sol]
+    fig_top = px.bar(top, orientation='h', title="Top Demandes", color_discrete_sequence=[COLOR_NAVY])
+    fig_croise = px.imshow(croise.to_numpy(), x=[lib_sol[j] for j in i_sol], y=[lib_dem[i] for i in i_dem], text_auto=True, aspect="auto", title="Demande → Solution",
+                           labels={'x': "Solution", 'y': "Demande", 'color': "Entretiens"}, color_continuous_scale="Blues")
+    return [dbc.Row([dbc.Col(dcc.Graph(figure=fig_top), width=6), dbc.Col(dcc.Graph(figure=fig_croise), width=6)])]
+
+def libelles_serie(dimension, valeurs):
+    """ Valeurs de SERIE_ENTRETIEN (codes en texte) -> libellés affichés. """
+    valeurs = pd.Series(valeurs, dtype=object)
+    if dimension == 'total': libelles = np.full(len(valeurs), "Total", dtype=object)
+    elif dimension == 'mode': libelles = nomenclature.courante()['mode'].decoder(valeurs.to_numpy(), 'Autre')
+    elif dimension == 'commune': libelles = communes.courant().noms(valeurs.replace("", np.nan), communes.LIB_INCONNUE)
+    else: libelles = valeurs.replace("", communes.LIB_INCONNUE).to_numpy()
+    return dict(zip(valeurs, libelles))
+
+@app.callback(
+    Output("evolution-graph", "figure"),
+    [Input("evo-grain", "value"), Input("evo-dimension", "value"), Input("evo-options", "value"), Input("evo-fenetre", "value"),
+     Input("filter-year", "value"), Input("store-view", "data"), Input("refresh-trigger", "data")]
+)
+def update_evolution(grain, dimension, options, fenetre, fy, view, refresh):
+    if ctx.triggered_id == "refresh-trigger": synchroniser_snapshot(refresh)
+    # Lecture de la série pré-agrégée (quelques centaines de lignes) : coût indépendant du nombre d'entretiens
+    if view != "evo" or df_global.empty or grain not in GRAINS or dimension not in DIMENSIONS: return no_update
+    options = options or []
+    serie = obtenir_series().serie(grain, dimension)
+    annuel = 'annuel' in options
+    if fy not in (None, 'ALL') and not annuel: serie = serie[series.annee_periode(serie['periode'], grain).astype(str) == fy]
+    large = series.tableau(serie, grain, libelles_serie(dimension, serie['valeur'].unique()))
+    fenetre = fenetre or FENETRE_DEFAUT[grain]
+    titre = f"Evolution {'Mensuelle' if grain == 'M' else 'Hebdomadaire' if grain == 'S' else 'Quotidienne'}"
+    if 'mobile' in options:
+        large = series.moyenne_mobile(large, fenetre)
+        titre += f" (moyenne mobile sur {int(fenetre)} périodes)"
+    if annuel:
+        table = series.glissement_annuel(large, grain)
+        return px.line(table, x='Rang', y='Nombre', color='Annee', title=titre + " — comparaison annuelle", markers=grain == 'M',
+                       labels={'Rang': GRAINS[grain] + " de l'année", 'Annee': "Année"})
+    table = large.reset_index().melt(id_vars='periode', var_name='Série', value_name='Nombre')
+    return px.line(table, x='periode', y='Nombre', color='Série', title=titre, markers=grain == 'M',
+                   labels={'periode': GRAINS[grain]}, color_discrete_sequence=[COLOR_NAVY, COLOR_GOLD] + px.colors.qualitative.Set2)
+
+def _croisement(v1, v2, v3, fy):
+    colonnes = [c for c in (v1, v2, v3) if c]
+    cube, libelles = obtenir_croiseur().croiser(colonnes, fy)
+    return colonnes, cube, libelles
 
-    return kpi, graphs, colors[0], colors[1], colors[2]
+@app.callback(
+    Output("crosstab-graph", "figure"),
+    [Input("cro-var1", "value"), Input("cro-var2", "value"), Input("cro-var3", "value"),
+     Input("filter-year", "value"), Input("store-view", "data"), Input("refresh-trigger", "data")]
+)
+def update_crosstab(v1, v2, v3, fy, view, refresh):
+    if ctx.triggered_id == "refresh-trigger": synchroniser_snapshot(refresh)
+    if view != "cro" or df_global.empty or not v1 or not v2: return no_update
+    colonnes, cube, libelles = _croisement(v1, v2, v3, fy)
+    titre = " × ".join(VARIABLES[c] for c in colonnes)
+    labels = {'y': VARIABLES[v1], 'x': VARIABLES[v2], 'color': "Nombre"}
+    if len(colonnes) == 2:
+        fig = px.imshow(cube, x=libelles[1], y=libelles[0], text_auto=True, aspect="auto", labels=labels, title=titre, color_continuous_scale="Blues")
+    else:
+        # Un panneau par modalité de la 3e variable (les 12 plus fréquentes)
+        garde = sorted(np.argsort(cube.sum(axis=(0, 1)))[::-1][:12])
+        fig = px.imshow(cube[:, :, garde].transpose(2, 0, 1), x=libelles[1], y=libelles[0], facet_col=0, facet_col_wrap=4,
+                        text_auto=True, aspect="auto", labels=labels, title=titre, color_continuous_scale="Blues")
+        for annotation, k in zip(fig.layout.annotations, garde):
+            annotation.text = f"{VARIABLES[v3]} : {libelles[2][k]}"
+    return fig
+
+@app.callback(
+    Output("download-crosstab", "data"), Input("btn-cro-export", "n_clicks"),
+    [State("cro-var1", "value"), State("cro-var2", "value"), State("cro-var3", "value"), State("filter-year", "value")],
+    prevent_initial_call=True
+)
+def export_crosstab(n_clicks, v1, v2, v3, fy):
+    if df_global.empty or not v1 or not v2: return no_update
+    colonnes, cube, libelles = _croisement(v1, v2, v3, fy)
+    table = vers_table(cube, libelles, colonnes)
+    return dcc.send_data_frame(table.to_excel, "croisement_mdd_vannes.xlsx", sheet_name="Croisement", index=False)
 
 app.index_string = '''<!DOCTYPE html><html><head>{%metas%}<title>MDD</title>{%favicon%}{%css%}<style>.nav-link-custom { color: rgba(255,255,255,0.8) !important; }.nav-link-custom.active { background-color: #D4AF37 !important; color: white !important; font-weight: bold; }.filter-box { background-color: #2C3E50; padding: 15px; border-radius: 10px; margin-top: 20px; }</style></head><body>{%app_entry%}<footer>{%config%}{%scripts%}{%renderer%}</footer></body></html>'''
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     url = "http://127.0.0.1:8050/"
     
     def open_browser():
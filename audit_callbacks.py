@@ -0,0 +1,106 @@
+"""
+Audit des callbacks Dash : mesure le coût d'un aller-retour serveur pour chaque callback.
+
+Usage : python audit_callbacks.py [--repetitions 20]
+
+Chaque callback serveur est rejoué via le client de test Flask (POST /_dash-update-component)
+avec les valeurs initiales du layout, comme au chargement de la page. Les callbacks clientside sont listés pour mémoire :
+ils ne coûtent aucun aller-retour.
+"""
+import argparse
+import json
+import statistics
+import time
+
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+
+# =============================================================================
+# 1. CONSTRUCTION DES REQUÊTES DASH
+# =============================================================================
+def decouper_cle_sortie(cle):
+    """ '..a.b...c.d..' -> [('a', 'b'), ('c', 'd')] ; 'a.b' -> [('a', 'b')] """
+    if cle.startswith('..'):
+        return [tuple(part.rsplit('.', 1)) for part in cle[2:-2].split('...')]
+    return [tuple(cle.rsplit('.', 1))]
+
+
+def valeurs_initiales(layout):
+    """ Dictionnaire {'id.prop': valeur} des propriétés déclarées dans le layout. """
+    valeurs = {}
+    composants = [layout] + list(layout._traverse())
+    for comp in composants:
+        comp_id = getattr(comp, 'id', None)
+        if not isinstance(comp_id, str): continue
+        for prop, val in comp.to_plotly_json()['props'].items():
+            if prop != 'children': valeurs[f"{comp_id}.{prop}"] = val
+    return valeurs
+
+
+def construire_requete(app, cle_sortie, valeurs=None, declencheur=None):
+    """
+    Corps JSON d'un appel à /_dash-update-component pour le callback `cle_sortie`.
+    `valeurs` surcharge les valeurs initiales ('id.prop' -> valeur), `declencheur`
+    est la propriété 'id.prop' à l'origine du changement. Sans déclencheur, l'appel est celui
+    du chargement de la page (changedPropIds vide, ctx.triggered_id = None), comme le navigateur.
+    """
+    entree = app.callback_map[cle_sortie]
+    connues = valeurs_initiales(app.layout)
+    connues.update(valeurs or {})
+
+    def _deps(liste):
+        return [{'id': d['id'], 'property': d['property'], 'value': connues.get(f"{d['id']}.{d['property']}")} for d in liste]
+
+    sorties = [{'id': i, 'property': p} for i, p in decouper_cle_sortie(cle_sortie)]
+    inputs = _deps(entree['inputs'])
+    return {
+        'output': cle_sortie,
+        'outputs': sorties if cle_sortie.startswith('..') else sorties[0],
+        'inputs': inputs,
+        'state': _deps(entree['state']),
+        'changedPropIds': [declencheur] if declencheur else [],
+    }
+
+
+# =============================================================================
+# 2. AUDIT
+# =============================================================================
+def auditer_callbacks(app, repetitions=20):
+    """ Retourne un DataFrame (callback, type, statut, médiane/p95 en ms, octets). """
+    client = app.server.test_client()
+    client.get('/')  # Initialise le layout et les routes
+    lignes = []
+
+    for cle, entree in app.callback_map.items():
+        if 'callback' not in entree: continue  # Callback clientside : pas de fonction serveur
+        corps = json.dumps(construire_requete(app, cle), cls=PlotlyJSONEncoder)
+        durees, taille, statut = [], 0, None
+        for _ in range(repetitions):
+            debut = time.perf_counter()
+            rep = client.post('/_dash-update-component', data=corps, content_type='application/json')
+            durees.append((time.perf_counter() - debut) * 1000)
+            taille, statut = len(rep.data), rep.status_code
+        durees.sort()
+        lignes.append({
+            'callback': entree['callback'].__name__, 'type': 'serveur', 'statut': statut,
+            'mediane_ms': round(statistics.median(durees), 2),
+            'p95_ms': round(durees[min(len(durees) - 1, int(len(durees) * 0.95))], 2),
+            'octets': taille, 'sortie': cle,
+        })
+
+    for cb in app._callback_list:
+        if cb.get('clientside_function'):
+            lignes.append({'callback': '(clientside)', 'type': 'client', 'statut': None,
+                           'mediane_ms': 0.0, 'p95_ms': 0.0, 'octets': 0, 'sortie': cb['output']})
+
+    return pd.DataFrame(lignes).sort_values(['type', 'mediane_ms'], ascending=[False, False])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Audit du coût des callbacks Dash")
+    parser.add_argument('--repetitions', type=int, default=20)
+    args = parser.parse_args()
+
+    import app as mdd
+    print(auditer_callbacks(mdd.app, args.repetitions).to_string(index=False))
@@ -0,0 +1,54 @@
+"""
+Comparaison des résultats de benchmarks entre deux commits.
+
+Usage : python -m bench.comparer [--base SHA] [--cible SHA] [--seuil 1.2]
+
+Par défaut : les deux derniers commits présents dans bench/resultats.jsonl.
+Une étape est signalée en régression si durée ou pic mémoire dépasse base x seuil.
+Code retour 1 en cas de régression (utilisable en CI).
+"""
+import argparse
+import sys
+
+import pandas as pd
+
+from bench.run import FICHIER_RESULTATS
+
+
+def charger(chemin=FICHIER_RESULTATS):
+    df = pd.read_json(chemin, lines=True)
+    # Plusieurs lancements sur un même commit : on garde la médiane
+    return df.groupby(["commit", "etape", "taille"], as_index=False).agg(
+        secondes=("secondes", "median"), pic_mo=("pic_mo", "median"), date=("date", "max"))
+
+
+def comparer(df, base, cible, seuil=1.2):
+    a = df[df["commit"] == base].set_index(["etape", "taille"])
+    b = df[df["commit"] == cible].set_index(["etape", "taille"])
+    res = a[["secondes", "pic_mo"]].join(b[["secondes", "pic_mo"]], lsuffix="_base", rsuffix="_cible", how="inner")
+    res["ratio_temps"] = (res["secondes_cible"] / res["secondes_base"]).round(2)
+    res["ratio_memoire"] = (res["pic_mo_cible"] / res["pic_mo_base"].where(res["pic_mo_base"] > 0)).round(2)
+    res["regression"] = (res["ratio_temps"] > seuil) | (res["ratio_memoire"] > seuil)
+    return res.reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare deux lancements de benchmarks")
+    parser.add_argument("--base")
+    parser.add_argument("--cible")
+    parser.add_argument("--seuil", type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    df = charger()
+    commits = df.sort_values("date").drop_duplicates("commit", keep="last")["commit"].tolist()
+    cible = args.cible or commits[-1]
+    base = args.base or (commits[-2] if len(commits) > 1 else commits[-1])
+
+    res = comparer(df, base, cible, args.seuil)
+    print(f"--- {base} -> {cible} (seuil x{args.seuil}) ---")
+    print(res.to_string(index=False))
+    return 1 if res["regression"].any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
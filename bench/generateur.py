@@ -0,0 +1,104 @@
+"""
+Générateur de données synthétiques pour les benchmarks.
+
+- `generer_donnees(n)` : tables entretien / demande / solution (codes BDD), distributions
+  réalistes mais tirées au hasard dans les espaces de codes de la nomenclature.
+- `generer_classeur(chemin, n)` : classeur mensuel au format de la saisie Excel
+  (un onglet par mois, en-tête "Mode" en 2e colonne), lisible par Read_xl.
+"""
+import numpy as np
+import pandas as pd
+
+import nomenclature
+from read_xl import MOIS
+
+# Espaces de codes de la base (DDL)
+NOMENC = nomenclature.courante()
+NATURES_DEMANDE = NOMENC['demande'].codes
+NATURES_SOLUTION = NOMENC['solution'].codes
+COMMUNES = NOMENC['commune'].codes
+PARTENAIRES = NOMENC['partenaire'].codes
+
+# Libellés tels qu'ils apparaissent dans les classeurs (libellés ou alias de la nomenclature)
+LIBELLES_EXCEL = {
+    "Mode": ["RDV", "Sans RDV", "Tel", "Courrier", "Mail"],
+    "Durée": ["- de 15 min", "15 à 30 min", "30 à 45 min", "45 à 60 min", "+ de 60 min"],
+    "Sexe": ["Homme", "Femme", "Couple", "Pro"],
+    "Age": ["-18 ans", "18-25 ans", "26-40 ans", "41-60 ans", "+ 60 ans"],
+    "Vient pr": ["Soi", "Conjoint", "Parent", "Enfant", "Persmor"],
+    "Sit° Fam": ["Célibataire", "Concubin", "Pacsé", "Marié", "Séparé/divorcé", "Parisolé", "Veuf/ve", "Non renseigné"],
+    "Modèle fam.": ["Tradi", "Monop", "Recomp"],
+    "Prof°": ["Sco/étud", "Employé", "Ouvrier", "Cadre", "Retraité", "Ddeur emploi", "Sss prof°"],
+    "Ress. 1": ["Salaire", "Revenus pro", "Retraite/rév", "Chômage", "RSA", "AAH", "Sans revenu"],
+    "Origine": ["Bouche à oreille", "Internet", "Déjà venu Suite", "Admin CAF", "Admin Mairie", "Privé PJ"],
+}
+
+
+def _tirage(rng, valeurs, n, decroissance=0.75):
+    """ Tirage pondéré : les premières modalités sont les plus fréquentes (comme dans la réalité). """
+    poids = decroissance ** np.arange(len(valeurs))
+    return np.asarray(valeurs, dtype=object)[rng.choice(len(valeurs), size=n, p=poids / poids.sum())]
+
+
+def _natures(rng, nums, natures, max_par_entretien=3):
+    """ 0 à 3 natures distinctes par entretien, positions 1..k (clé primaire (num, pos)). """
+    nb = rng.choice(max_par_entretien + 1, size=len(nums), p=[0.15, 0.55, 0.22, 0.08])
+    num = np.repeat(nums, nb)
+    pos = np.arange(nb.sum()) - np.repeat(np.cumsum(nb) - nb, nb) + 1
+    # Tirage sans doublon par entretien : permutation décalée de pos
+    depart = rng.integers(0, len(natures), size=len(nums))
+    nature = np.asarray(natures, dtype=object)[(np.repeat(depart, nb) + pos - 1) % len(natures)]
+    return pd.DataFrame({"num": num, "pos": pos.astype("int16"), "nature": nature})
+
+
+def generer_donnees(n, annee_debut=2019, annee_fin=2025, graine=42):
+    """ Retourne (entretien, demande, solution) : DataFrames au format des tables SQL. """
+    rng = np.random.default_rng(graine)
+    nums = np.arange(1, n + 1)
+    debut, fin = pd.Timestamp(f"{annee_debut}-01-01"), pd.Timestamp(f"{annee_fin}-12-31")
+    jours = rng.integers(0, (fin - debut).days + 1, size=n)
+
+    entretien = pd.DataFrame({
+        "num": nums,
+        "date_ent": (debut + pd.to_timedelta(jours, unit="D")).date,
+        "mode": _tirage(rng, NOMENC['mode'].codes, n),
+        "duree": _tirage(rng, NOMENC['duree'].codes, n, 0.6),
+        "sexe": _tirage(rng, NOMENC['sexe'].codes, n, 0.9),
+        "age": _tirage(rng, [3, 4, 5, 2, 1], n),
+        "vient_pr": _tirage(rng, NOMENC['vient_pr'].codes, n, 0.4),
+        "sit_fam": _tirage(rng, NOMENC['sit_fam'].codes, n, 0.85),
+        "enfant": rng.integers(0, 5, size=n),
+        "modele_fam": _tirage(rng, NOMENC['modele_fam'].codes, n, 0.5),
+        "profession": _tirage(rng, NOMENC['profession'].codes, n, 0.9),
+        "ress": _tirage(rng, NOMENC['ress'].codes, n, 0.8),
+        "origine": _tirage(rng, NOMENC['origine'].codes, n, 0.85),
+        "commune": _tirage(rng, COMMUNES, n, 0.8),
+        "partenaire": _tirage(rng, PARTENAIRES, n, 0.7),
+    }).sort_values("date_ent", ignore_index=True)
+    entretien["num"] = nums
+
+    return entretien, _natures(rng, nums, NATURES_DEMANDE), _natures(rng, nums, NATURES_SOLUTION)
+
+
+def generer_classeur(chemin, n_par_mois, graine=42):
+    """ Écrit un classeur de 12 onglets mensuels au format attendu par Read_xl. """
+    rng = np.random.default_rng(graine)
+    colonnes = ["N°"] + list(LIBELLES_EXCEL)[:6] + ["Enfts", "Modèle fam.", "Prof°", "Ress. 1", "Origine",
+                                                   "Domicile", "Partenaire", "Dem.1", "Dem.2", "Sol.1", "Sol.2"]
+    with pd.ExcelWriter(chemin, engine="openpyxl") as writer:
+        for mois in MOIS:
+            corps = {"N°": np.arange(1, n_par_mois + 1)}
+            for col in colonnes[1:]:
+                if col in LIBELLES_EXCEL: corps[col] = _tirage(rng, LIBELLES_EXCEL[col], n_par_mois)
+            corps["Enfts"] = rng.integers(0, 5, size=n_par_mois)
+            corps["Domicile"] = _tirage(rng, COMMUNES, n_par_mois, 0.8)
+            corps["Partenaire"] = _tirage(rng, PARTENAIRES, n_par_mois, 0.7)
+            corps["Dem.1"] = _tirage(rng, NATURES_DEMANDE, n_par_mois)
+            corps["Dem.2"] = np.where(rng.random(n_par_mois) < 0.3, _tirage(rng, NATURES_DEMANDE, n_par_mois), None)
+            corps["Sol.1"] = _tirage(rng, NATURES_SOLUTION, n_par_mois)
+            corps["Sol.2"] = np.where(rng.random(n_par_mois) < 0.2, _tirage(rng, NATURES_SOLUTION, n_par_mois), None)
+            feuille = pd.DataFrame(corps)[colonnes]
+            # Deux lignes de titre au-dessus du tableau, comme dans les classeurs réels
+            titre = pd.DataFrame([[f"Entretiens {mois}"] + [None] * (len(colonnes) - 1), [None] * len(colonnes), colonnes])
+            pd.concat([titre, pd.DataFrame(feuille.values)], ignore_index=True).to_excel(writer, sheet_name=mois, header=False, index=False)
+    return chemin
@@ -0,0 +1,244 @@
+"""
+Résolution des communes saisies en texte libre vers le référentiel COMMUNE (CODE_C).
+
+Les noms sont normalisés (accents, casse, ponctuation, « St » / « Ste », code postal) puis
+cherchés dans un index en mémoire sur COMMUNE.NOM_C : égalité exacte, préfixe unique
+(« Theix » -> « Theix-Noyalo », pas un simple « Saint »), puis correspondance approchée (difflib)
+pour une faute de frappe sur un nom long : un nom court proche (« Plouray ») est une autre commune.
+Chaque nom distinct n'est résolu qu'une fois (cache mémoïsé) : appliquer la résolution à une
+colonne entière ne coûte qu'un passage par nom distinct.
+
+Seules les résolutions sûres (égalité, préfixe unique) sont enregistrées en base (CODE_C : import,
+formulaire, `renseigner_codes`) ; la correspondance approchée ne sert qu'à l'affichage du snapshot.
+
+`AgregatCommunes` : comptages (année, commune, agglomération) pré-joints, calculés une fois
+par snapshot et servis tels quels au tableau de bord.
+"""
+import difflib
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import nomenclature
+from instrumentation import mesurer_requete
+
+logger = logging.getLogger("mdd")
+
+SEUIL_FLOU = 0.95        # Ratio difflib minimal : une seule faute, sur un nom d'au moins 10 lettres
+TAILLE_CACHE = 10_000    # Noms distincts mémorisés avant remise à zéro
+LIB_HORS_AGGLO = "Hors agglo"
+LIB_INCONNUE = "Inc."
+FOURRE_TOUT = {"autre", "autres"}  # Entrées « Autre » du référentiel (noms normalisés) : pas une commune
+MOTS_GENERIQUES = {"saint", "sainte", "le", "la", "les", "l", "d", "de", "du", "des", "sur", "en"}  # Préfixes non distinctifs
+
+SQL_COMMUNES = """
+    SELECT c.code_c, c.nom_c, c.code_a, a.acronyme
+    FROM commune c LEFT JOIN agglo a ON a.code_a = c.code_a
+    ORDER BY c.code_c
+"""
+
+
+def normaliser_nom(nom):
+    """ 'Ste-Anne-d'Auray (56400)' -> 'sainte anne d auray' """
+    if nom is None or (isinstance(nom, float) and np.isnan(nom)): return ""
+    s = unicodedata.normalize("NFKD", str(nom)).encode("ascii", "ignore").decode().casefold()
+    s = re.sub(r"\b\d{5}\b|\bcedex\b", " ", s)
+    s = re.sub(r"[^a-z0-9]+", " ", s).strip()
+    s = re.sub(r"\bste\b", "sainte", re.sub(r"\bst\b", "saint", s))
+    return s if s not in ("nan", "none", "null") else ""
+
+
+# =============================================================================
+# 1. INDEX DES COMMUNES
+# =============================================================================
+class IndexCommunes:
+    """ `table` : DataFrame (code_c, nom_c, code_a, agglo), une ligne par commune du référentiel. """
+    def __init__(self, table, version=None):
+        self.table = table.reset_index(drop=True)
+        self.version = version
+        self._codes = pd.Index(self.table["code_c"].astype(int))
+        self._noms = self.table["nom_c"].to_numpy(dtype=object)
+        agglos = self.table["agglo"].astype(object).where(self.table["agglo"].notna(), LIB_HORS_AGGLO)
+        self._agglos = agglos.to_numpy(dtype=object)
+
+        self._exacts = {}
+        for code, nom in zip(self._codes, self._noms):
+            self._exacts.setdefault(normaliser_nom(nom), int(code))
+        self._cles = list(self._exacts)
+        self._cache = {}
+        self._verrou = threading.Lock()
+
+    def __len__(self):
+        return len(self.table)
+
+    def resoudre_un(self, nom, approche=True):
+        """ CODE_C d'un nom saisi, ou None s'il ne correspond à aucune commune (`approche=False` : résolution sûre seulement). """
+        cle = normaliser_nom(nom)
+        if not cle: return None
+        with self._verrou:
+            resolution = self._cache.get(cle)
+        if resolution is None:
+            resolution = self._resolution(cle)
+            with self._verrou:
+                if len(self._cache) >= TAILLE_CACHE: self._cache.clear()
+                self._cache[cle] = resolution
+        code, sure = resolution
+        return code if sure or approche else None
+
+    def _resolution(self, cle):
+        """ (CODE_C ou None, sûre) : égalité ou préfixe unique = sûre ; correspondance approchée = non. """
+        code = self._exacts.get(cle)
+        if code is not None: return code, True
+        prefixes = [k for k in self._cles if k.startswith(cle + " ")]
+        if len(prefixes) == 1 and not set(cle.split()) <= MOTS_GENERIQUES:
+            return self._exacts[prefixes[0]], True
+        proches = difflib.get_close_matches(cle, self._cles, n=2, cutoff=SEUIL_FLOU)
+        return (self._exacts[proches[0]] if len(proches) == 1 else None), False  # Ambiguë : non résolue
+
+    def resoudre(self, noms, approche=True):
+        """ Résolution en masse : un appel par nom distinct, diffusé sur toute la colonne. """
+        serie = pd.Series(noms, dtype=object)
+        uniques = pd.Index(serie.drop_duplicates())
+        trouves = np.array([self.resoudre_un(n, approche) for n in uniques] + [None], dtype=object)
+        return trouves[uniques.get_indexer(serie)]
+
+    def completer(self, codes, noms):
+        """ CODE_C déjà connus, complétés par résolution des noms là où ils manquent (float, NaN si non résolu). """
+        codes = pd.to_numeric(pd.Series(codes, dtype=object), errors='coerce').to_numpy(dtype=float, copy=True)
+        manquants = np.isnan(codes)
+        if manquants.any():
+            resolus = self.resoudre(np.asarray(noms, dtype=object)[manquants])
+            codes[manquants] = pd.to_numeric(pd.Series(resolus, dtype=object), errors='coerce')
+        return codes
+
+    def _prendre(self, valeurs, codes, defaut):
+        pos = self._codes.get_indexer(pd.to_numeric(pd.Series(codes, dtype=object), errors='coerce'))
+        return np.append(valeurs, defaut)[pos]
+
+    def noms(self, codes, defaut=None):
+        """ CODE_C -> NOM_C (vectorisé). """
+        return self._prendre(self._noms, codes, defaut)
+
+    def agglos(self, codes, defaut=LIB_INCONNUE):
+        """ CODE_C -> acronyme de l'agglomération (« Hors agglo » si la commune n'en a pas). """
+        return self._prendre(self._agglos, codes, defaut)
+
+
+def depuis_nomenclature():
+    """ Sans base : communes de la nomenclature (VALEURS_C), numérotées comme l'insertion de tables.ddl. """
+    noms = [n for n in nomenclature.courante()["commune"].codes if not n.upper().startswith("HORS")]
+    table = pd.DataFrame({"code_c": range(1, len(noms) + 1), "nom_c": noms, "code_a": None, "agglo": None})
+    return IndexCommunes(table, version="nomenclature")
+
+
+# =============================================================================
+# 2. CACHE (rechargé si le référentiel change en base)
+# =============================================================================
+_verrou = threading.Lock()
+_courant = None
+
+
+def courant():
+    global _courant
+    with _verrou:
+        if _courant is None: _courant = depuis_nomenclature()
+        return _courant
+
+
+def actualiser(conn):
+    """ Relit COMMUNE / AGGLO (quelques dizaines de lignes) ; l'index et son cache sont conservés s'ils sont inchangés. """
+    global _courant
+    actuel = courant()
+    try:
+        cur = conn.cursor()
+        cur.execute(SQL_COMMUNES)
+        lignes = [tuple(l) for l in cur.fetchall()]
+    except Exception:
+        conn.rollback()
+        logger.warning("Référentiel COMMUNE indisponible : index précédent conservé", exc_info=True)
+        return actuel
+    if not lignes: return actuel
+    version = hashlib.md5(repr(lignes).encode("utf-8")).hexdigest()
+    if version == actuel.version: return actuel
+    nouveau = IndexCommunes(pd.DataFrame(lignes, columns=["code_c", "nom_c", "code_a", "agglo"]), version)
+    with _verrou:
+        _courant = nouveau
+    return nouveau
+
+
+SQL_SANS_CODE = "SELECT DISTINCT commune FROM entretien WHERE code_c IS NULL AND COALESCE(TRIM(commune), '') <> ''"
+
+
+def renseigner_codes(conn, index=None):
+    """
+    Migration : renseigne en base ENTRETIEN.CODE_C là où il manque (saisies antérieures, référentiel
+    complété depuis), pour les seuls noms résolus sans ambiguïté ; les séries SERIE_ENTRETIEN
+    (triggers) regroupent alors ces communes comme le snapshot. Lancée par l'import (read_xl.py)
+    ou seule (`python communes.py`), jamais au chargement. Renvoie le nombre de noms résolus.
+    """
+    index = index or courant()
+    try:
+        cur = conn.cursor()
+        with mesurer_requete("communes_codes") as m:
+            cur.execute(SQL_SANS_CODE)
+            noms = [l[0] for l in cur.fetchall()]
+            resolus = index.resoudre(noms, approche=False)
+            paires = [(int(code), nom) for nom, code in zip(noms, resolus) if code is not None]
+            if paires:
+                cur.executemany("UPDATE entretien SET code_c = %s WHERE code_c IS NULL AND commune = %s", paires)
+                conn.commit()
+            m['lignes'] = len(paires)
+        return len(paires)
+    except Exception:
+        conn.rollback()
+        logger.warning("CODE_C non renseignés en base", exc_info=True)
+        return 0
+
+
+# =============================================================================
+# 3. AGRÉGAT PRÉ-JOINT POUR LE TABLEAU DE BORD
+# =============================================================================
+class AgregatCommunes:
+    """
+    Nombre d'entretiens par (Annee, Commune, Agglo), calculé une fois par snapshot.
+    Immuable : porté par `DataFrame.attrs` sans copie (comme les incidences).
+    """
+    def __init__(self, table):
+        self.table = table
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @classmethod
+    def depuis_snapshot(cls, df):
+        table = df.groupby(["Annee", "Commune", "Agglo"], sort=False).size().reset_index(name="Nombre")
+        return cls(table)
+
+    def filtrer(self, annee=None):
+        if annee in (None, "ALL"): return self.table
+        return self.table[self.table["Annee"] == annee]
+
+    def par_agglo(self, annee=None):
+        return self.filtrer(annee).groupby("Agglo")["Nombre"].sum().sort_values(ascending=False)
+
+    def top_commune(self, annee=None):
+        """ Commune la plus fréquente, hors commune inconnue et entrée fourre-tout « Autre ». """
+        t = self.filtrer(annee)
+        t = t[(t["Commune"] != "") & ~t["Commune"].map(normaliser_nom).isin(FOURRE_TOUT)]
+        return t.groupby("Commune")["Nombre"].sum().idxmax() if not t.empty else "-"
+
+
+if __name__ == "__main__":
+    # Migration ponctuelle des CODE_C manquants (DATABASE_URL, sinon config.json)
+    import json
+    import os
+    import psycopg2
+    if 'DATABASE_URL' in os.environ: conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    else: conn = psycopg2.connect(**json.load(open('config.json', 'r', encoding='utf-8'))['POSTGRES'])
+    print(f"{renseigner_codes(conn, actualiser(conn))} nom(s) de commune renseigné(s)")
+    conn.close()
@@ -0,0 +1,98 @@
+"""
+Tableaux croisés sur les variables codées de l'entretien.
+
+Chaque colonne est factorisée une seule fois par snapshot (codes entiers 0..k-1, -1 = manquant).
+Un croisement de 2 ou 3 variables est alors un unique np.bincount sur l'indice combiné,
+les marges (équivalent des GROUPING SETS) s'obtenant par sommes sur les axes du cube.
+Les résultats sont mis en cache par (variables, année) tant que le snapshot ne change pas.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+LIB_MANQUANT = "Inc."
+
+# Variables croisables : colonne de df_global -> libellé affiché
+VARIABLES = {
+    "mode": "Mode", "duree": "Durée", "sexe": "Sexe", "age": "Âge", "vient_pr": "Vient pour",
+    "sit_fam": "Situation familiale", "enfant": "Enfants", "modele_fam": "Modèle familial",
+    "profession": "Profession", "ress": "Ressources", "origine": "Origine",
+    "Commune": "Commune", "Agglo": "Agglomération", "Partenaire": "Partenaire", "Mois": "Mois",
+}
+
+
+class Croiseur:
+    """ Index de codes entiers sur un snapshot ; `transcos` : colonne -> {code: libellé}. """
+    def __init__(self, df, transcos=None):
+        self.df = df
+        self.transcos = transcos or {}
+        self._codes = {}
+        self._cache = {}
+        self._verrou = threading.Lock()
+        self._annees = pd.factorize(df['Annee']) if 'Annee' in df.columns else None
+
+    def _factoriser(self, col):
+        """ (codes int32 avec le manquant en dernière position, libellés) pour une colonne. """
+        if col not in self._codes:
+            serie = self.df[col]
+            if not pd.api.types.is_numeric_dtype(serie): serie = serie.replace("", np.nan)
+            codes, uniques = pd.factorize(serie, sort=True)
+            codes = codes.astype(np.int32)
+            table = self.transcos.get(col, {})
+            libelles = [str(table.get(u, table.get(str(u), u))) for u in uniques]
+            if (codes < 0).any():
+                codes[codes < 0] = len(uniques)
+                libelles.append(LIB_MANQUANT)
+            self._codes[col] = (codes, libelles)
+        return self._codes[col]
+
+    def croiser(self, colonnes, annee=None):
+        """
+        Cube de comptages pour 2 ou 3 colonnes, filtré sur `annee` ('ALL'/None = tout).
+        Retourne (cube ndarray int64, [libellés par axe]).
+        """
+        cle = (tuple(colonnes), annee)
+        with self._verrou:
+            if cle in self._cache: return self._cache[cle]
+
+            axes = [self._factoriser(c) for c in colonnes]
+            tailles = [len(lib) for _, lib in axes]
+            indice = np.zeros(len(self.df), dtype=np.int64)
+            for (codes, _), taille in zip(axes, tailles):
+                indice = indice * taille + codes
+            if annee not in (None, 'ALL') and self._annees is not None:
+                codes_annee, annees = self._annees
+                position = annees.get_indexer([annee])[0]
+                indice = indice[codes_annee == position] if position >= 0 else indice[:0]
+
+            cube = np.bincount(indice, minlength=int(np.prod(tailles))).reshape(tailles)
+            resultat = (cube, [lib for _, lib in axes])
+            self._cache[cle] = resultat
+            return resultat
+
+
+def vers_table(cube, libelles, colonnes, marges=True):
+    """
+    Format long (une ligne par combinaison non nulle) + lignes de totaux par
+    sous-ensemble de variables (ROLLUP : total général, totaux par 1re variable...).
+    """
+    noms = [VARIABLES.get(c, c) for c in colonnes]
+    idx = np.nonzero(cube)
+    table = pd.DataFrame({nom: np.asarray(lib, dtype=object)[i] for nom, lib, i in zip(noms, libelles, idx)})
+    table["Nombre"] = cube[idx]
+    if not marges: return table
+
+    totaux = []
+    for k in range(len(noms) - 1, -1, -1):
+        sous_cube = cube.sum(axis=tuple(range(k, len(noms))))
+        if k == 0:
+            bloc = pd.DataFrame({nom: ["Total"] for nom in noms})
+            bloc["Nombre"] = [int(sous_cube)]
+        else:
+            idx_k = np.nonzero(sous_cube)
+            bloc = pd.DataFrame({nom: np.asarray(lib, dtype=object)[i] for nom, lib, i in zip(noms[:k], libelles[:k], idx_k)})
+            for nom in noms[k:]: bloc[nom] = "Total"
+            bloc["Nombre"] = sous_cube[idx_k]
+        totaux.append(bloc)
+    return pd.concat([table] + totaux, ignore_index=True)
@@ -0,0 +1,203 @@
+"""
+File d'écriture des entretiens : validation groupée (group commit) des saisies simultanées.
+
+Chaque enregistrement du formulaire est placé dans une file ; un fil d'écriture unique
+les regroupe par lots (au plus TAILLE_LOT dossiers, DELAI_LOT secondes d'attente après la
+première soumission) et valide chaque lot en une seule transaction, sur une seule connexion.
+Un point de sauvegarde par dossier isole les erreurs : une saisie invalide est annulée seule,
+les autres dossiers du lot sont validés. Chaque appelant reçoit son numéro de dossier dès
+la validation du lot. Un appelant qui abandonne l'attente (DELAI_REPONSE) annule sa saisie si
+elle n'est pas encore écrite ; sinon il est prévenu qu'elle est en cours (pas de doublon en réessayant).
+
+Le snapshot n'est plus rechargé à chaque enregistrement. Chaque lot renvoie l'identifiant
+de sa transaction (txid_current) ; le snapshot mémorise l'instantané PostgreSQL pris avant sa
+lecture (`Instantane`) et n'est rechargé que si cette transaction n'y est pas visible. Les deux
+viennent de la base : la comparaison vaut quel que soit le worker qui a validé l'écriture.
+
+La file est propre au processus : avec plusieurs workers, chacun regroupe ses propres saisies.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as DelaiDepasse
+
+import instrumentation
+from instrumentation import mesurer_requete
+
+logger = logging.getLogger("mdd")
+
+TAILLE_LOT = 32      # Dossiers validés au plus par transaction
+DELAI_LOT = 0.02     # Attente maximale (s) pour compléter un lot après la première soumission
+DELAI_REPONSE = 30   # Attente maximale (s) de la validation par l'appelant
+
+SQL_TRANSACTION = "SELECT txid_current()"
+SQL_INSTANTANE = "SELECT txid_current_snapshot()::text"
+
+SQL_INSERT = """
+    INSERT INTO entretien (date_ent, mode, duree, sexe, age, vient_pr, sit_fam,
+                           enfant, modele_fam, profession, ress, origine, commune, partenaire, code_c)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING num;
+"""
+SQL_UPDATE = """
+    UPDATE entretien SET date_ent=%s, mode=%s, duree=%s, sexe=%s, age=%s, vient_pr=%s,
+    sit_fam=%s, enfant=%s, modele_fam=%s, profession=%s, ress=%s, origine=%s, commune=%s, partenaire=%s, code_c=%s
+    WHERE num = %s
+"""
+
+
+def ecrire_entretien(cur, data, update_id=None):
+    """ Écrit un dossier (entretien + une ligne par nature) dans la transaction de `cur` ; renvoie son numéro. """
+    valeurs = (data['date'], data['mode'], data['duree'], data['sexe'], data['age'],
+               data['vient'], data['sit'], data['enfant'], data['mod_fam'],
+               data['prof'], data['ress'], data['origine'], data['ville'], data['partenaire'], data.get('code_c'))
+    if update_id:
+        cur.execute(SQL_UPDATE, valeurs + (update_id,))
+        cur.execute("DELETE FROM demande WHERE num=%s", (update_id,))
+        cur.execute("DELETE FROM solution WHERE num=%s", (update_id,))
+        num = update_id
+    else:
+        cur.execute(SQL_INSERT, valeurs)
+        num = cur.fetchone()[0]
+
+    # Une ligne par nature (pos = rang de saisie)
+    if data['demandes']:
+        cur.executemany("INSERT INTO demande (num, pos, nature) VALUES (%s, %s, %s)",
+                        [(num, pos, nature) for pos, nature in enumerate(data['demandes'], start=1)])
+    if data['solutions']:
+        cur.executemany("INSERT INTO solution (num, pos, nature) VALUES (%s, %s, %s)",
+                        [(num, pos, nature) for pos, nature in enumerate(data['solutions'], start=1)])
+    return num
+
+
+def transaction_courante(cur):
+    """ Identifiant (txid) de la transaction en cours, ou None si la base ne le fournit pas. """
+    cur.execute("SAVEPOINT transaction")
+    try:
+        cur.execute(SQL_TRANSACTION)
+        txid = int(cur.fetchone()[0])
+    except Exception:
+        cur.execute("ROLLBACK TO SAVEPOINT transaction")
+        return None
+    cur.execute("RELEASE SAVEPOINT transaction")
+    return txid
+
+
+class Instantane:
+    """ Instantané PostgreSQL 'xmin:xmax:xip,...' : quelles transactions validées étaient visibles. """
+    def __init__(self, texte):
+        xmin, xmax, xip = str(texte).split(":")
+        self.xmin, self.xmax = int(xmin), int(xmax)
+        self.en_cours = {int(x) for x in xip.split(",") if x}
+
+    def couvre(self, txid):
+        return txid < self.xmin or (txid < self.xmax and txid not in self.en_cours)
+
+    @classmethod
+    def lire(cls, conn):
+        """ Instantané courant (à prendre AVANT la lecture des données), None si indisponible. """
+        try:
+            cur = conn.cursor()
+            cur.execute(SQL_INSTANTANE)
+            return cls(cur.fetchone()[0])
+        except Exception:
+            conn.rollback()
+            return None
+
+
+class Enregistrement:
+    """ Résultat d'une écriture validée : numéro du dossier et transaction du lot. """
+    def __init__(self, num, cree, transaction):
+        self.num, self.cree, self.transaction = num, cree, transaction
+
+
+class FileEcriture:
+    """ File d'écriture validée par lots ; `connexion` : fabrique de connexions psycopg2. """
+    def __init__(self, connexion, taille_lot=TAILLE_LOT, delai=DELAI_LOT):
+        self.connexion = connexion
+        self.taille_lot, self.delai = taille_lot, delai
+        self._file = queue.Queue()
+        self._fil = None
+        self._verrou = threading.Lock()
+
+    # --- Soumission ---
+    def soumettre(self, data, update_id=None):
+        """ Place un dossier dans la file ; le Future renvoie un Enregistrement une fois le lot validé. """
+        future = Future()
+        self._demarrer()
+        self._file.put((data, update_id, future))
+        return future
+
+    def enregistrer(self, data, update_id=None, timeout=DELAI_REPONSE):
+        """ Soumet puis attend la validation (lève l'erreur SQL du dossier ou du lot, TimeoutError au-delà de `timeout`). """
+        future = self.soumettre(data, update_id)
+        try:
+            return future.result(timeout=timeout)
+        except DelaiDepasse:
+            if future.cancel(): raise TimeoutError("Base de données trop lente : dossier NON enregistré, réessayez.")
+            raise TimeoutError("Enregistrement toujours en cours de validation : vérifiez le dossier avant de réessayer.")
+
+    def _demarrer(self):
+        with self._verrou:
+            if self._fil is None or not self._fil.is_alive():
+                self._fil = threading.Thread(target=self._boucle, name="mdd-ecriture", daemon=True)
+                self._fil.start()
+
+    # --- Fil d'écriture ---
+    def _boucle(self):
+        while True:
+            lot = self._lot()
+            try:
+                self._valider(lot)
+            except Exception:
+                logger.exception("❌ ERREUR file d'écriture")
+
+    def _lot(self):
+        """ Bloque jusqu'à la première soumission, puis complète le lot pendant au plus `delai`. """
+        lot = [self._file.get()]
+        fin = time.monotonic() + self.delai
+        while len(lot) < self.taille_lot:
+            reste = fin - time.monotonic()
+            if reste <= 0: break
+            try:
+                lot.append(self._file.get(timeout=reste))
+            except queue.Empty:
+                break
+        return lot
+
+    def _valider(self, lot):
+        """ Une transaction pour le lot, un point de sauvegarde par dossier. """
+        conn, resultats = None, []
+        try:
+            conn = self.connexion()
+            if conn is None: raise RuntimeError("Base de données indisponible")
+            cur = conn.cursor()
+            lot = [(data, update_id, future) for data, update_id, future in lot
+                   if future.set_running_or_notify_cancel()]  # Saisies abandonnées par l'appelant : ignorées
+            if not lot: return
+            with mesurer_requete("save_entretien") as m:
+                for data, update_id, future in lot:
+                    cur.execute("SAVEPOINT ecriture")
+                    try:
+                        num = ecrire_entretien(cur, data, update_id)
+                    except Exception as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT ecriture")
+                        future.set_exception(e)
+                        continue
+                    cur.execute("RELEASE SAVEPOINT ecriture")
+                    resultats.append((future, num, not update_id))
+                transaction = transaction_courante(cur)
+                conn.commit()
+                m['lignes'] = len(resultats)
+        except Exception as e:
+            if conn: conn.rollback()
+            for _, _, future in lot:
+                if not future.done(): future.set_exception(e)
+            return
+        finally:
+            if conn: conn.close()
+
+        instrumentation.incrementer("mdd_ecriture_lots_total")
+        for future, num, cree in resultats:
+            future.set_result(Enregistrement(num, cree, transaction))
@@ -0,0 +1,92 @@
+"""
+Incidence creuse entretien × nature (demandes ou solutions).
+
+Stockage COO compact : pour chaque couple (entretien, nature) distinct, la position de
+l'entretien dans le snapshot (int32) et l'indice de la nature (int16) dans le vocabulaire.
+Au sein d'un entretien, les natures restent dans l'ordre de saisie (POS) : la première
+est la demande / solution principale.
+Les statistiques par nature sont de simples np.bincount ; le croisement demande → solution
+est un produit AᵀB calculé par jointure sur la position de l'entretien.
+
+Les objets sont immuables : ils peuvent être portés par `DataFrame.attrs` (la copie
+profonde faite par pandas renvoie le même objet).
+"""
+import numpy as np
+import pandas as pd
+
+
+class Incidence:
+    def __init__(self, lignes, colonnes, natures, n_lignes, rangs=None):
+        # Tri par entretien, puis rang de saisie (à défaut : indice de la nature)
+        ordre = np.lexsort((colonnes if rangs is None else rangs, lignes))
+        self.lignes = np.asarray(lignes, dtype=np.int32)[ordre]
+        self.colonnes = np.asarray(colonnes, dtype=np.int16)[ordre]
+        self.natures = list(natures)
+        self.n_lignes = n_lignes
+        # Début de chaque ligne dans les tableaux triés (format CSR)
+        self._debuts = np.searchsorted(self.lignes, np.arange(n_lignes + 1))
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @classmethod
+    def depuis_table(cls, table, ids, natures_connues=()):
+        """
+        `table` : DataFrame (num, pos, nature) tel que lu en base ; `ids` : numéros
+        d'entretien dans l'ordre du snapshot. Les natures inconnues s'ajoutent au vocabulaire.
+        """
+        natures = pd.Index(list(natures_connues))
+        nature = table['nature'].astype(str).str.strip()
+        extra = pd.Index(nature.unique()).difference(natures)
+        natures = natures.append(extra.sort_values())
+
+        lignes = pd.Index(ids).get_indexer(table['num'])
+        colonnes = natures.get_indexer(nature)
+        garde = lignes >= 0
+        rangs = table['pos'].to_numpy() if 'pos' in table.columns else np.arange(len(table))
+        paires = pd.DataFrame({'l': lignes[garde], 'c': colonnes[garde], 'r': rangs[garde]})
+        paires = paires.sort_values('r', kind='stable').drop_duplicates(['l', 'c'])  # Doublon : premier rang conservé
+        return cls(paires['l'].to_numpy(), paires['c'].to_numpy(), natures, len(ids), paires['r'].to_numpy())
+
+    def _masque(self, positions):
+        if positions is None: return None
+        masque = np.zeros(self.n_lignes, dtype=bool)
+        masque[np.asarray(positions, dtype=np.int64)] = True
+        return masque[self.lignes]
+
+    def comptes(self, positions=None):
+        """ Nombre d'entretiens par nature (restreint aux `positions` du snapshot si fourni). """
+        m = self._masque(positions)
+        colonnes = self.colonnes if m is None else self.colonnes[m]
+        return pd.Series(np.bincount(colonnes, minlength=len(self.natures)), index=self.natures)
+
+    def natures_de(self, position):
+        """ Natures d'un entretien (position dans le snapshot), dans l'ordre de saisie. """
+        return [self.natures[c] for c in self.colonnes[self._debuts[position]:self._debuts[position + 1]]]
+
+    def cooccurrences(self, autre, positions=None):
+        """ Matrice natures(self) × natures(autre) : nb d'entretiens ayant les deux. """
+        a = pd.DataFrame({'l': self.lignes, 'i': self.colonnes})
+        b = pd.DataFrame({'l': autre.lignes, 'j': autre.colonnes})
+        m = self._masque(positions)
+        if m is not None: a = a[m]
+        paires = a.merge(b, on='l')
+        q = len(autre.natures)
+        cube = np.bincount(paires['i'].to_numpy(np.int64) * q + paires['j'].to_numpy(np.int64), minlength=len(self.natures) * q)
+        return pd.DataFrame(cube.reshape(len(self.natures), q), index=self.natures, columns=autre.natures)
+
+    def textes(self, libelles=None, sep=", "):
+        """
+        Texte par entretien (affichage table / export), dans l'ordre du snapshot.
+        Les combinaisons de natures distinctes étant peu nombreuses, chaque texte n'est
+        construit qu'une fois puis diffusé par np.unique(..., return_inverse=True).
+        """
+        noms = [(libelles or {}).get(n, n) for n in self.natures]
+        nb = np.diff(self._debuts)
+        largeur = int(nb.max()) if len(nb) else 0
+        combinaisons = np.full((self.n_lignes, max(largeur, 1)), -1, dtype=np.int32)
+        rang = np.arange(len(self.lignes)) - self._debuts[self.lignes]
+        combinaisons[self.lignes, rang] = self.colonnes
+        uniques, inverse = np.unique(combinaisons, axis=0, return_inverse=True)
+        textes = np.array([sep.join(noms[c] for c in combi if c >= 0) for combi in uniques], dtype=object)
+        return textes[inverse.ravel()]
@@ -0,0 +1,214 @@
+"""
+Instrumentation de l'application : durée des callbacks et des requêtes SQL, lignes chargées,
+octets renvoyés, fréquence des rechargements.
+
+- Métriques au format Prometheus sur la route /metrics (voir `instrumenter`).
+- Logs structurés (une ligne JSON par évènement) sur le logger 'mdd.metrics'.
+- Profilage optionnel par requête : MDD_PROFIL=1 écrit un fichier .prof (cProfile) par appel
+  de callback dans MDD_PROFIL_DIR (défaut : ./profils), exploitable en flame graph avec snakeviz
+  ou flameprof. L'en-tête `X-MDD-Profil: 1` n'est honoré que si MDD_PROFIL_HEADER=1 ; seuls les
+  MDD_PROFIL_MAX derniers fichiers (défaut : 200) sont conservés.
+
+Les compteurs sont propres au processus : avec plusieurs workers, chacun expose les siens.
+"""
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+logger = logging.getLogger("mdd.metrics")
+
+PROFILS_MAX = 200  # Fichiers .prof conservés par défaut (les plus anciens sont supprimés)
+
+# Bornes des histogrammes de durée (secondes)
+BORNES_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+AIDE = {
+    "mdd_callback_duree_secondes": ("histogram", "Durée de traitement d'un callback Dash"),
+    "mdd_callback_octets_total": ("counter", "Octets renvoyés par les callbacks Dash"),
+    "mdd_callback_erreurs_total": ("counter", "Callbacks terminés en erreur (HTTP >= 500)"),
+    "mdd_sql_duree_secondes": ("histogram", "Durée des requêtes SQL"),
+    "mdd_sql_lignes_total": ("counter", "Lignes lues ou écrites par les requêtes SQL"),
+    "mdd_sql_octets_total": ("counter", "Octets chargés en mémoire par les requêtes SQL"),
+    "mdd_sql_erreurs_total": ("counter", "Requêtes SQL en erreur"),
+    "mdd_rechargements_total": ("counter", "Rechargements complets du snapshot df_global"),
+    "mdd_snapshot_lignes": ("gauge", "Nombre de lignes du snapshot courant"),
+    "mdd_ecriture_lots_total": ("counter", "Lots d'écritures validés par la file d'écriture"),
+}
+
+_verrou = threading.Lock()
+_compteurs = {}   # (nom, labels) -> valeur
+_jauges = {}      # (nom, labels) -> valeur
+_histos = {}      # (nom, labels) -> [compte par borne..., somme, total]
+
+
+def _cle(nom, labels):
+    return nom, tuple(sorted(labels.items()))
+
+
+# =============================================================================
+# 1. ENREGISTREMENT
+# =============================================================================
+def incrementer(nom, valeur=1, **labels):
+    with _verrou:
+        cle = _cle(nom, labels)
+        _compteurs[cle] = _compteurs.get(cle, 0) + valeur
+
+
+def fixer(nom, valeur, **labels):
+    with _verrou:
+        _jauges[_cle(nom, labels)] = valeur
+
+
+def observer(nom, valeur, **labels):
+    with _verrou:
+        h = _histos.setdefault(_cle(nom, labels), [0] * (len(BORNES_DUREE) + 2))
+        for i, borne in enumerate(BORNES_DUREE):
+            if valeur <= borne: h[i] += 1
+        h[-2] += valeur
+        h[-1] += 1
+
+
+def journaliser(evenement, **champs):
+    """ Log structuré : une ligne JSON par évènement. """
+    logger.info(json.dumps({"evt": evenement, "ts": round(time.time(), 3), **champs}, ensure_ascii=False, default=str))
+
+
+def reinitialiser():
+    with _verrou:
+        _compteurs.clear()
+        _jauges.clear()
+        _histos.clear()
+
+
+@contextmanager
+def mesurer_requete(nom):
+    """
+    Chronomètre un bloc SQL. Le bloc peut renseigner m['lignes'] et m['octets'].
+        with mesurer_requete("load_entretiens") as m:
+            df = pd.read_sql_query(...); m['lignes'] = len(df)
+    """
+    m = {"lignes": 0, "octets": 0}
+    debut = time.perf_counter()
+    try:
+        yield m
+    except Exception as e:
+        incrementer("mdd_sql_erreurs_total", requete=nom)
+        journaliser("sql_erreur", requete=nom, erreur=str(e))
+        raise
+    finally:
+        duree = time.perf_counter() - debut
+        observer("mdd_sql_duree_secondes", duree, requete=nom)
+        incrementer("mdd_sql_lignes_total", m["lignes"], requete=nom)
+        incrementer("mdd_sql_octets_total", m["octets"], requete=nom)
+        journaliser("sql", requete=nom, duree_ms=round(duree * 1000, 2), lignes=m["lignes"], octets=m["octets"])
+
+
+# =============================================================================
+# 2. EXPOSITION PROMETHEUS
+# =============================================================================
+def _echapper(valeur):
+    return str(valeur).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_txt(labels, extra=()):
+    paires = list(labels) + list(extra)
+    if not paires: return ""
+    return "{" + ",".join(f'{k}="{_echapper(v)}"' for k, v in paires) + "}"
+
+
+def exposition():
+    """ Texte au format d'exposition Prometheus (version 0.0.4). """
+    with _verrou:
+        compteurs, jauges = dict(_compteurs), dict(_jauges)
+        histos = {k: list(v) for k, v in _histos.items()}
+
+    lignes = []
+    noms = sorted({k[0] for k in list(compteurs) + list(jauges) + list(histos)})
+    for nom in noms:
+        type_m, aide = AIDE.get(nom, ("untyped", nom))
+        lignes += [f"# HELP {nom} {aide}", f"# TYPE {nom} {type_m}"]
+        for (n, labels), val in sorted(compteurs.items()):
+            if n == nom: lignes.append(f"{nom}{_labels_txt(labels)} {val}")
+        for (n, labels), val in sorted(jauges.items()):
+            if n == nom: lignes.append(f"{nom}{_labels_txt(labels)} {val}")
+        for (n, labels), h in sorted(histos.items()):
+            if n != nom: continue
+            for borne, compte in zip(BORNES_DUREE, h):
+                lignes.append(f"{nom}_bucket{_labels_txt(labels, [('le', borne)])} {compte}")
+            lignes.append(f"{nom}_bucket{_labels_txt(labels, [('le', '+Inf')])} {h[-1]}")
+            lignes.append(f"{nom}_sum{_labels_txt(labels)} {h[-2]}")
+            lignes.append(f"{nom}_count{_labels_txt(labels)} {h[-1]}")
+    return "\n".join(lignes) + "\n"
+
+
+# =============================================================================
+# 3. BRANCHEMENT SUR L'APPLICATION DASH
+# =============================================================================
+def _profil_actif():
+    if os.environ.get("MDD_PROFIL") == "1": return True
+    # En-tête client : seulement si explicitement autorisé côté serveur
+    return os.environ.get("MDD_PROFIL_HEADER") == "1" and request.headers.get("X-MDD-Profil") == "1"
+
+
+def _purger_profils(dossier):
+    """ Ne garde que les MDD_PROFIL_MAX fichiers .prof les plus récents. """
+    maximum = int(os.environ.get("MDD_PROFIL_MAX", PROFILS_MAX))
+    profils = sorted((e for e in os.scandir(dossier) if e.name.endswith(".prof")), key=lambda e: e.stat().st_mtime)
+    for entree in profils[:max(len(profils) - maximum, 0)]:
+        try:
+            os.remove(entree.path)
+        except OSError:
+            pass
+
+
+def instrumenter(app):
+    """ Chronomètre chaque appel /_dash-update-component et ajoute la route /metrics. """
+    server = app.server
+
+    def nom_callback(sortie):
+        entree = app.callback_map.get(sortie, {})
+        return getattr(entree.get("callback"), "__name__", sortie)
+
+    @server.before_request
+    def _debut_callback():
+        if not request.path.endswith("/_dash-update-component"): return
+        g.mdd_debut = time.perf_counter()
+        g.mdd_profil = None
+        if _profil_actif():
+            g.mdd_profil = cProfile.Profile()
+            g.mdd_profil.enable()
+
+    @server.after_request
+    def _fin_callback(response):
+        if "mdd_debut" not in g: return response
+        duree = time.perf_counter() - g.mdd_debut
+        corps = request.get_json(silent=True) or {}
+        nom = nom_callback(corps.get("output", "?"))
+        octets = response.calculate_content_length() or 0
+
+        observer("mdd_callback_duree_secondes", duree, callback=nom)
+        incrementer("mdd_callback_octets_total", octets, callback=nom)
+        if response.status_code >= 500: incrementer("mdd_callback_erreurs_total", callback=nom)
+        journaliser("callback", callback=nom, duree_ms=round(duree * 1000, 2), octets=octets, statut=response.status_code)
+
+        if g.mdd_profil is not None:
+            g.mdd_profil.disable()
+            dossier_profils = os.environ.get("MDD_PROFIL_DIR", "profils")
+            os.makedirs(dossier_profils, exist_ok=True)
+            chemin = os.path.join(dossier_profils, f"{time.strftime('%Y%m%d-%H%M%S')}_{nom}_{int(duree * 1000)}ms.prof")
+            g.mdd_profil.dump_stats(chemin)
+            _purger_profils(dossier_profils)
+            journaliser("profil", callback=nom, fichier=chemin)
+        return response
+
+    @server.route("/metrics")
+    def _metrics():
+        return Response(exposition(), mimetype="text/plain; version=0.0.4")
+
+    return app
@@ -0,0 +1,236 @@
+"""
+Nomenclature des variables codées (code BDD <-> libellé), source unique pour l'import Excel,
+le chargement du snapshot et les listes déroulantes du formulaire.
+
+Les modalités sont lues une fois dans les tables de métadonnées MODALITE / VALEURS_C
+(peuplées par tables.ddl à partir des COMMENT ON COLUMN). Si ces tables sont absentes ou
+vides, les mêmes commentaires sont relus directement dans tables.ddl.
+
+Chaque variable est compilée en tables de correspondance indexées :
+- code -> libellé : tableau indexé par le code (codes entiers) ou pd.Index.get_indexer (codes texte) ;
+- libellé / alias / code saisi -> code : pd.Index des formes normalisées.
+Le décodage d'une colonne entière est donc un seul accès vectorisé, sans dict par ligne.
+
+La nomenclature compilée est mise en cache avec sa version (empreinte md5 des métadonnées) :
+`actualiser(conn)` ne recharge que si la version en base a changé.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("mdd")
+
+FICHIER_DDL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables.ddl")
+TYPES_ENTIERS = ("SMALLINT", "INTEGER", "BIGINT", "SERIAL")
+
+# Formes abrégées rencontrées dans les classeurs Excel, par variable
+# (les libellés officiels et les codes eux-mêmes sont reconnus sans être listés ici)
+ALIAS = {
+    "mode": {"Tel": 3},
+    "duree": {"<15min": 1, "-5min": 1, "15/30min": 2, "0/45 min": 4, "5/60min": 4, "+60min": 5, ">30min": 5},
+    "sexe": {"Pro": 4},
+    "age": {"-8ans": 1, "18/5ans": 2, "26/40ans": 3, "1/60ans": 4, "+60ans": 5},
+    "vient_pr": {"Persmor": 5},
+    "sit_fam": {"Célib": "1", "Sép /s mm toit": "5f", "Parisolé": "5e"},
+    "modele_fam": {"Tradi": 1, "Monop": 2, "Recomp": 3},
+    "profession": {"Sco/étud": 1, "Scolaire": 1, "Pêch/agri": 2, "Chef ent": 3, "Ddeur emploi": 10, "Sss prof°": 11},
+    "ress": {"Revenus pro": 2, "Retraite/rév": 3, "Chômage": 4, "AAH": 6, "Bourse": 8},
+    "origine": {"Bouche à oreille": "1a", "Internet": "1b"},
+}
+
+
+def normaliser(valeurs):
+    """ Forme de comparaison : sans espaces superflus, casse ignorée, '3.0' -> '3'. """
+    s = pd.Series(valeurs, dtype=object).astype(str).str.strip().str.casefold()
+    return s.str.replace(r"\s+", " ", regex=True).str.replace(r"^(\d+)\.0$", r"\1", regex=True)
+
+
+def nom_variable(table, colonne):
+    """ ENTRETIEN.MODE -> 'mode' ; DEMANDE.NATURE -> 'demande'. """
+    return colonne.lower() if table.upper() == "ENTRETIEN" else table.lower()
+
+
+# =============================================================================
+# 1. VARIABLE COMPILÉE
+# =============================================================================
+class Codage:
+    """ Modalités d'une variable, dans l'ordre de la nomenclature. """
+    def __init__(self, nom, codes, libelles, entier=False, alias=None):
+        self.nom, self.entier = nom, entier
+        self.codes = [int(c) for c in codes] if entier else [str(c) for c in codes]
+        self.libelles = list(libelles)
+        self._index = pd.Index(self.codes)
+        if entier and self.codes:
+            # Table indexée par le code : position de la modalité, -1 si le code n'existe pas
+            self._lut = np.full(max(self.codes) + 1, -1, dtype=np.int32)
+            self._lut[self.codes] = np.arange(len(self.codes))
+        else:
+            self._lut = np.empty(0, dtype=np.int32)
+
+        # Saisies reconnues : codes, libellés puis alias (la première forme rencontrée l'emporte)
+        formes = pd.Series(self.codes + self.codes + list((alias or {}).values()), dtype=object)
+        cles = normaliser([str(c) for c in self.codes] + self.libelles + list((alias or {}))).to_numpy()
+        garde = ~pd.Index(cles).duplicated()
+        self._saisies = pd.Index(cles[garde])
+        self._saisies_codes = formes.to_numpy()[garde]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def positions(self, valeurs):
+        """ Position de chaque code dans la nomenclature (-1 : manquant ou inconnu). """
+        if self.entier:
+            v = pd.to_numeric(pd.Series(valeurs, dtype=object), errors='coerce').to_numpy(dtype=float)
+            ok = np.isfinite(v) & (v >= 0) & (v < len(self._lut)) & (v == np.floor(v))
+            pos = np.full(len(v), -1, dtype=np.int32)
+            pos[ok] = self._lut[v[ok].astype(np.int64)]
+            return pos
+        brut = pd.Series(valeurs, dtype=object)
+        return self._index.get_indexer(brut.where(brut.isna(), brut.astype(str).str.strip()))
+
+    def decoder(self, valeurs, defaut=None):
+        """ Codes -> libellés (`defaut` pour manquant / inconnu). Série en entrée -> Série en sortie. """
+        table = np.array(self.libelles + [defaut], dtype=object)
+        libelles = table[self.positions(valeurs)]  # -1 désigne la dernière case : `defaut`
+        return pd.Series(libelles, index=valeurs.index) if isinstance(valeurs, pd.Series) else libelles
+
+    def encoder(self, valeurs):
+        """ Libellés, alias ou codes saisis -> codes BDD (None si non reconnu). """
+        pos = self._saisies.get_indexer(normaliser(valeurs))
+        codes = np.append(self._saisies_codes, None)[pos]
+        return pd.Series(codes, index=valeurs.index) if isinstance(valeurs, pd.Series) else codes
+
+    def valider(self, code):
+        """ Code canonique (int ou str) si `code` appartient à la nomenclature, sinon None. """
+        if code is None: return None
+        pos = self.positions([code])[0]
+        return self.codes[pos] if pos >= 0 else None
+
+    def libelle(self, code, defaut=None):
+        pos = self.positions([code])[0]
+        return self.libelles[pos] if pos >= 0 else defaut
+
+    def en_dict(self):
+        return dict(zip(self.codes, self.libelles))
+
+    def options(self):
+        """ Options de liste déroulante : valeur = code BDD, libellé affiché. """
+        return [{'label': lib, 'value': code} for code, lib in zip(self.codes, self.libelles)]
+
+
+class Nomenclature:
+    def __init__(self, variables, version, source):
+        self.variables, self.version, self.source = variables, version, source
+
+    def __getitem__(self, nom):
+        return self.variables[nom]
+
+    def __contains__(self, nom):
+        return nom in self.variables
+
+    @classmethod
+    def compiler(cls, lignes, version, source):
+        """ `lignes` : (variable, type SQL, code, libellé), triées dans l'ordre de la nomenclature. """
+        variables = {}
+        df = pd.DataFrame(lignes, columns=["variable", "type", "code", "libelle"])
+        for nom, g in df.groupby("variable", sort=False):
+            entier = str(g["type"].iloc[0]).upper().startswith(TYPES_ENTIERS)
+            variables[nom] = Codage(nom, g["code"].str.strip(), g["libelle"].str.strip(), entier, ALIAS.get(nom))
+        return cls(variables, version, source)
+
+
+# =============================================================================
+# 2. SOURCES : MÉTADONNÉES EN BASE, OU COMMENTAIRES DE tables.ddl
+# =============================================================================
+SQL_VERSION = """
+    SELECT md5(COALESCE((SELECT string_agg(concat_ws('|', tab, pos, code, pos_m, lib_m), ';' ORDER BY tab, pos, code) FROM modalite), '')
+            || COALESCE((SELECT string_agg(concat_ws('|', tab, pos, pos_c, lib), ';' ORDER BY tab, pos, pos_c) FROM valeurs_c), '')),
+           (SELECT COUNT(*) FROM modalite)
+"""
+
+SQL_MODALITES = """
+    SELECT m.tab, c.column_name, c.data_type, m.code, m.lib_m, m.pos, m.pos_m
+    FROM modalite m
+    JOIN information_schema.columns c
+      ON c.table_schema = 'public' AND UPPER(c.table_name) = m.tab AND c.ordinal_position = m.pos
+    UNION ALL
+    SELECT v.tab, c.column_name, c.data_type, v.lib, v.lib, v.pos, v.pos_c
+    FROM valeurs_c v
+    JOIN information_schema.columns c
+      ON c.table_schema = 'public' AND UPPER(c.table_name) = v.tab AND c.ordinal_position = v.pos
+    ORDER BY 1, 6, 7
+"""
+
+
+def depuis_base(conn, version):
+    cur = conn.cursor()
+    cur.execute(SQL_MODALITES)
+    lignes = [(nom_variable(tab, col), typ, code, lib) for tab, col, typ, code, lib, _, _ in cur.fetchall()]
+    return Nomenclature.compiler(lignes, version, "base") if lignes else None
+
+
+def depuis_ddl(chemin=FICHIER_DDL):
+    """ Même extraction que la partie 4 de tables.ddl, appliquée au texte du fichier. """
+    with open(chemin, encoding="utf-8") as f:
+        texte = f.read()
+    types = {}
+    for table, corps in re.findall(r"CREATE TABLE (\w+)\s*\((.*?)\n\);", texte, re.S):
+        for colonne, typ in re.findall(r"^\s*(\w+)\s+([A-Z]+)", corps, re.M):
+            types[(table.upper(), colonne.upper())] = typ.upper()
+
+    lignes = []
+    for table, colonne, commentaire in re.findall(r"COMMENT ON COLUMN (\w+)\.(\w+) IS '((?:[^']|'')*)';", texte):
+        liste = re.search(r"\((.*)\)\s*,", commentaire.replace("''", "'"))
+        if not liste: continue
+        typ = types.get((table.upper(), colonne.upper()), "VARCHAR")
+        elements = [e.strip() for e in liste.group(1).split(";")]
+        if any(" : " in e for e in elements):  # MODALITE (« code : libellé »)
+            paires = [e.split(" : ", 1) for e in elements if " : " in e]
+        elif not typ.startswith(TYPES_ENTIERS):  # VALEURS_C (liste simple : code = libellé)
+            paires = [(e, e) for e in elements if e]
+        else:
+            continue  # Plage numérique (ENFANT) : pas de modalités
+        lignes += [(nom_variable(table, colonne), typ, code, lib) for code, lib in paires]
+    version = "ddl:" + hashlib.md5(texte.encode("utf-8")).hexdigest()
+    return Nomenclature.compiler(lignes, version, "ddl")
+
+
+# =============================================================================
+# 3. CACHE VERSIONNÉ
+# =============================================================================
+_verrou = threading.Lock()
+_courante = None
+
+
+def courante():
+    """ Nomenclature en cache (tables.ddl tant qu'aucune base n'a été consultée). """
+    global _courante
+    with _verrou:
+        if _courante is None: _courante = depuis_ddl()
+        return _courante
+
+
+def actualiser(conn):
+    """ Compare la version des métadonnées en base à celle du cache ; recompile si elle a changé. """
+    global _courante
+    actuelle = courante()
+    try:
+        cur = conn.cursor()
+        cur.execute(SQL_VERSION)
+        version, nb = cur.fetchone()
+        if not nb or version == actuelle.version: return actuelle
+        nouvelle = depuis_base(conn, version)
+    except Exception:
+        conn.rollback()
+        logger.warning("Métadonnées MODALITE indisponibles : nomenclature de tables.ddl conservée", exc_info=True)
+        return actuelle
+    if nouvelle is None: return actuelle
+    with _verrou:
+        _courante = nouvelle
+    logger.info("Nomenclature rechargée (%s variables, version %s)", len(nouvelle.variables), version)
+    return nouvelle
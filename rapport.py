@@ -0,0 +1,295 @@
+"""
+Rapport statistique annuel, piloté par les métadonnées VARIABLE / RUBRIQUE / MODALITE.
+
+Toutes les variables rattachées à une rubrique sont comptées en une seule requête :
+un GROUPING SETS par table (ENTRETIEN, DEMANDE, SOLUTION) réunis par UNION ALL, soit un
+seul passage sur chaque table. Pour chaque variable, deux ensembles : (période, variable)
+et (variable) ; plus (période) et () pour le nombre d'entretiens. La période est le mois
+pour un rapport annuel, l'année pour le rapport pluriannuel.
+
+Le résultat long (table, colonne, valeur, période, nombre) est mis en forme par variable
+(modalités dans l'ordre de la nomenclature, zéros compris) puis écrit dans un classeur :
+une feuille de synthèse et une feuille par rubrique. Sans base, les mêmes comptages sont
+calculés sur le snapshot et les métadonnées relues dans tables.ddl.
+"""
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+import nomenclature
+from instrumentation import mesurer_requete
+
+logger = logging.getLogger("mdd")
+
+LIB_NON_RENSEIGNE = "Non renseigné"
+LIB_TOTAL = "Total"
+NOMS_MOIS = ["Janv", "Févr", "Mars", "Avr", "Mai", "Juin", "Juil", "Août", "Sept", "Oct", "Nov", "Déc"]
+EXCLUES = {("ENTRETIEN", "NUM"), ("ENTRETIEN", "DATE_ENT")}  # Identifiant et axe du temps
+
+# Expression SQL d'une colonne quand la valeur brute ne suffit pas
+EXPRESSIONS = {
+    ("ENTRETIEN", "COMMUNE"): "COALESCE(c.nom_c, NULLIF(TRIM(e.commune), ''))",  # Nom du référentiel si résolue
+    ("ENTRETIEN", "PARTENAIRE"): "NULLIF(TRIM(e.partenaire), '')",
+    ("ENTRETIEN", "SIT_FAM"): "NULLIF(TRIM(e.sit_fam), '')",
+    ("ENTRETIEN", "ORIGINE"): "NULLIF(TRIM(e.origine), '')",
+}
+# Colonne correspondante du snapshot (df_global)
+COLONNES_SNAPSHOT = {"COMMUNE": "Commune", "PARTENAIRE": "Partenaire"}
+
+SQL_VARIABLES = """
+    SELECT v.tab, v.lib, v.commentaire, v.type_v, v.mois_debut_validite, v.mois_fin_validite, r.pos, r.lib
+    FROM variable v JOIN rubrique r ON r.pos = v.rubrique
+    ORDER BY r.pos, v.pos
+"""
+
+
+class Variable:
+    def __init__(self, tab, colonne, libelle, type_v, rubrique, pos_rubrique=0, mois_debut=1, mois_fin=12):
+        self.tab, self.colonne = tab.upper(), colonne.upper()
+        self.libelle = libelle or colonne.capitalize()
+        self.type_v, self.rubrique, self.pos_rubrique = type_v, rubrique, pos_rubrique
+        self.mois_debut, self.mois_fin = int(mois_debut or 1), int(mois_fin or 12)
+
+    @property
+    def cle(self):
+        return (self.tab, self.colonne)
+
+    @property
+    def nom(self):
+        """ Nom de la variable dans la nomenclature ('mode', 'demande'...). """
+        return nomenclature.nom_variable(self.tab, self.colonne)
+
+
+def libelle_commentaire(commentaire):
+    """ "Mode de l'entretien (1 : RDV;...)" -> "Mode de l'entretien" """
+    return re.split(r"\s+\(|\s+Valeur par défaut", commentaire or "")[0].strip()
+
+
+# =============================================================================
+# 1. MÉTADONNÉES
+# =============================================================================
+def _filtrer(variables):
+    return [v for v in variables if v.cle not in EXCLUES]
+
+
+def variables_base(conn):
+    cur = conn.cursor()
+    cur.execute(SQL_VARIABLES)
+    return _filtrer([Variable(tab, col, libelle_commentaire(com), typ, rub, pos_r, debut, fin)
+                     for tab, col, com, typ, debut, fin, pos_r, rub in cur.fetchall()])
+
+
+def variables_ddl(chemin=nomenclature.FICHIER_DDL):
+    """ Même lecture que la partie 4 de tables.ddl : rubrique en fin de commentaire, ENFANT numérique. """
+    with open(chemin, encoding="utf-8") as f:
+        texte = f.read()
+    rubriques = re.search(r"INSERT INTO RUBRIQUE \(LIB\) VALUES(.*?);", texte, re.S).group(1)
+    positions = {lib.replace("''", "'"): i + 1 for i, lib in enumerate(re.findall(r"\('((?:[^']|'')*)'\)", rubriques))}
+    variables = []
+    for table, colonne, commentaire in re.findall(r"COMMENT ON COLUMN (\w+)\.(\w+) IS '((?:[^']|'')*)';", texte):
+        commentaire = commentaire.replace("''", "'")
+        rubrique = re.search(r"Rubrique (.*)$", commentaire)
+        if not rubrique: continue
+        type_v = "NUM" if colonne.upper() == "ENFANT" else "CHAINE" if colonne.upper() in ("COMMUNE", "PARTENAIRE") else "MOD"
+        rub = rubrique.group(1).strip()
+        variables.append(Variable(table, colonne, libelle_commentaire(commentaire), type_v, rub, positions.get(rub, 0)))
+    variables.sort(key=lambda v: (v.pos_rubrique, v.tab != "ENTRETIEN"))
+    return _filtrer(variables)
+
+
+# =============================================================================
+# 2. COMPTAGES : UNE REQUÊTE GROUPING SETS
+# =============================================================================
+def _valide(v, expression, annee):
+    """ Hors de la période de validité de la variable (rapport annuel), la valeur n'est pas comptée. """
+    if annee is None or (v.mois_debut, v.mois_fin) == (1, 12): return expression
+    return f"CASE WHEN EXTRACT(MONTH FROM e.date_ent) BETWEEN {v.mois_debut} AND {v.mois_fin} THEN {expression} END"
+
+
+def requete(variables, annee=None):
+    """ (requête, paramètres) : colonnes tab, colonne, valeur (texte), periode (NULL = toute la période), nombre. """
+    periode = "EXTRACT(MONTH FROM e.date_ent)::int" if annee else "EXTRACT(YEAR FROM e.date_ent)::int"
+    filtre = "e.date_ent >= %(debut)s AND e.date_ent < %(fin)s" if annee else "e.date_ent IS NOT NULL"
+    params = {'debut': f"{annee}-01-01", 'fin': f"{int(annee) + 1}-01-01"} if annee else {}
+
+    entretien = [v for v in variables if v.tab == "ENTRETIEN"]
+    n = len(entretien)
+    colonnes = ",\n               ".join(
+        f"({_valide(v, EXPRESSIONS.get(v.cle, 'e.' + v.colonne.lower()), annee)})::text AS v{i}" for i, v in enumerate(entretien))
+    # GROUPING(v0..vn-1) : bit à 1 pour chaque colonne absente de l'ensemble ; un seul bit à 0 = variable comptée
+    tous = (1 << n) - 1
+    masques = [tous ^ (1 << (n - 1 - i)) for i in range(n)]
+    grouping = f"GROUPING({', '.join(f'v{i}' for i in range(n))})"
+    cas_colonne = " ".join(f"WHEN {m} THEN '{v.colonne}'" for m, v in zip(masques, entretien))
+    cas_valeur = " ".join(f"WHEN {m} THEN v{i}" for i, m in enumerate(masques))
+    ensembles = ", ".join(f"(periode, v{i}), (v{i})" for i in range(n))
+    parties = [f"""
+        SELECT 'ENTRETIEN' AS tab, CASE {grouping} {cas_colonne} ELSE '' END AS colonne,
+               CASE {grouping} {cas_valeur} END AS valeur,
+               CASE WHEN GROUPING(periode) = 0 THEN periode END AS periode, COUNT(*) AS nombre
+        FROM (
+            SELECT {periode} AS periode,
+               {colonnes}
+            FROM entretien e LEFT JOIN commune c ON c.code_c = e.code_c
+            WHERE {filtre}
+        ) x
+        GROUP BY GROUPING SETS ({ensembles}, (periode), ())"""]
+    for v in variables:
+        if v.tab == "ENTRETIEN": continue
+        parties.append(f"""
+        SELECT '{v.tab}', '{v.colonne}', valeur, CASE WHEN GROUPING(periode) = 0 THEN periode END, COUNT(*)
+        FROM (
+            SELECT {periode} AS periode, {_valide(v, 'TRIM(t.' + v.colonne.lower() + ')', annee)} AS valeur
+            FROM {v.tab.lower()} t JOIN entretien e ON e.num = t.num
+            WHERE {filtre}
+        ) x
+        GROUP BY GROUPING SETS ((periode, valeur), (valeur))""")
+    return "\nUNION ALL".join(parties), params
+
+
+def comptages_base(conn, variables, annee=None):
+    sql, params = requete(variables, annee)
+    cur = conn.cursor()
+    with mesurer_requete("rapport") as m:
+        cur.execute(sql, params)
+        comptes = pd.DataFrame(cur.fetchall(), columns=["tab", "colonne", "valeur", "periode", "nombre"])
+        m['lignes'] = len(comptes)
+    comptes["periode"] = pd.to_numeric(comptes["periode"], errors='coerce')
+    return comptes
+
+
+def _texte(valeurs):
+    """ Même rendu que ::text en SQL : entiers sans '.0', chaînes nettoyées, None si vide. """
+    brut = pd.Series(valeurs, dtype=object)
+    nombres = pd.to_numeric(brut, errors='coerce')
+    entiers = nombres.notna() & (nombres == np.floor(nombres))
+    texte = brut.astype(str).str.strip().where(brut.notna(), None)
+    texte = texte.where(~entiers, nombres.where(entiers).astype("Int64").astype(str))
+    return texte.where(texte.notna() & (texte != "") & (texte != "nan"), None)
+
+
+def comptages_snapshot(df, variables, annee=None):
+    """ Mêmes comptages (format long) calculés sur le snapshot. """
+    dates = pd.to_datetime(df['date_ent'], errors='coerce')
+    garde = ((dates.dt.year == int(annee)) if annee else dates.notna()).to_numpy()
+    periodes = (dates.dt.month if annee else dates.dt.year).to_numpy()
+
+    blocs = []
+    def compter(tab, colonne, valeurs, periode):
+        t = pd.DataFrame({"valeur": valeurs, "periode": periode})
+        par_periode = t.groupby(["periode", "valeur"], dropna=False).size().reset_index(name="nombre")
+        total = t.groupby("valeur", dropna=False).size().reset_index(name="nombre")
+        blocs.append(pd.concat([par_periode, total.assign(periode=np.nan)]).assign(tab=tab, colonne=colonne))
+
+    for v in variables:
+        mois = dates.dt.month.to_numpy()
+        valide = (mois >= v.mois_debut) & (mois <= v.mois_fin) if annee else np.ones(len(df), dtype=bool)
+        if v.tab == "ENTRETIEN":
+            colonne = COLONNES_SNAPSHOT.get(v.colonne, v.colonne.lower())
+            if colonne not in df.columns: continue
+            valeurs = _texte(df[colonne].where(valide)).to_numpy()
+            compter(v.tab, v.colonne, valeurs[garde], periodes[garde])
+        else:
+            incidence = df.attrs.get('demandes' if v.tab == "DEMANDE" else 'solutions')
+            if incidence is None: continue
+            retenues = (garde & valide)[incidence.lignes]
+            natures = np.asarray(incidence.natures, dtype=object)[incidence.colonnes[retenues]]
+            lignes = incidence.lignes[retenues]
+            compter(v.tab, v.colonne, natures, periodes[lignes])
+
+    t = pd.DataFrame({"periode": periodes[garde]})
+    total = t.groupby("periode").size().reset_index(name="nombre")
+    blocs.append(pd.concat([total, pd.DataFrame({"nombre": [int(garde.sum())], "periode": [np.nan]})])
+                 .assign(tab="ENTRETIEN", colonne="", valeur=None))
+    comptes = pd.concat(blocs, ignore_index=True)[["tab", "colonne", "valeur", "periode", "nombre"]]
+    comptes["valeur"] = comptes["valeur"].astype(object).where(comptes["valeur"].notna(), None)
+    return comptes
+
+
+# =============================================================================
+# 3. MISE EN FORME
+# =============================================================================
+def entetes(periodes, annee):
+    return [NOMS_MOIS[int(p) - 1] if annee else str(int(p)) for p in periodes]
+
+
+def tableau_variable(v, comptes, periodes, annee=None):
+    """ Modalités × périodes (+ Total, %), modalités de la nomenclature en premier, zéros compris. """
+    sous = comptes[(comptes["tab"] == v.tab) & (comptes["colonne"] == v.colonne)]
+    sous = sous.assign(valeur=sous["valeur"].fillna(LIB_NON_RENSEIGNE), periode=sous["periode"].fillna(0))
+    large = sous.pivot_table(index="valeur", columns="periode", values="nombre", aggfunc="sum", fill_value=0)
+    large = large.reindex(columns=[0] + list(periodes), fill_value=0)
+
+    nomenc = nomenclature.courante()
+    codage = nomenc[v.nom] if v.nom in nomenc and v.type_v == "MOD" else None
+    if codage is not None:
+        codes = [str(c) for c in codage.codes]
+        autres = [x for x in large.index if x not in codes and x != LIB_NON_RENSEIGNE]
+        ordre = codes + sorted(autres) + ([LIB_NON_RENSEIGNE] if LIB_NON_RENSEIGNE in large.index else [])
+        large = large.reindex(ordre, fill_value=0)
+        large.index = [codage.libelle(x, x) if x != LIB_NON_RENSEIGNE else x for x in large.index]
+    elif v.type_v == "NUM":
+        large = large.loc[sorted(large.index, key=lambda x: (x == LIB_NON_RENSEIGNE, pd.to_numeric(x, errors='coerce')))]
+    else:
+        large = large.sort_values(0, ascending=False)
+
+    table = large[list(periodes)].set_axis(entetes(periodes, annee), axis=1)
+    table[LIB_TOTAL] = large[0]
+    total = table.sum()
+    table["%"] = (100 * table[LIB_TOTAL] / total[LIB_TOTAL]).round(1) if total[LIB_TOTAL] else 0.0
+    table.loc[LIB_TOTAL] = list(total) + [100.0 if total[LIB_TOTAL] else 0.0]
+    table.index.name = "Modalité"
+    return table
+
+
+def construire(variables, comptes, annee=None):
+    """ {'Synthèse': DataFrame, rubrique: [(Variable, DataFrame)], ...} dans l'ordre des rubriques. """
+    periodes = list(range(1, 13)) if annee else sorted(int(p) for p in comptes["periode"].dropna().unique())
+    totaux = comptes[(comptes["tab"] == "ENTRETIEN") & (comptes["colonne"] == "")]
+    par_periode = totaux.dropna(subset=["periode"]).set_index("periode")["nombre"].reindex(periodes, fill_value=0)
+    synthese = pd.DataFrame([list(par_periode) + [int(totaux[totaux["periode"].isna()]["nombre"].sum())]],
+                            columns=entetes(periodes, annee) + [LIB_TOTAL], index=pd.Index(["Entretiens"], name=""))
+    rapport = {"Synthèse": synthese}
+    for v in variables:
+        rapport.setdefault(v.rubrique, []).append((v, tableau_variable(v, comptes, periodes, annee)))
+    return rapport
+
+
+def ecrire_classeur(cible, rapport, titre):
+    """ Une feuille de synthèse puis une feuille par rubrique (un bloc titré par variable). """
+    from openpyxl.styles import Font
+
+    with pd.ExcelWriter(cible, engine="openpyxl") as writer:
+        for feuille, contenu in rapport.items():
+            nom = re.sub(r"[\[\]:*?/\\]", " ", feuille)[:31]
+            blocs = [(titre, contenu)] if isinstance(contenu, pd.DataFrame) else [(v.libelle, t) for v, t in contenu]
+            ligne = 0
+            for entete, table in blocs:
+                table.to_excel(writer, sheet_name=nom, startrow=ligne + 1)
+                cellule = writer.sheets[nom].cell(row=ligne + 1, column=1, value=entete)
+                cellule.font = Font(bold=True, size=12)
+                ligne += len(table) + 4
+            writer.sheets[nom].column_dimensions["A"].width = 45
+
+
+def generer(cible, df=None, conn=None, annee=None):
+    """ Rapport de `annee` (mois en colonnes) ou de toutes les années ; en base si `conn`, sinon sur `df`. """
+    annee = None if annee in (None, "ALL", "Inconnue") else str(annee)
+    variables = comptes = None
+    if conn is not None:
+        try:
+            variables = variables_base(conn)
+            comptes = comptages_base(conn, variables, annee)
+        except Exception:
+            conn.rollback()
+            logger.warning("Rapport : base indisponible, comptages sur le snapshot", exc_info=True)
+            variables = comptes = None
+    if comptes is None:
+        if df is None or df.empty: raise ValueError("Aucune donnée pour le rapport")
+        variables = variables_ddl()
+        comptes = comptages_snapshot(df, variables, annee)
+    titre = f"Activité {annee}" if annee else "Activité toutes années"
+    ecrire_classeur(cible, construire(variables, comptes, annee), titre)
+    return comptes
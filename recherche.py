@@ -0,0 +1,144 @@
+"""
+Recherche plein texte des entretiens (vue « Données »).
+
+En base, RECHERCHE_ENTRETIEN (tables.ddl) porte un document par entretien — commune,
+partenaire, libellés des demandes / solutions et de l'origine — indexé en GIN :
+- tsvector : chaque mot saisi est cherché comme préfixe (« vann » -> Vannes), tous requis ;
+- pg_trgm (si installé) : correspondance approchée en complément (fautes de frappe).
+Les résultats sont classés (ts_rank pondéré A/B/C, puis date décroissante) et paginés
+par LIMIT / OFFSET ; un numéro de dossier saisi seul est aussi cherché tel quel.
+
+Sans base ou sans cette table, la même recherche (préfixes, tous les mots requis) est faite
+sur le snapshot. Les réponses sont mémorisées par (texte, page) pour le snapshot courant.
+"""
+import logging
+import re
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import nomenclature
+from instrumentation import mesurer_requete
+
+logger = logging.getLogger("mdd")
+
+LIMITE = 500          # Résultats renvoyés par page de recherche
+TAILLE_CACHE = 256    # Recherches mémorisées par snapshot avant remise à zéro
+COLONNES_DOCUMENT = ['Ville', 'Partenaire', 'Demandes', 'Solutions']
+
+SQL_TRGM = "SELECT to_regclass('idx_recherche_trgm') IS NOT NULL"
+
+SQL_RECHERCHE = """
+    WITH trouves AS (
+        SELECT r.num, r.date_ent, {score} AS score
+        FROM recherche_entretien r CROSS JOIN to_tsquery('simple', %(requete)s) q
+        WHERE r.vecteur @@ q {approche} OR r.num = %(num)s
+    )
+    SELECT num, score, (SELECT COUNT(*) FROM trouves) AS total
+    FROM trouves
+    ORDER BY score DESC, date_ent DESC NULLS LAST, num DESC
+    LIMIT %(limite)s OFFSET %(decalage)s
+"""
+
+
+def mots(texte):
+    """ 'Ste-Anne, Vannes' -> ['ste', 'anne', 'vannes'] (minuscules sans accents). """
+    s = unicodedata.normalize("NFKD", str(texte or "")).encode("ascii", "ignore").decode().lower()
+    return re.findall(r"[a-z0-9]+", s)
+
+
+def requete_sql(texte, trigrammes=False, limite=LIMITE, decalage=0):
+    """ (requête, paramètres) : mots en préfixes obligatoires, approximation trigramme en option. """
+    termes = mots(texte)
+    approche = "OR %(texte)s <%% r.document" if trigrammes else ""
+    score = "ts_rank(r.vecteur, q)" + (" + word_similarity(%(texte)s, r.document)" if trigrammes else "")
+    params = {
+        'requete': " & ".join(f"{t}:*" for t in termes),
+        'texte': " ".join(termes),
+        'num': int(termes[0]) if len(termes) == 1 and termes[0].isdigit() else None,
+        'limite': limite, 'decalage': decalage,
+    }
+    return SQL_RECHERCHE.format(score=score, approche=approche), params
+
+
+class Resultat:
+    """ Numéros d'entretien classés (une page) et nombre total de correspondances. """
+    def __init__(self, nums, total, source):
+        self.nums, self.total, self.source = list(nums), int(total), source
+
+    def __len__(self):
+        return len(self.nums)
+
+
+class Recherche:
+    """ Recherche sur le snapshot `df` : en base si possible, sinon dans le snapshot lui-même. """
+    def __init__(self, df, connexion=None):
+        self.df = df
+        self.connexion = connexion
+        self._documents = None
+        self._trigrammes = None
+        self._cache = {}
+        self._verrou = threading.Lock()
+
+    def rechercher(self, texte, limite=LIMITE, decalage=0):
+        cle = (" ".join(mots(texte)), limite, decalage)
+        if not cle[0]: return Resultat([], 0, "vide")
+        with self._verrou:
+            if cle in self._cache: return self._cache[cle]
+        resultat = self._en_base(texte, limite, decalage)
+        if resultat is None: resultat = self._en_memoire(texte, limite, decalage)
+        with self._verrou:
+            if len(self._cache) >= TAILLE_CACHE: self._cache.clear()
+            self._cache[cle] = resultat
+        return resultat
+
+    def _en_base(self, texte, limite, decalage):
+        try:
+            conn = self.connexion() if self.connexion else None
+        except Exception:
+            conn = None
+        if conn is None: return None
+        try:
+            cur = conn.cursor()
+            if self._trigrammes is None:
+                cur.execute(SQL_TRGM)
+                self._trigrammes = bool(cur.fetchone()[0])
+            requete, params = requete_sql(texte, self._trigrammes, limite, decalage)
+            with mesurer_requete("recherche") as m:
+                cur.execute(requete, params)
+                lignes = cur.fetchall()
+                m['lignes'] = len(lignes)
+            return Resultat([l[0] for l in lignes], lignes[0][2] if lignes else 0, "base")
+        except Exception:
+            conn.rollback()
+            logger.warning("RECHERCHE_ENTRETIEN indisponible : recherche dans le snapshot", exc_info=True)
+            return None
+        finally:
+            conn.close()
+
+    def documents(self):
+        """ Texte normalisé par entretien du snapshot (construit une fois). """
+        if self._documents is None:
+            parties = [self.df[c].fillna("").astype(str) for c in COLONNES_DOCUMENT if c in self.df.columns]
+            if 'origine' in self.df.columns:
+                parties.append(nomenclature.courante()['origine'].decoder(self.df['origine'], "").astype(str))
+            texte = parties[0].str.cat(parties[1:], sep=" ") if parties else pd.Series("", index=self.df.index)
+            texte = texte.str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii").str.lower()
+            self._documents = " " + texte.str.replace(r"[^a-z0-9]+", " ", regex=True)
+        return self._documents
+
+    def _en_memoire(self, texte, limite, decalage):
+        """ Tous les mots requis (en début de mot) ; classement par nombre d'occurrences puis ordre du snapshot. """
+        documents, termes = self.documents(), mots(texte)
+        score = np.ones(len(documents))
+        for t in termes:
+            score *= documents.str.count(" " + re.escape(t)).to_numpy()
+        if len(termes) == 1 and termes[0].isdigit() and 'id' in self.df.columns:
+            score = np.where(self.df['id'].to_numpy() == int(termes[0]), score + 1, score)
+        trouves = np.flatnonzero(score > 0)
+        trouves = trouves[np.argsort(-score[trouves], kind="stable")]
+        page = trouves[decalage:decalage + limite]
+        nums = self.df['id'].to_numpy()[page] if 'id' in self.df.columns else page
+        return Resultat([int(n) for n in nums], len(trouves), "snapshot")
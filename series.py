@@ -0,0 +1,161 @@
+"""
+Séries temporelles du nombre d'entretiens pour la vue « Évolution ».
+
+La table SERIE_ENTRETIEN (tables.ddl) est tenue à jour par des triggers sur ENTRETIEN :
+un comptage par (grain, période, dimension, valeur) avec
+- grain : 'J' jour, 'S' semaine (lundi), 'M' mois ;
+- dimension : 'total', 'mode', 'partenaire' ou 'commune' (valeur = code ou texte, '' si absent).
+Une courbe se lit donc en une requête sur quelques centaines de lignes, quel que soit le
+nombre d'entretiens. Sans cette table (base ancienne, tests), la même série est recalculée
+depuis le snapshot.
+
+`Series` met en cache chaque (grain, dimension) pour le snapshot courant.
+"""
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import mesurer_requete
+
+logger = logging.getLogger("mdd")
+
+GRAINS = {'J': "Jour", 'S': "Semaine", 'M': "Mois"}
+DIMENSIONS = {'total': "Total", 'mode': "Mode", 'partenaire': "Partenaire", 'commune': "Commune"}
+FENETRE_DEFAUT = {'J': 7, 'S': 4, 'M': 3}
+LIB_AUTRES = "Autres"
+
+SQL_SERIE = """
+    SELECT periode, valeur, nombre FROM serie_entretien
+    WHERE grain = %s AND dimension = %s AND nombre <> 0
+    ORDER BY periode
+"""
+
+
+# =============================================================================
+# 1. LIBELLÉS DE PÉRIODE (une mise en forme par valeur distincte, pas par ligne)
+# =============================================================================
+def _formater(cles, format_cle, vide):
+    codes, uniques = pd.factorize(cles)
+    libelles = np.array([format_cle(int(u)) for u in uniques] + [vide], dtype=object)
+    return libelles[codes]  # -1 (date manquante) -> `vide`
+
+
+def libelles_annee(dates, vide="Inconnue"):
+    return _formater(pd.Series(dates).dt.year, str, vide)
+
+
+def libelles_mois(dates, vide=None):
+    dates = pd.Series(dates)
+    return _formater(dates.dt.year * 100 + dates.dt.month, lambda k: f"{k // 100}-{k % 100:02d}", vide)
+
+
+def debut_periode(dates, grain):
+    """ Premier jour du jour / de la semaine (lundi) / du mois contenant chaque date. """
+    jours = pd.Series(dates).dt.normalize()
+    if grain == 'S': return jours - pd.to_timedelta(jours.dt.weekday, unit='D')
+    if grain == 'M': return jours - pd.to_timedelta(jours.dt.day - 1, unit='D')
+    return jours
+
+
+def annee_periode(periodes, grain):
+    """ Année d'une période ; pour les semaines, année ISO (le lundi 30/12/2024 ouvre la semaine 1 de 2025). """
+    dates = pd.DatetimeIndex(periodes)
+    return np.asarray(dates.isocalendar().year if grain == 'S' else dates.year, dtype=int)
+
+
+# =============================================================================
+# 2. SOURCES
+# =============================================================================
+def depuis_base(conn, grain, dimension):
+    cur = conn.cursor()
+    cur.execute(SQL_SERIE, (grain, dimension))
+    serie = pd.DataFrame(cur.fetchall(), columns=["periode", "valeur", "nombre"])
+    serie["periode"] = pd.to_datetime(serie["periode"])
+    return serie.astype({"valeur": object, "nombre": int})
+
+
+def _valeurs_dimension(df, dimension):
+    """ Même codage que le trigger : code en texte, '' si absent. """
+    if dimension == 'total': return pd.Series("", index=df.index, dtype=object)
+    if dimension == 'partenaire': return df['Partenaire'].astype(str).str.strip().astype(object)
+    codes = pd.to_numeric(df['mode' if dimension == 'mode' else 'code_c'], errors='coerce')
+    return pd.Series(_formater(codes, str, ""), index=df.index, dtype=object)
+
+
+def depuis_snapshot(df, grain, dimension):
+    dates = pd.to_datetime(df['date_ent'], errors='coerce')
+    t = pd.DataFrame({"periode": debut_periode(dates, grain), "valeur": _valeurs_dimension(df, dimension)})
+    t = t[dates.notna()]
+    serie = t.groupby(["periode", "valeur"]).size().reset_index(name="nombre").sort_values("periode", ignore_index=True)
+    return serie.astype({"valeur": object, "nombre": int})
+
+
+class Series:
+    """ Séries du snapshot `df`, lues en base par (grain, dimension) puis conservées en mémoire. """
+    def __init__(self, df, connexion=None):
+        self.df = df
+        self.connexion = connexion
+        self._cache = {}
+        self._verrou = threading.Lock()
+
+    def serie(self, grain, dimension):
+        cle = (grain, dimension)
+        with self._verrou:
+            if cle not in self._cache: self._cache[cle] = self._charger(grain, dimension)
+            return self._cache[cle]
+
+    def _charger(self, grain, dimension):
+        try:
+            conn = self.connexion() if self.connexion else None
+        except Exception:
+            conn = None
+        if conn is not None:
+            try:
+                with mesurer_requete("serie_entretien") as m:
+                    serie = depuis_base(conn, grain, dimension)
+                    m['lignes'] = len(serie)
+                if not serie.empty or self.df.empty: return serie
+            except Exception:
+                conn.rollback()
+                logger.warning("SERIE_ENTRETIEN indisponible : série recalculée depuis le snapshot", exc_info=True)
+            finally:
+                conn.close()
+        return depuis_snapshot(self.df, grain, dimension)
+
+
+# =============================================================================
+# 3. MISES EN FORME
+# =============================================================================
+def periodes_completes(debut, fin, grain):
+    frequence = {'J': 'D', 'S': 'W-MON', 'M': 'MS'}[grain]
+    return pd.date_range(debut, fin, freq=frequence, name="periode")
+
+
+def tableau(serie, grain, libelles=None, top=8):
+    """
+    Format large : une colonne par valeur (les `top` plus fréquentes, le reste dans « Autres »),
+    une ligne par période, périodes vides à 0 (pour que la moyenne mobile compte bien des périodes).
+    """
+    if serie.empty: return pd.DataFrame(index=pd.DatetimeIndex([], name="periode"))
+    totaux = serie.groupby("valeur")["nombre"].sum().sort_values(ascending=False)
+    gardees = totaux.index[:top]
+    valeur = serie["valeur"].where(serie["valeur"].isin(gardees), LIB_AUTRES)
+    large = serie.assign(valeur=valeur).pivot_table(index="periode", columns="valeur", values="nombre", aggfunc="sum", fill_value=0)
+    large = large.reindex(periodes_completes(large.index.min(), large.index.max(), grain), fill_value=0)
+    large = large[[v for v in list(gardees) + [LIB_AUTRES] if v in large.columns]]
+    return large.rename(columns=lambda v: (libelles or {}).get(v, v) if v != LIB_AUTRES else v)
+
+
+def moyenne_mobile(large, fenetre):
+    return large.rolling(max(int(fenetre or 1), 1), min_periods=1).mean()
+
+
+def glissement_annuel(large, grain):
+    """ Total par période réparti en une ligne par année : rang dans l'année (mois, semaine ISO, jour) en abscisse. """
+    total = large.sum(axis=1)
+    dates = total.index
+    rang = {'M': dates.month, 'S': dates.isocalendar().week.to_numpy(), 'J': dates.dayofyear}[grain]
+    annees = annee_periode(dates, grain).astype(str)  # Semaine ISO : année et numéro pris ensemble
+    return pd.DataFrame({"Annee": annees, "Rang": np.asarray(rang, dtype=int), "Nombre": total.to_numpy()})
@@ -8,10 +8,11 @@ from dash import no_update
 # 1. TESTS DE CONFIGURATION (Dictionnaires)
 # =============================================================================
 def test_transco_dictionaries_integrity():
-    """Vérifie les dictionnaires de traduction."""
-    assert app.TRANSCO_MODE[1] == "RDV"
-    assert app.REV_MODE["RDV"] == 1
-    assert app.TRANSCO_SEXE[1] == "Homme"
+    """Vérifie la nomenclature utilisée par le formulaire."""
+    assert app.code_saisie('mode', 1.0) == 1
+    assert app.code_saisie('sit_fam', None, "7") == "7"
+    assert {'label': 'RDV', 'value': 1} in app.options_codes('in-mode')
+    assert {'label': 'Non renseigné', 'value': 12} in app.options_codes('in-prof')
 
 # =============================================================================
 # 2. TESTS LOGIQUE MÉTIER (Load / Save / Excel)
@@ -40,29 +41,62 @@ def mock_db_data():
         'origine': ['1a', None],
         'commune': ['Vannes', 'Auray'],
         'partenaire': ['CAF', ''],
-        
-        # Colonnes textes pour Demandes/Solutions (aggrégées par SQL normalement)
-        'demande_txt': ['Logement', ''],
-        'solution_txt': ['Avocat', '']
+        'code_c': [None, None], # Saisies antérieures à CODE_C : résolues au chargement
     })
 
-def test_load_data_logic(mocker, mock_db_data):
+@pytest.fixture
+def mock_db_natures():
+    """Tables demande / solution brutes : une ligne par (num, pos)."""
+    demandes = pd.DataFrame({'num': [101, 101, 102], 'pos': [1, 2, 1], 'nature': ['1b', '7b', 'Logement']})
+    solutions = pd.DataFrame({'num': [101], 'pos': [1], 'nature': ['4a']})
+    return demandes, solutions
+
+@pytest.fixture
+def snapshot_charge(monkeypatch, mocker, mock_db_data, mock_db_natures):
+    """Charge le snapshot (load_data_from_db sur les tables simulées) dans app.df_global ; tables remplaçables."""
+    def charger(entretiens=None, natures=None):
+        mocker.patch('app.get_db_connection', return_value=MagicMock())
+        mocker.patch('pandas.read_sql_query', side_effect=[mock_db_data if entretiens is None else entretiens, *(natures or mock_db_natures)])
+        monkeypatch.setattr(app, 'df_global', app.load_data_from_db())
+        return app.df_global
+    return charger
+
+def test_load_data_logic(snapshot_charge):
     """Teste le chargement et la TRANSFORMATION des données."""
-    mocker.patch('app.get_db_connection', return_value=MagicMock())
-    # On simule que SQL retourne nos données brutes
-    mocker.patch('pandas.read_sql_query', return_value=mock_db_data)
-    
-    df = app.load_data_from_db()
+    # SQL simulé : données brutes (entretien, demande, solution)
+    df = snapshot_charge()
     
     # Vérifications
     assert not df.empty
-    assert 'Ville' in df.columns # Vérifie le renommage commune -> Ville
+    assert 'Ville' in df.columns and 'Commune' in df.columns # Texte saisi + nom du référentiel
     assert 'id' in df.columns    # Vérifie le renommage num -> id
     
     # Vérifie que le mapping a fonctionné ET que le tri est bon
     # Index 0 doit être le plus récent (2023-02-01) donc "RDV"
     assert df.iloc[0]['Mode_Lib'] == "RDV"
 
+    # Demandes / solutions : incidence par nature, texte d'affichage dérivé
+    assert df.attrs['demandes'].comptes().to_dict()['1b'] == 1
+    assert df.attrs['demandes'].natures_de(0) == ['1b', '7b']
+    assert df.iloc[0]['Demandes'] == "Famille Séparation, Pénal Victime"
+    assert df.iloc[1]['Solutions'] == ""
+
+    # Communes résolues sur le référentiel ; agrégat pré-joint pour le tableau de bord
+    assert df['code_c'].notna().all()
+    assert df.attrs['communes'].top_commune() in {"Vannes", "Auray"}
+    assert df.attrs['communes'].filtrer('2023')['Nombre'].sum() == 2
+
+def test_commune_saisie_conservee(snapshot_charge, mock_db_data):
+    """'Ville' garde le texte saisi (pré-remplissage, enregistrement) ; 'Commune' affiche le référentiel."""
+    snapshot_charge(mock_db_data.assign(commune=['vannes (56000)', 'Plouray']))
+
+    assert list(app.df_global['Ville']) == ['vannes (56000)', 'Plouray']
+    assert list(app.df_global['Commune']) == ['Vannes', 'Plouray']  # Plouray n'est pas Plouay
+    # Chargement en lecture seule : aucune écriture des CODE_C résolus
+    curseur = app.get_db_connection.return_value.cursor.return_value
+    assert not curseur.executemany.called and not app.get_db_connection.return_value.commit.called
+    assert app.populate_form(101)[6] == 'vannes (56000)' and app.populate_form(102)[6] == 'Plouray'
+
 def test_save_entretien_db_logic(mocker):
     """Teste la logique SQL (Insert/Update)."""
     mock_conn = MagicMock()
@@ -74,45 +108,54 @@ def test_save_entretien_db_logic(mocker):
     data = {'date': '2023-01-01', 'mode': 1, 'duree': 2, 'sexe': 1, 'age': 3, 
             'vient': 1, 'sit': '4', 'enfant': 0, 'mod_fam': 1, 'prof': 6, 
             'ress': 1, 'origine': '1a', 'ville': 'Vannes', 'partenaire': '', 
-            'demande_txt': '', 'solution_txt': ''}
+            'demandes': ['1a', '7b'], 'solutions': []}
 
     # Test INSERT
-    success, msg = app.save_entretien_db(data, update_id=None)
+    success, msg, transaction = app.save_entretien_db(data, update_id=None)
     assert success is True
     assert "créé" in msg
+    # Une ligne demande par nature, requête paramétrée
+    mock_cursor.executemany.assert_called_once_with(
+        "INSERT INTO demande (num, pos, nature) VALUES (%s, %s, %s)", [(999, 1, '1a'), (999, 2, '7b')])
 
     # Test UPDATE
-    success, msg = app.save_entretien_db(data, update_id=999)
+    success, msg, transaction = app.save_entretien_db(data, update_id=999)
     assert success is True
     assert "modifié" in msg
 
-def test_export_excel_callback(mocker):
+def test_export_excel_callback(monkeypatch, mocker):
     """Teste le bouton Excel."""
-    app.df_global = pd.DataFrame({'A': [1, 2]})
+    monkeypatch.setattr(app, 'df_global', pd.DataFrame({'A': [1, 2]}))
     res = app.export_excel_callback(1)
     assert res['filename'] == "export_mdd_vannes.xlsx"
 
-def test_display_page():
-    """Teste la navigation."""
-    hide, show, hide2 = app.display_page("/data")
-    assert show == {'display': 'block'}
-    hide, hide2, show = app.display_page("/input")
-    assert show == {'display': 'block'}
-    show, hide, hide2 = app.display_page("/")
-    assert show == {'display': 'block'}
+def test_export_rapport(mocker, snapshot_charge):
+    """Le rapport annuel est généré sur le snapshot quand la base est indisponible."""
+    snapshot_charge()
+    mocker.patch('app.get_db_connection', return_value=None)
+    res = app.export_rapport(1, '2023')
+    assert res['filename'] == "rapport_mdd_vannes_2023.xlsx" and res['base64']
+
+def test_callbacks_clientside():
+    """Navigation, boutons Modifier/Supprimer et choix de vue : gérés côté client (aucun aller-retour)."""
+    clientside = [cb['output'] for cb in app.app._callback_list if cb.get('clientside_function')]
+    assert "..view-dashboard.style...view-data.style...view-input.style.." in clientside
+    assert "..btn-edit-mode.disabled...btn-delete.disabled.." in clientside
+    assert "..store-view.data...btn-act.color...btn-cli.color...btn-evo.color...btn-cro.color...crosstab-panel.style...evolution-panel.style.." in clientside
+    assert not hasattr(app, 'display_page')
 
-def test_populate_form(mock_db_data, mocker):
+def test_populate_form(monkeypatch, mock_db_data, mocker):
     """Teste le pré-remplissage du formulaire."""
     # 1. On prépare les données comme si elles sortaient de load_data_from_db
     # (Il faut renommer 'num' en 'id' et ajouter les libellés, car populate_form utilise df_global)
     df_processed = mock_db_data.copy()
-    df_processed.rename(columns={'num': 'id', 'commune': 'Ville', 'partenaire': 'Partenaire', 'demande_txt': 'Demandes', 'solution_txt': 'Solutions'}, inplace=True)
+    df_processed.rename(columns={'num': 'id', 'commune': 'Ville', 'partenaire': 'Partenaire'}, inplace=True)
     
     # On ajoute les colonnes calculées manquantes pour éviter tout bug
     df_processed['Mode_Lib'] = "RDV"
     
     # On injecte dans l'app
-    app.df_global = df_processed
+    monkeypatch.setattr(app, 'df_global', df_processed)
     
     # Cas 1 : ID Inexistant
     res = app.populate_form(None)
@@ -121,8 +164,72 @@ def test_populate_form(mock_db_data, mocker):
     # Cas 2 : ID Existant (101)
     res = app.populate_form(101)
     assert "Modification" in res[0]
-    assert res[2] == "RDV" # Mode
+    assert res[2] == 1 # Mode (code BDD, valeur de la liste déroulante)
+    assert res[8] == "4" and res[9] == 1 # Situation, modèle familial
     assert res[6] == "Vannes" # Ville
+    assert res[15] == [] and res[16] == [] # Pas d'incidence chargée
+
+def test_populate_form_natures(snapshot_charge):
+    """Les natures de l'entretien pré-remplissent les listes ; les hors-nomenclature sont ajoutées aux options."""
+    snapshot_charge()
+
+    res = app.populate_form(102)
+    assert res[15] == ['Logement']
+    assert {'label': 'Logement', 'value': 'Logement'} in res[17]
+    res = app.populate_form(101)
+    assert res[15] == ['1b', '7b'] and res[16] == ['4a']
+
+def test_recherche_table(monkeypatch, mocker, snapshot_charge):
+    """La recherche filtre la table sans recharger le snapshot ; pagination côté serveur."""
+    snapshot_charge()
+    mocker.patch('app.get_db_connection', return_value=None)  # Recherche dans le snapshot
+    charger = mocker.patch('app.load_data_from_db')
+    mocker.patch('app.ctx').triggered_id = "search-input"
+
+    lignes, pages, page, selection, resume = app.refresh_table(0, "pénal")
+    assert [l['id'] for l in lignes] == [101] and resume == "1 résultat(s)" and (pages, page) == (1, 0)
+    lignes, pages, page, selection, resume = app.refresh_table(0, "")
+    assert len(lignes) == 2 and resume == ""
+
+    # Pagination serveur : page demandée -> LIMIT / OFFSET de la recherche, sélection remise à zéro
+    monkeypatch.setattr(app, 'TAILLE_PAGE', 1)
+    app.ctx.triggered_id = "data-table"
+    rechercher = mocker.spy(app.obtenir_recherche(), 'rechercher')
+    lignes, pages, page, selection, resume = app.refresh_table(0, "pénal", 1)
+    rechercher.assert_called_once_with("pénal", limite=1, decalage=1)
+    assert (lignes, pages, page, selection, resume) == ([], 1, 1, [], "1 résultat(s)")
+    lignes, pages, page, _, _ = app.refresh_table(0, "", 1)
+    assert [l['id'] for l in lignes] == [102] and pages == 2
+    charger.assert_not_called()
+
+def test_graphes_natures(monkeypatch, snapshot_charge):
+    """Top demandes et croisement demande -> solution sur le snapshot filtré."""
+    snapshot_charge()
+
+    (row,) = app.graphes_natures(app.df_global)
+    fig_top, fig_croise = [col.children.figure for col in row.children]
+    assert "Pénal Victime" in list(fig_top.data[0].y)
+    assert fig_croise.data[0].z.sum() == 2  # 101 : (1b, 4a) et (7b, 4a)
+    assert app.graphes_natures(app.df_global.iloc[1:]) and app.df_global.iloc[1:].index[0] == 1
+
+    # Croisement limité aux TOP_NATURES demandes × solutions les plus fréquentes
+    monkeypatch.setattr(app, 'TOP_NATURES', 1)
+    (row,) = app.graphes_natures(app.df_global)
+    fig_top, fig_croise = [col.children.figure for col in row.children]
+    assert fig_croise.data[0].z.shape == (1, 1) and len(fig_top.data[0].y) == 1
+
+def test_incidence_ordre_de_saisie(snapshot_charge):
+    """Natures restituées dans l'ordre POS (principale d'abord), pas dans l'ordre du vocabulaire."""
+    demandes = pd.DataFrame({'num': [101, 101, 101], 'pos': [2, 1, 3], 'nature': ['1b', '7b', '1b']})
+    solutions = pd.DataFrame({'num': [101, 101], 'pos': [1, 2], 'nature': ['4a', '1']})
+    snapshot_charge(natures=(demandes, solutions))
+
+    position = app.df_global.index[app.df_global['id'] == 101][0]
+    assert app.df_global.attrs['demandes'].natures_de(position) == ['7b', '1b']  # Doublon : premier rang
+    assert app.df_global.attrs['solutions'].natures_de(position) == ['4a', '1']
+    # Modifier puis enregistrer conserve la demande principale
+    form = app.populate_form(101)
+    assert (form[15], form[16]) == (['7b', '1b'], ['4a', '1'])
 
 def test_handle_table_actions(mocker):
     """Teste les boutons Modifier / Supprimer."""
@@ -142,9 +249,9 @@ def test_handle_table_actions(mocker):
 
     # Supprimer
     mock_ctx.triggered_id = "btn-delete"
-    mocker.patch('app.delete_entretien_db', return_value=(True, "Supprimé"))
+    mocker.patch('app.delete_entretien_db', return_value=(True, "Supprimé", 4242))
     url, edit_id, alert, refresh = app.handle_table_actions(0, 1, 0, [0], rows)
-    assert "Supprimé" in alert.children
+    assert "Supprimé" in alert.children and refresh == 4242  # Transaction de la suppression
 
 def test_save_form_data_validation(mocker):
     """Teste la validation du formulaire."""
@@ -153,15 +260,27 @@ def test_save_form_data_validation(mocker):
     assert "Champs obligatoires manquants" in res.children
     
     # Succès
-    mocker.patch('app.save_entretien_db', return_value=(True, "OK"))
-    res, trigger = app.save_form_data(1, None, "2023-01-01", "RDV", "15-30 min", "Homme", "-18 ans", "Vannes", 0, "Célibataire", "Tradi", "Soi", "Ouvrier", "RSA", "1a", "CAF", "Dem", "Sol")
-    assert "OK" in res.children
+    save = mocker.patch('app.save_entretien_db', return_value=(True, "OK", 4242))
+    res, trigger = app.save_form_data(1, None, "2023-01-01", 1, 2, 1, 1, "Vannes", 0, "1", 1, 1, 7, 5, "1a", "CAF", ["1a"], ["1"])
+    assert "OK" in res.children and trigger == 4242  # Transaction de CET enregistrement
+    data = save.call_args[0][0]
+    assert (data['mode'], data['sit'], data['mod_fam'], data['origine']) == (1, "1", 1, "1a")
+    assert data['code_c'] == app.communes.courant().resoudre_un("Vannes")
+    assert app.communes.courant().resoudre_un("Theix Noyallo") is not None
+    app.save_form_data(1, None, "2023-01-01", 1, 2, 1, 1, "Theix Noyallo", 0, "1", 1, 1, 7, 5, "1a", "CAF", [], [])
+    assert save.call_args[0][0]['code_c'] is None  # Correspondance approchée : pas enregistrée
+
+    # Listes vides : valeurs par défaut de la saisie
+    app.save_form_data(1, None, "2023-01-01", 1, None, 1, None, "", 0, None, None, None, None, None, None, "", [], [])
+    data = save.call_args[0][0]
+    assert (data['duree'], data['sit'], data['prof'], data['mod_fam']) == (2, "7", 11, None)
 
-def test_update_dashboard_complete(mocker, mock_db_data):
+def test_update_dashboard_complete(monkeypatch, mocker, mock_db_data):
     """Teste le dashboard."""
     # On doit simuler des données 'finales' (avec Annee, Mois, etc.)
     df_processed = mock_db_data.copy()
     df_processed.rename(columns={'commune': 'Ville', 'partenaire': 'Partenaire'}, inplace=True)
+    df_processed['Commune'] = df_processed['Ville']
     df_processed['Annee'] = '2023'
     df_processed['Mois'] = '2023-01'
     df_processed['Mode_Lib'] = 'RDV'
@@ -170,16 +289,27 @@ def test_update_dashboard_complete(mocker, mock_db_data):
     df_processed['Sit_Lib'] = 'Marié'
     df_processed['Prof_Lib'] = 'Employé'
     
-    app.df_global = df_processed
+    monkeypatch.setattr(app, 'df_global', df_processed)
     mock_ctx = mocker.patch('app.ctx')
     
-    mock_ctx.triggered_id = "btn-act"
-    kpi, graphs, c1, c2, c3 = app.update_dashboard('2023', 0, 0, 0, 0)
-    assert c1 == "primary"
+    mock_ctx.triggered_id = "store-view"
+    kpi, graphs = app.update_dashboard('2023', "act", 0)
+    assert "Modes" in str(graphs)
     
-    mock_ctx.triggered_id = "btn-cli"
-    kpi, graphs, c1, c2, c3 = app.update_dashboard('2023', 0, 0, 0, 0)
-    assert c2 == "primary"
+    kpi, graphs = app.update_dashboard('2023', "cli", 0)
+    assert "Age" in str(graphs)
+
+    kpi, graphs = app.update_dashboard('2023', "evo", 0)
+    assert graphs == []  # Courbes portées par evolution-panel
+
+    # Sans base : séries recalculées depuis le snapshot
+    mocker.patch('app.get_db_connection', return_value=None)
+    fig = app.update_evolution('M', 'mode', [], None, '2023', "evo", 0)
+    assert "Evolution Mensuelle" in fig.layout.title.text
+    assert {t.name for t in fig.data} == {'RDV', 'Sans RDV'}
+    fig = app.update_evolution('S', 'total', ['annuel', 'mobile'], 2, 'ALL', "evo", 0)
+    assert "comparaison annuelle" in fig.layout.title.text and fig.data[0].name == '2023'
+    assert app.update_evolution('M', 'total', [], None, 'ALL', "act", 0) is no_update
 
 
 
@@ -200,12 +330,62 @@ def test_error_cases(mocker):
     mock_conn.cursor.side_effect = Exception("Erreur SQL Delete")
     mocker.patch('app.get_db_connection', return_value=mock_conn)
     
-    success, msg = app.delete_entretien_db(1)
+    success, msg, transaction = app.delete_entretien_db(1)
     assert success is False
     assert "Erreur SQL Delete" in msg
     mock_conn.rollback.assert_called() # Vérifie que le rollback (annulation) est bien appelé
 
     mock_conn.cursor.side_effect = Exception("Erreur SQL Save")
-    success, msg = app.save_entretien_db({}, update_id=None)
+    success, msg, transaction = app.save_entretien_db({}, update_id=None)
     assert success is False
-    assert "Erreur SQL Save" in msg
\ No newline at end of file
+    assert "Erreur SQL Save" in msg
+
+    # Délai dépassé : message explicite (annulée ou en cours), pas une erreur SQL vide
+    mocker.patch.object(app.ecritures, 'enregistrer', side_effect=TimeoutError("dossier NON enregistré, réessayez."))
+    success, msg, transaction = app.save_entretien_db({}, update_id=None)
+    assert success is False and msg == "dossier NON enregistré, réessayez."
+
+def test_audit_callbacks(monkeypatch, mocker):
+    """L'audit rejoue chaque callback serveur et liste les callbacks clientside à coût nul."""
+    import audit_callbacks
+    mocker.patch('app.load_data_from_db', return_value=pd.DataFrame())
+    monkeypatch.setattr(app, 'df_global', pd.DataFrame())
+
+    assert audit_callbacks.decouper_cle_sortie("..a.b...c.d..") == [('a', 'b'), ('c', 'd')]
+    res = audit_callbacks.auditer_callbacks(app.app, repetitions=1)
+    serveur = res[res['type'] == 'serveur']
+    assert set(serveur['statut']) <= {200, 204}
+    assert 'update_dashboard' in serveur['callback'].values
+    assert (res[res['type'] == 'client']['mediane_ms'] == 0).all()
+
+def test_get_db_connection_sslmode(mocker, monkeypatch):
+    """DATABASE_URL : SSL imposé, sauf sslmode explicite dans l'URL."""
+    connect = mocker.patch('app.psycopg2.connect')
+    monkeypatch.setenv('DATABASE_URL', 'postgresql://hote/mdd')
+    app.get_db_connection()
+    connect.assert_called_with('postgresql://hote/mdd', sslmode='require')
+    monkeypatch.setenv('DATABASE_URL', 'host=/tmp dbname=mdd_bench sslmode=prefer')
+    app.get_db_connection()
+    connect.assert_called_with('host=/tmp dbname=mdd_bench sslmode=prefer')
+
+
+def test_synchroniser_snapshot_selon_instantane(monkeypatch, mocker):
+    """Rechargement seulement si l'écriture n'est pas visible dans l'instantané du snapshot, quel que soit le worker."""
+    df = pd.DataFrame({'id': [1]})
+    df.attrs['instantane'] = app.Instantane("100:105:102")
+    monkeypatch.setattr(app, 'df_global', df)
+    charger = mocker.patch('app.load_data_from_db', return_value=df)
+    mocker.patch('app.ctx').triggered_id = "refresh-trigger"
+
+    for transaction in (99, 103, 0):  # Déjà visibles : aucun rechargement
+        app.update_crosstab('mode', 'sexe', None, 'ALL', 'act', transaction)
+    charger.assert_not_called()
+    app.update_evolution('M', 'total', [], None, 'ALL', 'act', 102)  # En cours lors du chargement
+    app.refresh_table(105)                                           # Validée après
+    app.refresh_table(app.jeton_rafraichissement(None))              # Base sans txid : rechargement forcé
+    assert charger.call_count == 3
+
+    # Listes du filtre et du formulaire : suivent le snapshot (refresh-trigger), pas les pages de la table
+    entrees = {cb['output']: [i['id'] for i in cb['inputs']] for cb in app.app._callback_list}
+    assert entrees['filter-year.options'] == ['refresh-trigger'] and app.update_form_options(99)
+    assert charger.call_count == 3
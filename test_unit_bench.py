@@ -0,0 +1,88 @@
+import pandas as pd
+import app
+import nomenclature
+from bench.generateur import generer_donnees, generer_classeur, NATURES_DEMANDE
+from bench.comparer import comparer
+import read_xl
+
+
+def test_generer_donnees_codes_valides():
+    """Les données synthétiques respectent les espaces de codes et la clé (num, pos)."""
+    entretien, demande, solution = generer_donnees(2000)
+    assert len(entretien) == 2000 and entretien['num'].is_unique
+    nomenc = nomenclature.courante()
+    assert set(entretien['mode']) <= set(nomenc['mode'].codes)
+    assert set(entretien['sit_fam']) <= set(nomenc['sit_fam'].codes)
+    assert set(entretien['origine']) <= set(nomenc['origine'].codes)
+    assert set(demande['nature']) <= set(NATURES_DEMANDE)
+    assert not demande.duplicated(['num', 'pos']).any()
+    assert not demande.duplicated(['num', 'nature']).any()
+    assert set(solution['num']) <= set(entretien['num'])
+
+
+def test_generer_classeur_lisible_par_read_xl(tmp_path, mocker):
+    """Le classeur synthétique passe par l'extraction de Read_xl."""
+    chemin = generer_classeur(tmp_path / "classeur.xlsx", 5)
+    mocker.patch.object(read_xl, 'CHEMIN_DONNEES', str(chemin))
+    lecteur = read_xl.Read_xl()
+    df = lecteur.extraction_dataframe(lecteur.feuilles["Jan"])
+    assert len(df) == 5
+    # Tous les libellés et alias des classeurs sont reconnus par la nomenclature
+    codes = lecteur.codifier(df)
+    assert codes[[c.lower() for c in read_xl.VARIABLES_CODEES]].notna().all().all()
+    assert set(codes['mode']) <= {1, 2, 3, 4, 5}
+    assert codes['Dem.1'].isin(NATURES_DEMANDE).all()
+    assert codes['code_c'].notna().all()  # Communes du classeur résolues sur le référentiel
+
+
+def test_comparer_signale_les_regressions():
+    df = pd.DataFrame([
+        {'commit': 'a', 'etape': 'load', 'taille': 10, 'secondes': 1.0, 'pic_mo': 10.0},
+        {'commit': 'b', 'etape': 'load', 'taille': 10, 'secondes': 1.5, 'pic_mo': 10.0},
+        {'commit': 'a', 'etape': 'dash', 'taille': 10, 'secondes': 1.0, 'pic_mo': 10.0},
+        {'commit': 'b', 'etape': 'dash', 'taille': 10, 'secondes': 1.1, 'pic_mo': 10.0},
+    ])
+    res = comparer(df, 'a', 'b', seuil=1.2).set_index('etape')
+    assert bool(res.loc['load', 'regression']) is True
+    assert bool(res.loc['dash', 'regression']) is False
+
+
+def test_charge_rapport_et_parcours():
+    """Le rapport de charge donne les percentiles par callback ; le parcours vise les bons callbacks."""
+    import json
+    from bench.charge import Parcours, rapport
+    mesures = [("update_dashboard", i / 1000, 200, 100, 0) for i in range(1, 101)] + [("save_form_data", 0.05, 500, 10, 0)]
+    res = rapport(mesures, duree=10).set_index("callback")
+    assert res.loc["update_dashboard", "p50_ms"] == 50.5
+    assert res.loc["update_dashboard", "p99_ms"] >= 99
+    assert res.loc["save_form_data", "erreurs_pct"] == 100
+    assert res.loc["TOTAL", "appels"] == 101
+
+    p = Parcours(app.app)
+    corps = json.loads(p.requete(p.K_DASH, {"store-view.data": "cli"}, "store-view.data"))
+    assert p.noms[corps["output"]] == "update_dashboard"
+    assert {"id": "store-view", "property": "data", "value": "cli"} in corps["inputs"]
+    corps = json.loads(p.requete(p.K_TABLE, {"data-table.page_current": 3}, "data-table.page_current"))
+    assert p.noms[corps["output"]] == "refresh_table" and corps["changedPropIds"] == ["data-table.page_current"]
+
+
+def test_ouverture_de_page_recharge_le_snapshot(monkeypatch, mocker):
+    """Sans déclencheur, la requête est celle du chargement de page : refresh_table recharge le snapshot."""
+    import json
+    from bench.charge import Parcours
+    monkeypatch.setattr(app, 'df_global', pd.DataFrame())
+    charger = mocker.patch('app.load_data_from_db', return_value=pd.DataFrame())
+    p = Parcours(app.app)
+    corps = p.requete(p.K_TABLE)
+    assert json.loads(corps)["changedPropIds"] == []
+    assert app.server.test_client().post('/_dash-update-component', data=corps, content_type='application/json').status_code == 200
+    charger.assert_called_once()
+
+
+def test_charge_ecritures_exigent_une_base_jetable(monkeypatch):
+    """Les écritures du test de charge sont optionnelles et refusées sans MDD_BENCH_DSN."""
+    import pytest
+    from bench import charge
+    monkeypatch.delenv("MDD_BENCH_DSN", raising=False)
+    with pytest.raises(SystemExit):
+        charge.main(["--ecritures", "--url", "http://127.0.0.1:1"])
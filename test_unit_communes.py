@@ -0,0 +1,72 @@
+import pandas as pd
+from unittest.mock import MagicMock
+import communes
+from communes import IndexCommunes, AgregatCommunes, normaliser_nom
+
+
+def index():
+    return IndexCommunes(pd.DataFrame({
+        'code_c': [1, 2, 3, 4, 5],
+        'nom_c': ['Vannes', 'Saint-Avé', 'Theix-Noyalo', 'Ploërmel', 'Plouay'],
+        'code_a': [2, 2, 2, None, None],
+        'agglo': ['Vannes Agglo', 'Vannes Agglo', 'Vannes Agglo', None, None],
+    }))
+
+
+def test_normaliser_nom():
+    assert normaliser_nom("  Ste-Anne-d'Auray (56400) ") == "sainte anne d auray"
+    assert normaliser_nom("PLOERMEL") == normaliser_nom("Ploërmel") == "ploermel"
+    assert normaliser_nom(None) == normaliser_nom(float('nan')) == normaliser_nom("nan") == ""
+
+
+def test_resolution_exacte_prefixe_approchee():
+    idx = index()
+    assert idx.resoudre_un("St Avé") == 2          # Abréviation
+    assert idx.resoudre_un("Theix") == 3           # Préfixe unique (ancienne commune)
+    assert idx.resoudre_un("Theix Noyallo") == 3   # Faute de frappe sur un nom long
+    assert idx.resoudre_un("Theix Noyallo", approche=False) is None and idx.resoudre_un("Theix", approche=False) == 3
+    assert idx.resoudre_un("Plouray") is None      # Nom court proche : une autre commune
+    assert idx.resoudre_un("Saint") is None        # Préfixe unique mais non distinctif
+    assert idx.resoudre_un("Vanes") is None
+    assert idx.resoudre_un("Paris") is None
+    assert idx.resoudre_un("") is None
+
+
+def test_resolution_en_masse_memoisee(mocker):
+    idx = index()
+    espion = mocker.spy(idx, 'resoudre_un')
+    noms = ["Vannes", "vannes ", "Ploermel", None, "Vannes"] * 100
+    codes = idx.resoudre(noms)
+    assert list(codes[:5]) == [1, 1, 4, None, 1]
+    assert espion.call_count == 4  # Un appel par valeur distincte
+
+    complets = idx.completer([1, None, None], ["Vannes", "Saint Ave", "Lyon"])
+    assert list(complets[:2]) == [1, 2] and pd.isna(complets[2])
+    assert list(idx.noms([2, 99])) == ['Saint-Avé', None]
+    assert list(idx.agglos([1, 4, None])) == ['Vannes Agglo', 'Hors agglo', 'Inc.']
+
+
+def test_agregat_communes():
+    df = pd.DataFrame({'Annee': ['2023', '2023', '2024', '2024', '2024', '2024'],
+                       'Commune': ['Vannes', 'Vannes', 'Ploërmel', '', 'Autre', 'Autre'],
+                       'Agglo': ['Vannes Agglo', 'Vannes Agglo', 'Hors agglo', 'Inc.', 'Hors agglo', 'Hors agglo']})
+    agregat = AgregatCommunes.depuis_snapshot(df)
+    assert agregat.top_commune() == 'Vannes' and agregat.top_commune('2024') == 'Ploërmel'  # « Autre » exclue
+    assert AgregatCommunes.depuis_snapshot(df[df['Commune'] == 'Autre']).top_commune() == "-"
+    assert agregat.par_agglo().to_dict() == {'Vannes Agglo': 2, 'Hors agglo': 3, 'Inc.': 1}
+    assert df.assign(x=1).copy().attrs == {} and agregat.__deepcopy__({}) is agregat
+
+
+def test_renseigner_codes_en_base():
+    """Migration des CODE_C manquants : résolutions sûres seulement (pas les correspondances approchées)."""
+    conn = MagicMock()
+    cur = conn.cursor.return_value
+    cur.fetchall.return_value = [("St Avé",), ("Theix",), ("Theix Noyallo",), ("Paris",)]
+    assert communes.renseigner_codes(conn, index()) == 2
+    cur.executemany.assert_called_once_with(
+        "UPDATE entretien SET code_c = %s WHERE code_c IS NULL AND commune = %s", [(2, "St Avé"), (3, "Theix")])
+    conn.commit.assert_called_once()
+
+    cur.execute.side_effect = Exception("permission denied")
+    assert communes.renseigner_codes(conn, index()) == 0
+    conn.rollback.assert_called_once()
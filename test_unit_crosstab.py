@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import app
+import nomenclature
+from crosstab import Croiseur, vers_table
+
+
+def snapshot():
+    return pd.DataFrame({
+        'mode': [1, 2, 1, 1, np.nan],
+        'sexe': [1, 1, 2, 2, 2],
+        'Commune': ['Vannes', 'Auray', 'Vannes', '', 'Vannes'],
+        'Mois': ['2023-01', '2023-01', '2023-02', '2024-01', '2024-01'],
+        'Annee': ['2023', '2023', '2023', '2024', '2024'],
+    })
+
+
+def test_croiser_comptages_et_manquants():
+    """Le cube correspond à un crosstab pandas ; les manquants ont leur propre modalité."""
+    c = Croiseur(snapshot(), {'mode': nomenclature.courante()['mode'].en_dict(), 'sexe': nomenclature.courante()['sexe'].en_dict()})
+    cube, libelles = c.croiser(['mode', 'sexe'])
+    assert libelles == [['RDV', 'Sans RDV', 'Inc.'], ['Homme', 'Femme']]
+    assert cube.tolist() == [[1, 2], [1, 0], [0, 1]]
+    assert cube.sum() == 5
+
+    cube, _ = c.croiser(['mode', 'sexe'], '2023')
+    assert cube.sum() == 3
+
+    cube, libelles = c.croiser(['Commune', 'sexe', 'Mois'])
+    assert cube.shape == (3, 2, 3) and libelles[0][-1] == 'Inc.'
+
+
+def test_croiser_cache():
+    """Une même requête est servie depuis le cache."""
+    c = Croiseur(snapshot())
+    assert c.croiser(['mode', 'sexe'], 'ALL') is c.croiser(['mode', 'sexe'], 'ALL')
+
+
+def test_vers_table_marges():
+    """Table longue + totaux par sous-ensemble (ROLLUP)."""
+    c = Croiseur(snapshot(), {'mode': nomenclature.courante()['mode'].en_dict()})
+    cube, libelles = c.croiser(['mode', 'sexe'])
+    table = vers_table(cube, libelles, ['mode', 'sexe'])
+    total = table[(table['Mode'] == 'Total') & (table['Sexe'] == 'Total')]
+    assert total['Nombre'].tolist() == [5]
+    assert table[(table['Mode'] == 'RDV') & (table['Sexe'] == 'Total')]['Nombre'].tolist() == [3]
+
+
+def test_callbacks_crosstab(monkeypatch, mocker):
+    """Heatmap (2 ou 3 variables) et export du tableau depuis le snapshot courant."""
+    monkeypatch.setattr(app, 'df_global', snapshot())
+    mocker.patch('app.ctx').triggered_id = "cro-var1"
+    assert app.update_crosstab('mode', 'sexe', None, 'ALL', 'act', 0) is app.no_update
+    fig = app.update_crosstab('mode', 'sexe', None, 'ALL', 'cro', 0)
+    assert fig.data[0].z.sum() == 5
+    fig = app.update_crosstab('mode', 'sexe', 'Commune', '2023', 'cro', 0)
+    assert any("Commune" in a.text for a in fig.layout.annotations)
+
+    res = app.export_crosstab(1, 'mode', 'sexe', None, 'ALL')
+    assert res['filename'] == "croisement_mdd_vannes.xlsx"
+    assert app.obtenir_croiseur() is app.obtenir_croiseur()
+    croiseur, recherche = app.obtenir_croiseur(), app.obtenir_recherche()
+    monkeypatch.setattr(app, 'df_global', snapshot())  # Snapshot rechargé : objets dérivés reconstruits
+    assert app.obtenir_croiseur() is not croiseur and app.obtenir_croiseur().df is app.df_global
+    assert app.obtenir_recherche() is not recherche
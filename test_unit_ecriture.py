@@ -0,0 +1,97 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+import ecriture
+from ecriture import FileEcriture, Instantane
+
+
+def saisie(**kw):
+    data = {'date': '2023-01-01', 'mode': 1, 'duree': 2, 'sexe': 1, 'age': 3,
+            'vient': 1, 'sit': '4', 'enfant': 0, 'mod_fam': 1, 'prof': 6,
+            'ress': 1, 'origine': '1a', 'ville': 'Vannes', 'partenaire': '',
+            'demandes': ['1a'], 'solutions': []}
+    data.update(kw)
+    return data
+
+
+def test_lot_valide_en_une_transaction():
+    conn = MagicMock()
+    cur = conn.cursor.return_value
+    cur.fetchone.side_effect = [(101,), (102,), (7001,)]  # Deux créations puis txid du lot
+    file = FileEcriture(lambda: conn, delai=0.5)
+    futures = [file.soumettre(saisie()), file.soumettre(saisie(), update_id=55), file.soumettre(saisie())]
+    resultats = [f.result(timeout=5) for f in futures]
+
+    assert [(r.num, r.cree) for r in resultats] == [(101, True), (55, False), (102, True)]
+    assert {r.transaction for r in resultats} == {7001}
+    conn.commit.assert_called_once()
+    conn.close.assert_called_once()
+    assert [c.args[0] for c in cur.execute.call_args_list].count("SAVEPOINT ecriture") == 3
+
+
+def test_erreur_isolee_par_point_de_sauvegarde():
+    conn = MagicMock()
+    conn.cursor.return_value.fetchone.side_effect = [(101,), (102,), (7002,)]
+    file = FileEcriture(lambda: conn, delai=0.5)
+    futures = [file.soumettre(saisie()), file.soumettre({}), file.soumettre(saisie())]
+
+    assert futures[0].result(timeout=5).num == 101 and futures[2].result(timeout=5).num == 102
+    with pytest.raises(KeyError):
+        futures[1].result(timeout=5)
+    executes = [c.args[0] for c in conn.cursor.return_value.execute.call_args_list]
+    assert "ROLLBACK TO SAVEPOINT ecriture" in executes
+    conn.commit.assert_called_once()
+
+
+def test_echec_du_lot_propage_a_chaque_saisie():
+    conn = MagicMock()
+    conn.commit.side_effect = Exception("connexion perdue")
+    file = FileEcriture(lambda: conn, delai=0.2)
+    futures = [file.soumettre(saisie()), file.soumettre(saisie())]
+    for f in futures:
+        with pytest.raises(Exception, match="connexion perdue"):
+            f.result(timeout=5)
+    conn.rollback.assert_called_once()
+
+    with pytest.raises(RuntimeError, match="indisponible"):
+        FileEcriture(lambda: None).enregistrer(saisie(), timeout=5)
+
+
+def test_delai_depasse_annule_ou_signale_en_cours():
+    """Au-delà du délai : la saisie pas encore écrite est annulée (jamais écrite) ; sinon « en cours »."""
+    libre, conn = threading.Event(), MagicMock()
+    conn.cursor.return_value.fetchone.side_effect = [(101,), (7003,)]
+    file = FileEcriture(lambda: libre.wait() and conn, delai=0)  # Connexion bloquée : saisie en attente
+    with pytest.raises(TimeoutError, match="NON enregistré"):
+        file.enregistrer(saisie(ville='Annulée'), timeout=0.1)
+    libre.set()
+    assert file.enregistrer(saisie(), timeout=5).num == 101
+    villes = [c.args[1][12] for c in conn.cursor.return_value.execute.call_args_list if c.args[0] == ecriture.SQL_INSERT]
+    assert villes == ['Vannes']
+
+    libre.clear()
+    conn = MagicMock()
+    conn.cursor.return_value.execute.side_effect = lambda *a: libre.wait()  # Saisie déjà en cours d'écriture
+    file = FileEcriture(lambda: conn, delai=0)
+    with pytest.raises(TimeoutError, match="en cours"):
+        file.enregistrer(saisie(), timeout=0.1)
+    libre.set()
+
+
+def test_instantane_et_transaction():
+    instantane = Instantane("100:105:101,103")
+    assert [instantane.couvre(t) for t in (99, 101, 102, 103, 104, 105)] == [True, False, True, False, True, False]
+
+    conn = MagicMock()
+    conn.cursor.return_value.fetchone.return_value = ("7:9:",)
+    assert Instantane.lire(conn).couvre(8)
+    conn.cursor.return_value.execute.side_effect = Exception("function txid_current_snapshot() does not exist")
+    assert Instantane.lire(conn) is None and conn.rollback.called
+
+    cur = MagicMock()
+    cur.fetchone.return_value = ("42",)
+    assert ecriture.transaction_courante(cur) == 42
+    cur.fetchone.side_effect = Exception("txid indisponible")
+    assert ecriture.transaction_courante(cur) is None
+    assert cur.execute.call_args.args[0] == "ROLLBACK TO SAVEPOINT transaction"
+    assert ecriture.ecrire_entretien(MagicMock(), saisie(demandes=[]), update_id=7) == 7
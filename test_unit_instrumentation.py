@@ -0,0 +1,68 @@
+import json
+import pytest
+import pandas as pd
+from unittest.mock import MagicMock
+import app
+import instrumentation
+
+
+@pytest.fixture(autouse=True)
+def metriques_vides():
+    instrumentation.reinitialiser()
+    yield
+    instrumentation.reinitialiser()
+
+
+def test_mesurer_requete_compte_lignes_et_erreurs():
+    """Durée, lignes et erreurs SQL sont comptabilisées par requête."""
+    with instrumentation.mesurer_requete("test") as m:
+        m['lignes'] = 42
+
+    with pytest.raises(ValueError):
+        with instrumentation.mesurer_requete("test"):
+            raise ValueError("boom")
+
+    texte = instrumentation.exposition()
+    assert 'mdd_sql_lignes_total{requete="test"} 42' in texte
+    assert 'mdd_sql_erreurs_total{requete="test"} 1' in texte
+    assert 'mdd_sql_duree_secondes_count{requete="test"} 2' in texte
+    assert '# TYPE mdd_sql_duree_secondes histogram' in texte
+
+
+def test_load_data_instrumente(mocker):
+    """Le chargement compte un rechargement et les lignes du snapshot ; les erreurs sont loguées."""
+    mocker.patch('app.get_db_connection', return_value=MagicMock())
+    mocker.patch('pandas.read_sql_query', return_value=pd.DataFrame())
+    app.load_data_from_db()
+    texte = instrumentation.exposition()
+    assert 'mdd_rechargements_total 1' in texte
+    assert 'mdd_snapshot_lignes 0' in texte
+
+    mocker.patch('pandas.read_sql_query', side_effect=Exception("SQL KO"))
+    assert app.load_data_from_db().empty
+    assert 'mdd_sql_erreurs_total{requete="load_entretiens"} 1' in instrumentation.exposition()
+
+
+def test_route_metrics_et_callbacks(mocker, tmp_path, monkeypatch):
+    """Chaque appel de callback est chronométré, exposé sur /metrics, et profilé sur demande."""
+    import audit_callbacks
+    mocker.patch('app.load_data_from_db', return_value=pd.DataFrame())
+    monkeypatch.setattr(app, 'df_global', pd.DataFrame())
+    monkeypatch.setenv('MDD_PROFIL_DIR', str(tmp_path))
+    client = app.server.test_client()
+
+    corps = audit_callbacks.construire_requete(app.app, "filter-year.options")
+    poster = lambda: client.post('/_dash-update-component', data=json.dumps(corps), content_type='application/json',
+                                 headers={'X-MDD-Profil': '1'})
+    assert poster().status_code == 200
+    assert not list(tmp_path.glob('*.prof'))  # En-tête ignoré sans MDD_PROFIL_HEADER
+
+    monkeypatch.setenv('MDD_PROFIL_HEADER', '1')
+    monkeypatch.setenv('MDD_PROFIL_MAX', '1')
+    (tmp_path / "ancien.prof").write_bytes(b"")
+    assert poster().status_code == 200
+
+    texte = client.get('/metrics').get_data(as_text=True)
+    assert 'mdd_callback_duree_secondes_count{callback="update_year_filter"} 2' in texte
+    assert 'mdd_callback_octets_total{callback="update_year_filter"}' in texte
+    assert len(list(tmp_path.glob('*_update_year_filter_*.prof'))) == 1 and len(list(tmp_path.glob('*.prof'))) == 1
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from unittest.mock import MagicMock
+import nomenclature
+
+
+def test_ddl_complete():
+    """Toutes les variables commentées dans tables.ddl sont extraites, y compris « ) , Rubrique »."""
+    nomenc = nomenclature.depuis_ddl()
+    assert {'mode', 'sit_fam', 'profession', 'ress', 'origine', 'demande', 'solution', 'commune'} <= set(nomenc.variables)
+    assert 'enfant' not in nomenc  # Plage numérique, pas de modalités
+    assert nomenc['profession'].libelle(12) == "Non renseigné"
+    assert nomenc['mode'].entier and not nomenc['sit_fam'].entier
+    assert nomenc.version.startswith("ddl:")
+
+
+def test_decoder_encoder_vectorises():
+    nomenc = nomenclature.depuis_ddl()
+    assert nomenc['mode'].decoder(pd.Series([1, 2.0, np.nan, 99]), 'Autre').tolist() == ['RDV', 'Sans RDV', 'Autre', 'Autre']
+    assert list(nomenc['sit_fam'].decoder(['4', ' 5f', 'zz'])) == ['Marié', 'Séparé/divorcé Séparés sous le même toit', None]
+    # Libellé officiel, alias Excel propre à la variable, code saisi (même en 3.0), inconnu
+    assert list(nomenc['ress'].encoder(['AAH/Invalidité', ' salaire', 'Autre', '3.0', 'xx'])) == [6, 1, 10, 3, None]
+    assert nomenc['vient_pr'].encoder(['Autre'])[0] == 6  # « Autre » n'a pas le même code selon la variable
+    assert nomenc['sit_fam'].valider('5a') == '5a' and nomenc['age'].valider(0) is None
+
+
+def test_actualiser_selon_version(mocker):
+    """La base n'est relue que si l'empreinte des métadonnées change."""
+    mocker.patch.object(nomenclature, '_courante', nomenclature.depuis_ddl())
+    cur = MagicMock()
+    conn = MagicMock()
+    conn.cursor.return_value = cur
+    cur.fetchone.return_value = ('v1', 3)
+    cur.fetchall.return_value = [('ENTRETIEN', 'mode', 'smallint', '1', 'RDV', 3, 1),
+                                 ('ENTRETIEN', 'mode', 'smallint', '6', 'Visio', 3, 2),
+                                 ('DEMANDE', 'nature', 'character varying', '9z', 'Nouvelle', 3, 1)]
+
+    nomenc = nomenclature.actualiser(conn)
+    assert nomenc.source == "base" and nomenc.version == 'v1'
+    assert nomenc['mode'].libelle(6) == "Visio" and nomenc['demande'].codes == ['9z']
+    assert nomenclature.courante() is nomenc
+
+    cur.execute.reset_mock()
+    assert nomenclature.actualiser(conn) is nomenc
+    assert cur.execute.call_count == 1  # Version seule
+
+    # Métadonnées indisponibles : la nomenclature courante est conservée
+    cur.execute.side_effect = Exception("relation modalite does not exist")
+    assert nomenclature.actualiser(conn) is nomenc
+    conn.rollback.assert_called()
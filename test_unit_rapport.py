@@ -0,0 +1,71 @@
+import io
+import pandas as pd
+from unittest.mock import MagicMock
+import rapport
+from incidence import Incidence
+
+
+def snapshot():
+    df = pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'date_ent': pd.to_datetime(['2023-01-05', '2023-01-20', '2023-03-02', '2024-06-01']),
+        'mode': [1, 2, 1, 3], 'duree': [1, 1, None, 2], 'sexe': [2, 1, 2, 2], 'age': [3, 3, 4, 2],
+        'vient_pr': [1, 1, 1, 1], 'sit_fam': ['4', '5f', '', '1'], 'enfant': [2, 0, 0, 1],
+        'modele_fam': [1, None, None, 2], 'profession': [6, 7, 6, 1], 'ress': [1, 5, 1, 9],
+        'origine': ['1b', '1a', None, '1b'], 'Commune': ['Vannes', 'Auray', 'Vannes', ''],
+        'Partenaire': ['CAF', '', 'CAF', 'Mairie'],
+    })
+    demandes = pd.DataFrame({'num': [1, 1, 3, 4], 'pos': [1, 2, 1, 1], 'nature': ['1b', '7b', '1b', '7a']})
+    df.attrs['demandes'] = Incidence.depuis_table(demandes, df['id'], ['1a', '1b', '7a', '7b'])
+    df.attrs['solutions'] = Incidence.depuis_table(demandes.iloc[:0], df['id'], ['1'])
+    return df
+
+
+def test_variables_depuis_ddl():
+    variables = rapport.variables_ddl()
+    cles = [v.cle for v in variables]
+    assert ('ENTRETIEN', 'NUM') not in cles and ('ENTRETIEN', 'DATE_ENT') not in cles
+    assert cles[0] == ('ENTRETIEN', 'MODE') and ('DEMANDE', 'NATURE') in cles
+    rubriques = list(dict.fromkeys(v.rubrique for v in variables))
+    assert rubriques == ['Entretien', 'Usager', 'Demande', 'Solution', 'Repérage du dispositif', 'Résidence', 'Partenaire']
+    enfant = next(v for v in variables if v.colonne == 'ENFANT')
+    assert (enfant.libelle, enfant.type_v) == ("Enfant(s) à charge", "NUM")
+
+
+def test_requete_grouping_sets():
+    variables = rapport.variables_ddl()
+    sql, params = rapport.requete(variables, '2023')
+    assert params == {'debut': '2023-01-01', 'fin': '2024-01-01'}
+    assert sql.count("GROUPING SETS") == 3 and sql.count("UNION ALL") == 2  # Entretien, demande, solution
+    n = sum(v.tab == 'ENTRETIEN' for v in variables)
+    assert f"WHEN {(1 << n) - 1 - (1 << (n - 1))} THEN 'MODE'" in sql
+    assert "EXTRACT(YEAR" in rapport.requete(variables)[0]
+
+
+def test_comptages_et_tableaux():
+    variables = rapport.variables_ddl()
+    comptes = rapport.comptages_snapshot(snapshot(), variables, '2023')
+    mode = comptes[(comptes['colonne'] == 'MODE') & comptes['periode'].isna()].set_index('valeur')['nombre']
+    assert mode.to_dict() == {'1': 2, '2': 1}
+    nat = comptes[(comptes['tab'] == 'DEMANDE') & (comptes['periode'] == 1)].set_index('valeur')['nombre']
+    assert nat.to_dict() == {'1b': 1, '7b': 1}
+
+    rapport_ = rapport.construire(variables, comptes, '2023')
+    assert rapport_['Synthèse'].loc['Entretiens', 'Total'] == 3
+    v_mode, t_mode = rapport_['Entretien'][0]
+    assert list(t_mode.index) == ['RDV', 'Sans RDV', 'Téléphonique', 'Courrier', 'Mail', 'Total']  # Zéros compris
+    assert t_mode.loc['RDV', 'Janv'] == 1 and t_mode.loc['RDV', 'Mars'] == 1 and t_mode.loc['Total', '%'] == 100
+    duree = dict(rapport_['Entretien'])[next(v for v, _ in rapport_['Entretien'] if v.colonne == 'DUREE')]
+    assert duree.loc[rapport.LIB_NON_RENSEIGNE, 'Total'] == 1
+
+
+def test_generer_classeur_repli_snapshot():
+    conn = MagicMock()
+    conn.cursor.return_value.execute.side_effect = Exception("relation variable does not exist")
+    tampon = io.BytesIO()
+    rapport.generer(tampon, snapshot(), conn, 'ALL')
+    conn.rollback.assert_called()
+    feuilles = pd.read_excel(tampon, sheet_name=None, header=None)
+    assert list(feuilles)[:3] == ['Synthèse', 'Entretien', 'Usager']
+    synthese = feuilles['Synthèse']
+    assert [int(a) for a in synthese.iloc[1, 1:3]] == [2023, 2024] and list(synthese.iloc[2, 1:]) == [3, 1, 4]
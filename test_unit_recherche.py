@@ -0,0 +1,53 @@
+import pandas as pd
+from unittest.mock import MagicMock
+import recherche
+from recherche import Recherche
+
+
+def snapshot():
+    return pd.DataFrame({
+        'id': [10, 11, 12, 13],
+        'Ville': ['Vannes', 'Sainte-Anne-d\'Auray', 'Vannes', 'Séné'],
+        'Partenaire': ['Permanence juridique Vannes', '', 'CAF', ''],
+        'Demandes': ['Famille Séparation', 'Pénal Victime', '', 'Famille Union'],
+        'Solutions': ['Info', '', 'Orientation Avocat', ''],
+        'origine': ['1b', None, '1a', '1b'],
+    })
+
+
+def test_mots_et_requete_sql():
+    assert recherche.mots("Ste-Anne, PÉNAL  ") == ['ste', 'anne', 'penal']
+    sql, params = recherche.requete_sql("Vann famille")
+    assert params['requete'] == "vann:* & famille:*" and params['num'] is None
+    assert "<%%" not in sql and "ts_rank" in sql
+    sql, params = recherche.requete_sql("123", trigrammes=True, limite=15, decalage=30)
+    assert params['num'] == 123 and (params['limite'], params['decalage']) == (15, 30)
+    assert "%(texte)s <%% r.document" in sql
+
+
+def test_recherche_en_memoire_prefixes_et_classement():
+    r = Recherche(snapshot())
+    res = r.rechercher("vann")
+    assert res.source == "snapshot" and res.nums == [10, 12] and res.total == 2  # 2 occurrences pour 10
+    assert r.rechercher("famille").nums == [10, 13]
+    assert r.rechercher("famille sene").nums == [13]   # Tous les mots requis, accents ignorés
+    assert r.rechercher("internet").nums == [10, 13]   # Libellé de l'origine
+    assert r.rechercher("12").nums == [12]             # Numéro de dossier
+    assert r.rechercher("vannes", limite=1, decalage=1).nums == [12]
+    assert r.rechercher("  ").total == 0
+
+
+def test_recherche_en_base_puis_repli():
+    conn = MagicMock()
+    cur = conn.cursor.return_value
+    cur.fetchone.return_value = (False,)
+    cur.fetchall.return_value = [(12, 0.5, 7), (10, 0.2, 7)]
+    r = Recherche(snapshot(), lambda: conn)
+    res = r.rechercher("Vannes")
+    assert (res.nums, res.total, res.source) == ([12, 10], 7, "base")
+    r.rechercher("vannes")  # Même recherche normalisée : servie par le cache
+    assert cur.execute.call_count == 2  # Détection pg_trgm + recherche
+
+    cur.execute.side_effect = Exception("relation recherche_entretien does not exist")
+    assert r.rechercher("famille").source == "snapshot"
+    conn.rollback.assert_called()
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from unittest.mock import MagicMock
+import series
+from series import Series
+
+
+def snapshot():
+    return pd.DataFrame({
+        'date_ent': pd.to_datetime(['2023-01-02', '2023-01-04', '2023-03-15', '2024-01-10', None]),
+        'mode': [1, 2, 1, 1, 1],
+        'Partenaire': ['CAF ', 'CAF', '', 'Mairie', 'CAF'],
+        'code_c': [7.0, np.nan, 7.0, 3.0, 7.0],
+    })
+
+
+def test_libelles_periode():
+    dates = pd.Series(pd.to_datetime(['2023-01-31', None, '2024-12-01']))
+    assert list(series.libelles_annee(dates)) == ['2023', 'Inconnue', '2024']
+    assert list(series.libelles_mois(dates)) == ['2023-01', None, '2024-12']
+    assert list(series.debut_periode(dates, 'S').dt.strftime('%Y-%m-%d').fillna('')) == ['2023-01-30', '', '2024-11-25']
+
+
+def test_depuis_snapshot_meme_codage_que_le_trigger():
+    s = series.depuis_snapshot(snapshot(), 'M', 'commune')
+    assert s.to_dict('list') == {
+        'periode': list(pd.to_datetime(['2023-01-01', '2023-01-01', '2023-03-01', '2024-01-01'])),
+        'valeur': ['', '7', '7', '3'], 'nombre': [1, 1, 1, 1]}
+    assert set(series.depuis_snapshot(snapshot(), 'J', 'partenaire')['valeur']) == {'CAF', '', 'Mairie'}
+    assert series.depuis_snapshot(snapshot(), 'S', 'total')['nombre'].sum() == 4
+
+
+def test_tableau_moyenne_et_glissement():
+    s = series.depuis_snapshot(snapshot(), 'M', 'mode')
+    large = series.tableau(s, 'M', {'1': 'RDV', '2': 'Sans RDV'}, top=1)
+    assert list(large.columns) == ['RDV', series.LIB_AUTRES]
+    assert len(large) == 13 and large.sum().sum() == 4  # Mois sans entretien à 0
+    assert series.moyenne_mobile(large, 3)['RDV'].iloc[2] == 2 / 3
+    g = series.glissement_annuel(large, 'M')
+    assert g[g['Annee'] == '2024'][['Rang', 'Nombre']].values.tolist() == [[1, 1]]
+
+
+def test_series_lues_en_base_puis_en_cache():
+    conn = MagicMock()
+    conn.cursor.return_value.fetchall.return_value = [(pd.Timestamp('2023-01-01').date(), '', 5)]
+    s = Series(snapshot(), lambda: conn)
+    assert s.serie('M', 'total')['nombre'].tolist() == [5]
+    s.serie('M', 'total')
+    assert conn.cursor.return_value.execute.call_count == 1
+    conn.close.assert_called_once()
+
+    # Table absente : repli sur le snapshot
+    conn.cursor.return_value.execute.side_effect = Exception("relation serie_entretien does not exist")
+    assert s.serie('M', 'mode')['nombre'].sum() == 4
+    conn.rollback.assert_called()
+
+
+def test_glissement_hebdomadaire_annee_iso():
+    """Semaine 1 de 2025 commencée le 30/12/2024 : rattachée à 2025, pas à la semaine 1 de 2024."""
+    df = pd.DataFrame({'date_ent': pd.to_datetime(['2024-01-03', '2024-12-31', '2025-01-02', '2021-01-02'])})
+    large = series.tableau(series.depuis_snapshot(df, 'S', 'total'), 'S', {'': 'Total'})
+    g = series.glissement_annuel(large, 'S')
+    g = g[g['Nombre'] > 0]
+    assert g[['Annee', 'Rang', 'Nombre']].values.tolist() == [['2020', 53, 1], ['2024', 1, 1], ['2025', 1, 2]]
+    assert list(series.annee_periode(pd.to_datetime(['2024-12-30', '2021-01-02']), 'M')) == [2024, 2021]